@@ -11,5 +11,8 @@ setup(
         'requests>=2.3.0',
         'six>=1.10.0',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     license='LICENSE.txt',
     packages=['spotipy'])
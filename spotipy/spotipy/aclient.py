@@ -0,0 +1,408 @@
+# coding: utf-8
+
+""" asyncio counterpart of the Spotify client
+"""
+
+import asyncio
+import collections
+import inspect
+import itertools
+import json
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .client import Spotify, SpotifyChunkError, SpotifyException, \
+    _chunks, _merge_chunks, _paging_object, _retry_after
+
+
+async def _resolve(result):
+    """ Awaits the result if it's awaitable (methods returning early don't
+        return a coroutine)
+    """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def _query_params(params):
+    """ aiohttp neither drops None nor converts numbers like requests does
+    """
+    return {key: value if isinstance(value, str) else str(value)
+            for key, value in (params or {}).items() if value is not None}
+
+
+# Errors of a chunk which don't stop the other chunks
+_chunk_errors = (SpotifyException, asyncio.TimeoutError)
+if aiohttp is not None:
+    _chunk_errors += (aiohttp.ClientError,)
+
+
+class _AsyncSingleFlight(object):
+    """ Coalesces identical, concurrent GETs of one event loop
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key, function):
+        if self.ttl > 0:
+            self._purge(time.monotonic())
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            return await asyncio.shield(call[0])
+
+        # The call runs in its own task, so cancelling the first caller
+        # doesn't cancel the others
+        task = asyncio.ensure_future(function())
+        self._calls[key] = (task, None)
+        self.executed += 1
+        task.add_done_callback(lambda task: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key, (None,))[0] is not task:
+            return
+        # Nobody might be waiting for it
+        failed = task.cancelled() or task.exception() is not None
+        if self.ttl > 0 and not failed:
+            self._calls[key] = (task, time.monotonic())
+        else:
+            del self._calls[key]
+
+    def _purge(self, now):
+        expired = [key for key, (task, done_at) in self._calls.items()
+                   if done_at is not None and now - done_at >= self.ttl]
+        for key in expired:
+            del self._calls[key]
+
+    def stats(self):
+        return {'executed': self.executed, 'shared': self.shared}
+
+
+class AsyncSpotify(Spotify):
+    """
+        Same as Spotify, but every API method is a coroutine::
+
+            import spotipy.aclient
+
+            async def main():
+                async with spotipy.aclient.AsyncSpotify(auth=token) as sp:
+                    tracks = await asyncio.gather(sp.track(uri1), sp.track(uri2))
+
+        Requires aiohttp. The auth managers are the same as Spotify's; they
+        are blocking, so they are called in the loop's default executor.
+    """
+
+    def __init__(self, auth=None, client_credentials_manager=None,
+        proxies=None, requests_timeout=None, pool_maxsize=10,
+        keep_alive=True, retry_deadline=None, coalesce_requests=False,
+        coalesce_ttl=0, response_cache=None, chunk_concurrency=1):
+        """
+        Create an asyncio Spotify API object. The parameters are the same
+        as Spotify's
+
+        :param pool_maxsize:
+            Maximum number of connections kept open (all hosts)
+        """
+        super(AsyncSpotify, self).__init__(
+            auth=auth, requests_session=False,
+            client_credentials_manager=client_credentials_manager,
+            proxies=proxies, requests_timeout=requests_timeout,
+            keep_alive=keep_alive, retry_deadline=retry_deadline,
+            coalesce_requests=coalesce_requests, coalesce_ttl=coalesce_ttl,
+            response_cache=response_cache, chunk_concurrency=chunk_concurrency)
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+        if coalesce_requests:
+            self._single_flight = _AsyncSingleFlight(coalesce_ttl)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Closes the connections
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _client_session(self):
+        if self._session is None:
+            if aiohttp is None:
+                raise ImportError('AsyncSpotify requires aiohttp')
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                             force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _request(self, method, url, headers, params, data):
+        """ Does the HTTP request. Returns status, headers and body
+        """
+        proxy = None
+        if self.proxies:
+            proxy = self.proxies.get('https') or self.proxies.get('http')
+        timeout = aiohttp.ClientTimeout(total=self.requests_timeout)
+
+        async with self._client_session().request(
+                method, url, headers=headers, params=params, data=data,
+                proxy=proxy, timeout=timeout) as r:
+            return r.status, r.headers, await r.text()
+
+    async def _async_auth_headers(self):
+        if self._auth or not self.client_credentials_manager:
+            return self._auth_headers()
+        # Getting the token may mean refreshing it (blocking)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._auth_headers)
+
+    async def _internal_call(self, method, url, payload, params, deadline=None):
+        if not url.startswith('http'):
+            url = self.prefix + url
+
+        cache_key = self._cache_key(method, url, params)
+        cached = self._cached_response(cache_key)
+        if cached and cached['expires'] > time.time():
+            self.response_cache.count('hits')
+            return cached['body']
+
+        blocked_for = self.rate_limiter.blocked_for()
+        if not self.rate_limiter.reserve(blocked_for, deadline, retry=False):
+            raise SpotifyException(429, -1,
+                '%s:\n rate limited for another %.1f seconds' % (url, blocked_for),
+                headers={'Retry-After': str(int(blocked_for) + 1)})
+        if blocked_for > 0:
+            await asyncio.sleep(blocked_for)
+
+        headers = await self._async_auth_headers()
+        headers['Content-Type'] = 'application/json'
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+
+        data = json.dumps(payload) if payload else None
+        if self.trace_out:
+            print(url)
+        status, response_headers, text = await self._request(
+            method, url, headers, _query_params(params), data)
+
+        if self.trace:  # pragma: no cover
+            print()
+            print('headers', headers)
+            print('http status', status)
+            print(method, url)
+
+        if status == 429:
+            self.rate_limiter.throttle(
+                _retry_after(response_headers, self.rate_limiter.backoff(1)))
+
+        if status == 304 and cached:
+            return self._revalidated(cache_key, cached, response_headers)
+
+        has_body = text and text != 'null'
+        if status >= 400:
+            message = 'error'
+            if has_body:
+                try:
+                    message = json.loads(text)['error']['message']
+                except (ValueError, KeyError, TypeError):
+                    pass
+            raise SpotifyException(status, -1, '%s:\n %s' % (url, message),
+                                   headers=response_headers)
+
+        results = json.loads(text) if has_body else None
+        self._store_response(cache_key, results, response_headers)
+        return results
+
+    async def _get(self, url, args=None, payload=None, **kwargs):
+        if args:
+            kwargs.update(args)
+
+        key = self._coalesce_key(url, payload, kwargs)
+        if key is not None:
+            return await self._single_flight.do(
+                key, lambda: self._get_retrying(url, payload, kwargs))
+
+        return await self._get_retrying(url, payload, kwargs)
+
+    async def _get_retrying(self, url, payload, kwargs):
+        deadline = None
+        if self.retry_deadline is not None:
+            deadline = time.monotonic() + self.retry_deadline
+
+        attempt = 0
+        while True:
+            try:
+                return await self._internal_call('GET', url, payload, kwargs,
+                                                 deadline=deadline)
+            except SpotifyException as e:
+                attempt += 1
+                status = e.http_status
+                if status == 429:
+                    if attempt >= self.max_get_retries:
+                        raise
+                    if deadline is not None and \
+                            time.monotonic() + self.rate_limiter.blocked_for() > deadline:
+                        raise
+                elif status >= 500 and status < 600:
+                    if attempt >= self.max_get_retries:
+                        raise
+                    sleep_seconds = self.rate_limiter.backoff(attempt)
+                    if not self.rate_limiter.reserve(sleep_seconds, deadline):
+                        raise
+                    await asyncio.sleep(sleep_seconds)
+                else:
+                    raise
+
+    async def _post(self, url, args=None, payload=None, **kwargs):
+        if args:
+            kwargs.update(args)
+        return await self._internal_call('POST', url, payload, kwargs)
+
+    async def _delete(self, url, args=None, payload=None, **kwargs):
+        if args:
+            kwargs.update(args)
+        return await self._internal_call('DELETE', url, payload, kwargs)
+
+    async def _put(self, url, args=None, payload=None, **kwargs):
+        if args:
+            kwargs.update(args)
+        return await self._internal_call('PUT', url, payload, kwargs)
+
+    # Bulk requests
+
+    async def _bulk_get(self, key, chunks, request):
+        if len(chunks) == 1:
+            return await request(chunks[0])
+
+        semaphore = asyncio.Semaphore(max(1, self.chunk_concurrency))
+
+        async def call(chunk):
+            async with semaphore:
+                return await request(chunk)
+
+        results = await asyncio.gather(*[call(chunk) for chunk in chunks],
+                                       return_exceptions=True)
+        failures = []
+        for index, result in enumerate(results):
+            if isinstance(result, _chunk_errors):
+                failures.append((index, result))
+                results[index] = None
+            elif isinstance(result, BaseException):
+                raise result
+        return _merge_chunks(key, chunks, results, failures)
+
+    async def _bulk_change(self, chunks, request):
+        result = None
+        for index, chunk in enumerate(chunks):
+            try:
+                result = await request(index, chunk, result)
+            except _chunk_errors as e:
+                if len(chunks) == 1:
+                    raise
+                unsent = [item for later in chunks[index + 1:] for item in later]
+                raise SpotifyChunkError(result, [(chunk, e)], unsent)
+        return result
+
+    # Methods which may return without calling the API
+
+    async def next(self, result):
+        return await _resolve(super(AsyncSpotify, self).next(result))
+
+    async def previous(self, result):
+        return await _resolve(super(AsyncSpotify, self).previous(result))
+
+    async def repeat(self, state, device_id=None):
+        return await _resolve(super(AsyncSpotify, self).repeat(state, device_id))
+
+    async def volume(self, volume_percent, device_id=None):
+        return await _resolve(super(AsyncSpotify, self).volume(volume_percent, device_id))
+
+    async def shuffle(self, state, device_id=None):
+        return await _resolve(super(AsyncSpotify, self).shuffle(state, device_id))
+
+    async def start_playback(self, device_id=None, context_uri=None, uris=None, offset=None):
+        return await _resolve(super(AsyncSpotify, self).start_playback(
+            device_id, context_uri, uris, offset))
+
+    async def seek_track(self, position_ms, device_id=None):
+        return await _resolve(super(AsyncSpotify, self).seek_track(position_ms, device_id))
+
+    # Paging
+
+    async def iter_pages(self, result, prefetch=True, concurrency=1):
+        """ Same as Spotify.iter_pages, but an async generator::
+
+                async for page in sp.iter_pages(await sp.current_user_saved_tracks()):
+                    ...
+        """
+        page = _paging_object(result)
+        if not page:
+            return
+
+        urls = self._page_urls(page) if concurrency > 1 else None
+        pending = collections.deque()
+        try:
+            if urls is not None:
+                for url in itertools.islice(urls, concurrency):
+                    pending.append(asyncio.ensure_future(self._get_page(url)))
+                yield page
+                while pending:
+                    page = await pending.popleft()
+                    url = next(urls, None)
+                    if url is not None:
+                        pending.append(asyncio.ensure_future(self._get_page(url)))
+                    yield page
+            else:
+                while page:
+                    next_url = page.get('next')
+                    if next_url and prefetch:
+                        pending.append(asyncio.ensure_future(self._get_page(next_url)))
+                    yield page
+                    if pending:
+                        page = await pending.popleft()
+                    else:
+                        page = await self._get_page(next_url) if next_url else None
+        finally:
+            # The caller may stop early
+            for task in pending:
+                task.cancel()
+
+    async def iter_items(self, result, prefetch=True, concurrency=1):
+        """ Same as Spotify.iter_items, but an async generator
+        """
+        async for page in self.iter_pages(result, prefetch, concurrency):
+            for item in page['items']:
+                yield item
+
+    async def _get_page(self, url):
+        return _paging_object(await self._get(url))
+
+    # Methods post-processing the response
+
+    async def audio_features(self, tracks=[]):
+        """ Get audio features for one or multiple tracks based upon their Spotify IDs
+            Parameters:
+                - tracks - a list of track URIs, URLs or IDs. More than
+                  audio_features_limit are fetched in several requests
+        """
+        if isinstance(tracks, str):
+            tlist = [self._get_id('track', tracks)]
+        else:
+            tlist = [self._get_id('track', t) for t in tracks]
+        results = await self._bulk_get(
+            'audio_features', _chunks(tlist, self.audio_features_limit),
+            lambda chunk: self._get('audio-features/?ids=' + ','.join(chunk)))
+        if 'audio_features' in results:
+            return results['audio_features']
+        else:
+            return results
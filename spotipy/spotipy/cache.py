@@ -0,0 +1,176 @@
+# coding: utf-8
+
+""" Response caches for Spotify GET requests
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+_max_age_re = re.compile(r'max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def cache_entry(body, headers, now=None):
+    """ Builds a cache entry from a response. Returns None if the response
+        must not be cached
+
+        Parameters:
+            - body - the parsed response
+            - headers - the response headers
+            - now - time.time() of the response (default: now)
+    """
+    cache_control = headers.get('Cache-Control', '') or ''
+    if 'no-store' in cache_control.lower():
+        return None
+
+    etag = headers.get('ETag')
+    max_age = 0
+    if 'no-cache' not in cache_control.lower():
+        match = _max_age_re.search(cache_control)
+        if match:
+            max_age = int(match.group(1))
+
+    if not etag and max_age <= 0:
+        return None
+
+    if now is None:
+        now = time.time()
+    return {'body': body, 'etag': etag, 'expires': now + max_age}
+
+
+class ResponseCache(object):
+    """
+        Base class of the response caches. Keeps the counters, subclasses
+        implement _load and _store.
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, key):
+        """ Returns the entry for the key or None
+
+            Parameters:
+                - key - the cache key
+        """
+        return self._load(key)
+
+    def set(self, key, entry):
+        """ Stores an entry
+
+            Parameters:
+                - key - the cache key
+                - entry - dict with body, etag and expires
+        """
+        self._store(key, entry)
+
+    def count(self, counter):
+        """ Increments one of the counters (hits, misses, revalidations)
+        """
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """ Returns the counters
+        """
+        with self._stats_lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'revalidations': self.revalidations}
+
+    def _load(self, key):
+        raise NotImplementedError()
+
+    def _store(self, key, entry):
+        raise NotImplementedError()
+
+
+class MemoryCache(ResponseCache):
+    """
+        Keeps up to maxsize responses in memory, evicting the least
+        recently used ones. The bodies are copied, so callers modifying
+        a result don't change the cached one.
+    """
+
+    def __init__(self, maxsize=1000):
+        """
+            Parameters:
+                - maxsize - the maximum number of responses
+        """
+        super(MemoryCache, self).__init__()
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(entry)
+
+    def _store(self, key, entry):
+        entry = copy.deepcopy(entry)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class DiskCache(ResponseCache):
+    """
+        Keeps the responses as files in a directory, so they survive
+        restarts.
+    """
+
+    def __init__(self, directory):
+        """
+            Parameters:
+                - directory - the directory. Will be created if it doesn't
+                  exist
+        """
+        super(DiskCache, self).__init__()
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # Different keys may (theoretically) end up in the same file
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def _store(self, key, entry):
+        entry = dict(entry, key=key)
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(temp_name, self._path(key))
+        except Exception:
+            os.unlink(temp_name)
+            raise
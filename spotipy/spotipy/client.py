@@ -2,12 +2,21 @@
 
 
 from __future__ import print_function
+import collections
+import concurrent.futures
+import itertools
 import sys
+import threading
 import requests
+import requests.adapters
 import json
 import time
 
 import six
+import six.moves.urllib.parse as urllibparse
+
+from . import cache
+from .ratelimit import RateLimiter
 
 """ A simple and thin Python library for the Spotify Web API
 """
@@ -29,6 +38,226 @@ class SpotifyException(Exception):
             self.http_status, self.code, self.msg)
 
 
+class SpotifyChunkError(SpotifyException):
+    """ Some of the requests of a bulk call (split into chunks because of
+        the API's limits) failed.
+
+        - result - the merged result of the other chunks. The objects of
+          the failed chunks are None. For playlist changes the response of
+          the last successful chunk
+        - failures - list of (chunk, exception)
+        - unsent - the items not sent at all (playlist changes stop at the
+          first failed chunk)
+    """
+
+    def __init__(self, result, failures, unsent=None):
+        first = failures[0][1]
+        super(SpotifyChunkError, self).__init__(
+            getattr(first, 'http_status', -1), getattr(first, 'code', -1),
+            '%d of the chunks failed, first error: %s' % (len(failures), first),
+            headers=getattr(first, 'headers', None))
+        self.result = result
+        self.failures = failures
+        self.unsent = unsent or []
+
+
+# Errors of a chunk which don't stop the other chunks
+_chunk_errors = (SpotifyException, requests.exceptions.RequestException)
+
+
+def _snapshot_id(previous, snapshot_id):
+    """ The snapshot the next chunk of a playlist change refers to: the
+        one returned by the previous chunk, if any
+    """
+    if previous and previous.get('snapshot_id'):
+        return previous['snapshot_id']
+    return snapshot_id
+
+
+def _chunks(items, size):
+    """ Splits items into lists of at most size items (at least one list)
+    """
+    return [items[start:start + size]
+            for start in range(0, len(items), size)] or [items]
+
+
+def _merge_chunks(key, chunks, results, failures):
+    """ Merges the object lists of the responses of a bulk GET. Raises
+        SpotifyChunkError if some of the chunks failed
+
+        Parameters:
+            - key - the key of the list in the responses, e.g. 'tracks'
+            - chunks - the chunks
+            - results - the responses, None for the failed chunks
+            - failures - list of (chunk index, exception)
+    """
+    merged = []
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            merged.extend([None] * len(chunk))
+        elif isinstance(result, dict):
+            merged.extend(result[key])
+        else:
+            merged.extend(result)
+    merged = {key: merged}
+
+    if failures:
+        failures = sorted(failures, key=lambda failure: failure[0])
+        raise SpotifyChunkError(
+            merged, [(chunks[index], e) for index, e in failures])
+    return merged
+
+
+def _retry_after(headers, default):
+    """ Returns the number of seconds from the Retry-After header, or the
+        default if there's none
+    """
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def _paging_object(result):
+    """ Returns the paging object of a result. Some endpoints (search,
+        followed artists) wrap it, e.g. {'artists': {'items': ...}}
+    """
+    if not result or 'items' in result:
+        return result
+    if len(result) == 1:
+        value = list(result.values())[0]
+        if isinstance(value, dict) and 'items' in value:
+            return value
+    return result
+
+
+class _PoolingAdapter(requests.adapters.HTTPAdapter):
+    """ A HTTPAdapter keeping track of whether a request went over a fresh
+        or over a reused (kept alive) connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_PoolingAdapter, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def send(self, request, **kwargs):
+        response = super(_PoolingAdapter, self).send(request, **kwargs)
+
+        # The body hasn't been read yet, so the urllib3 response still
+        # holds the connection. A connection is only used by one request
+        # at a time, so tagging it is safe without locking.
+        connection = getattr(response.raw, '_connection', None)
+        reused = None
+        if connection is not None:
+            reused = getattr(connection, '_spotipy_used', False)
+            connection._spotipy_used = True
+        response.connection_reused = reused
+
+        with self._stats_lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            elif reused is not None:
+                self.new_connections += 1
+        return response
+
+    def stats(self):
+        with self._stats_lock:
+            return {'requests': self.requests,
+                    'new_connections': self.new_connections,
+                    'reused_connections': self.reused_connections}
+
+
+def pooled_session(pool_connections=10, pool_maxsize=10):
+    """ Creates a requests session which keeps the connections open. It can
+        be shared by a Spotify client and the oauth2 managers, so token
+        requests reuse connections too
+
+        Parameters:
+            - pool_connections - number of hosts to keep connection pools for
+            - pool_maxsize - maximum number of connections kept alive per host
+    """
+    session = requests.Session()
+    adapter = _PoolingAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class _Call(object):
+    """ A GET which is (or has been) in flight
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.done_at = None
+
+
+class _SingleFlight(object):
+    """ Coalesces identical, concurrent calls: The first caller executes
+        the call, the others wait for it and share the result. With a ttl,
+        the result is also handed out to callers arriving shortly after.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, function):
+        with self._lock:
+            now = time.monotonic()
+            if self.ttl > 0:
+                self._purge(now)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.done_at = time.monotonic()
+                # Only successful results are kept for the ttl
+                if self.ttl <= 0 or call.error is not None:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+            call.event.set()
+
+    def _purge(self, now):
+        expired = [key for key, call in self._calls.items()
+                   if call.done_at is not None and now - call.done_at >= self.ttl]
+        for key in expired:
+            del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared}
+
+
 class Spotify(object):
     """
         Example usage::
@@ -52,8 +281,26 @@ class Spotify(object):
     trace_out = False
     max_get_retries = 10
 
+    # Shared by all Spotify objects, so a 429 holds back every caller
+    rate_limiter = RateLimiter()
+
+    # GETs of these (catalog) endpoints are kept in the response cache
+    cacheable_paths = ('tracks', 'albums', 'artists', 'audio-features',
+                       'audio-analysis', 'playlists/', 'users/')
+
+    # Maximum number of IDs per request of the bulk endpoints. Longer lists
+    # are split into several requests
+    tracks_limit = 50
+    artists_limit = 50
+    albums_limit = 20
+    audio_features_limit = 100
+    playlist_tracks_limit = 100
+
     def __init__(self, auth=None, requests_session=True,
-        client_credentials_manager=None, proxies=None, requests_timeout=None):
+        client_credentials_manager=None, proxies=None, requests_timeout=None,
+        pool_connections=10, pool_maxsize=10, keep_alive=True,
+        retry_deadline=None, coalesce_requests=False, coalesce_ttl=0,
+        response_cache=None, chunk_concurrency=1):
         """
         Create a Spotify API object.
 
@@ -62,29 +309,152 @@ class Spotify(object):
             A Requests session object or a truthy value to create one.
             A falsy value disables sessions.
             It should generally be a good idea to keep sessions enabled
-            for performance reasons (connection pooling).
+            for performance reasons (connection pooling). See pooled_session
+            for sharing one with the oauth2 managers.
         :param client_credentials_manager:
             SpotifyClientCredentials object
         :param proxies:
             Definition of proxies (optional)
         :param requests_timeout:
             Tell Requests to stop waiting for a response after a given number of seconds
+        :param pool_connections:
+            Number of hosts to keep connection pools for (only used if the
+            session is created by this object)
+        :param pool_maxsize:
+            Maximum number of connections kept alive per host (only used if
+            the session is created by this object)
+        :param keep_alive:
+            Keep connections open between calls. If false, the connections
+            are closed after every call
+        :param retry_deadline:
+            Maximum number of seconds a GET may spend waiting for the rate
+            limit and retrying. None waits as long as necessary
+        :param coalesce_requests:
+            Concurrent identical GETs share a single request and its
+            result. Off by default: the callers get the same result
+            object, so it must not be modified
+        :param coalesce_ttl:
+            Number of seconds the result of a GET is also handed out to
+            identical GETs issued after it has completed (0 = only to
+            concurrent ones)
+        :param response_cache:
+            A cache.MemoryCache or cache.DiskCache object (optional).
+            Responses of catalog endpoints are kept in it according to
+            their Cache-Control header and revalidated using their ETag
+        :param chunk_concurrency:
+            Number of requests sent at the same time when a bulk GET (e.g.
+            tracks) has to be split because of the API's limits. Playlist
+            changes are always sent one after the other
         """
         self.prefix = 'https://api.spotify.com/v1/'
         self._auth = auth
         self.client_credentials_manager = client_credentials_manager
         self.proxies = proxies
         self.requests_timeout = requests_timeout
+        self.keep_alive = keep_alive
+        self.retry_deadline = retry_deadline
+        self._adapter = None
+        self.response_cache = response_cache
+        self.chunk_concurrency = chunk_concurrency
+        self._single_flight = None
+        if coalesce_requests:
+            self._single_flight = _SingleFlight(coalesce_ttl)
 
         if isinstance(requests_session, requests.Session):
             self._session = requests_session
         else:
             if requests_session:  # Build a new session.
-                self._session = requests.Session()
+                self._session = pooled_session(pool_connections, pool_maxsize)
             else:  # Use the Requests API module as a "session".
                 from requests import api
                 self._session = api
 
+        if isinstance(self._session, requests.Session):
+            adapter = self._session.get_adapter(self.prefix)
+            if isinstance(adapter, _PoolingAdapter):
+                self._adapter = adapter
+
+    def connection_stats(self):
+        """ Returns the number of requests and how many of them went over
+            a new or a reused connection. Only available if the session
+            has been created by this object or by pooled_session (then the
+            requests of the others sharing it are counted too), otherwise
+            None
+        """
+        if self._adapter:
+            return self._adapter.stats()
+        return None
+
+    def coalesce_stats(self):
+        """ Returns the number of GETs executed and the number of GETs which
+            shared the result of another one. None if coalescing is off
+        """
+        if self._single_flight:
+            return self._single_flight.stats()
+        return None
+
+    def cache_stats(self):
+        """ Returns the hits, misses and revalidations of the response
+            cache. None if there's no cache
+        """
+        if self.response_cache is not None:
+            return self.response_cache.stats()
+        return None
+
+    def _cache_key(self, method, url, params):
+        """ Returns the key of the response in the response cache or None
+            if it must not be cached
+        """
+        if method != 'GET' or self.response_cache is None:
+            return None
+        path = url[len(self.prefix):] if url.startswith(self.prefix) else url
+        if not path.startswith(self.cacheable_paths):
+            return None
+        query = sorted((key, value) for key, value in (params or {}).items()
+                       if value is not None)
+        return url + '?' + six.moves.urllib.parse.urlencode(query)
+
+    def _cached_response(self, cache_key):
+        """ Returns the cached response (fresh or stale) or None
+        """
+        if cache_key:
+            return self.response_cache.get(cache_key)
+        return None
+
+    def _revalidated(self, cache_key, cached, headers):
+        """ Handles a 304 Not Modified: the cached body is still valid,
+            only its headers are new. Returns the body
+        """
+        self.response_cache.count('revalidations')
+        headers = requests.structures.CaseInsensitiveDict(headers)
+        headers.setdefault('ETag', cached['etag'])
+        entry = cache.cache_entry(cached['body'], headers)
+        if entry:
+            self.response_cache.set(cache_key, entry)
+        return cached['body']
+
+    def _store_response(self, cache_key, results, headers):
+        """ Keeps the response in the cache (if it may be cached)
+        """
+        if cache_key:
+            self.response_cache.count('misses')
+            entry = cache.cache_entry(results, headers)
+            if entry:
+                self.response_cache.set(cache_key, entry)
+
+    def _coalesce_key(self, url, payload, params):
+        """ Returns the key identical GETs share or None if the GET
+            must not be coalesced
+        """
+        if not self._single_flight or payload:
+            return None
+        key = (url, tuple(sorted(params.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def _auth_headers(self):
         if self._auth:
             return {'Authorization': 'Bearer {0}'.format(self._auth)}
@@ -94,13 +464,28 @@ class Spotify(object):
         else:
             return {}
 
-    def _internal_call(self, method, url, payload, params):
-        args = dict(params=params)
-        args["timeout"] = self.requests_timeout
+    def _internal_call(self, method, url, payload, params, deadline=None):
         if not url.startswith('http'):
             url = self.prefix + url
+
+        cache_key = self._cache_key(method, url, params)
+        cached = self._cached_response(cache_key)
+        if cached and cached['expires'] > time.time():
+            self.response_cache.count('hits')
+            return cached['body']
+
+        if not self.rate_limiter.wait(deadline):
+            retry_after = self.rate_limiter.blocked_for()
+            raise SpotifyException(429, -1,
+                '%s:\n rate limited for another %.1f seconds' % (url, retry_after),
+                headers={'Retry-After': str(int(retry_after) + 1)})
+
+        args = dict(params=params)
+        args["timeout"] = self.requests_timeout
         headers = self._auth_headers()
         headers['Content-Type'] = 'application/json'
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
 
         if payload:
             args["data"] = json.dumps(payload)
@@ -113,10 +498,20 @@ class Spotify(object):
             print()
             print ('headers', headers)
             print ('http status', r.status_code)
+            print ('connection reused', getattr(r, 'connection_reused', None))
             print(method, r.url)
             if payload:
                 print("DATA", json.dumps(payload))
 
+        if r.status_code == 429:
+            self.rate_limiter.throttle(
+                _retry_after(r.headers, self.rate_limiter.backoff(1)))
+
+        if r.status_code == 304 and cached:
+            if not self.keep_alive:
+                r.connection.close()
+            return self._revalidated(cache_key, cached, r.headers)
+
         try:
             r.raise_for_status()
         except:
@@ -128,49 +523,62 @@ class Spotify(object):
                 raise SpotifyException(r.status_code,
                     -1, '%s:\n %s' % (r.url, 'error'), headers=r.headers)
         finally:
-            r.connection.close()
+            if not self.keep_alive:
+                r.connection.close()
         if r.text and len(r.text) > 0 and r.text != 'null':
             results = r.json()
             if self.trace:  # pragma: no cover
                 print('RESP', results)
                 print()
-            return results
         else:
-            return None
+            results = None
+
+        self._store_response(cache_key, results, r.headers)
+        return results
 
     def _get(self, url, args=None, payload=None, **kwargs):
         if args:
             kwargs.update(args)
-        retries = self.max_get_retries
-        delay = 1
-        while retries > 0:
+
+        key = self._coalesce_key(url, payload, kwargs)
+        if key is not None:
+            return self._single_flight.do(
+                key, lambda: self._get_retrying(url, payload, kwargs))
+
+        return self._get_retrying(url, payload, kwargs)
+
+    def _get_retrying(self, url, payload, kwargs):
+        deadline = None
+        if self.retry_deadline is not None:
+            deadline = time.monotonic() + self.retry_deadline
+
+        attempt = 0
+        while True:
             try:
-                return self._internal_call('GET', url, payload, kwargs)
+                return self._internal_call('GET', url, payload, kwargs,
+                                           deadline=deadline)
             except SpotifyException as e:
-                retries -= 1
+                attempt += 1
                 status = e.http_status
-                # 429 means we hit a rate limit, backoff
-                if status == 429 or (status >= 500 and status < 600):
-                    if retries < 0:
+                # 429 means we hit a rate limit. The rate limiter already
+                # knows how long to back off, the next call waits for it
+                if status == 429:
+                    if attempt >= self.max_get_retries:
+                        raise
+                    if deadline is not None and \
+                            time.monotonic() + self.rate_limiter.blocked_for() > deadline:
+                        raise
+                    if self.trace:  # pragma: no cover
+                        print('rate limited, retrying in',
+                              self.rate_limiter.blocked_for(), 'secs')
+                elif status >= 500 and status < 600:
+                    if attempt >= self.max_get_retries:
+                        raise
+                    sleep_seconds = self.rate_limiter.backoff(attempt)
+                    if self.trace:  # pragma: no cover
+                        print('retrying in', sleep_seconds, 'secs')
+                    if not self.rate_limiter.sleep(sleep_seconds, deadline):
                         raise
-                    else:
-                        sleep_seconds = int(e.headers.get('Retry-After', delay))
-                        print ('retrying ...' + str(sleep_seconds) + 'secs')
-                        time.sleep(sleep_seconds + 1)
-                        delay += 1
-                else:
-                    raise
-            except Exception as e:
-                raise
-                print ('exception', str(e))
-                # some other exception. Requests have
-                # been know to throw a BadStatusLine exception
-                retries -= 1
-                if retries >= 0:
-                    sleep_seconds = int(e.headers.get('Retry-After', delay))
-                    print ('retrying ...' + str(delay) + 'secs')
-                    time.sleep(sleep_seconds + 1)
-                    delay += 1
                 else:
                     raise
 
@@ -189,6 +597,56 @@ class Spotify(object):
             kwargs.update(args)
         return self._internal_call('PUT', url, payload, kwargs)
 
+    def _bulk_get(self, key, chunks, request):
+        """ Sends a request per chunk (chunk_concurrency at a time) and
+            merges the responses in order
+
+            Parameters:
+                - key - the key of the object list in the responses
+                - chunks - the chunks of IDs
+                - request - function(chunk) sending the request
+        """
+        if len(chunks) == 1:
+            return request(chunks[0])
+
+        results = [None] * len(chunks)
+        failures = []
+
+        def call(index):
+            try:
+                results[index] = request(chunks[index])
+            except _chunk_errors as e:
+                failures.append((index, e))
+
+        if self.chunk_concurrency > 1:
+            workers = min(self.chunk_concurrency, len(chunks))
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                list(executor.map(call, range(len(chunks))))
+        else:
+            for index in range(len(chunks)):
+                call(index)
+        return _merge_chunks(key, chunks, results, failures)
+
+    def _bulk_change(self, chunks, request):
+        """ Sends a request per chunk, one after the other, and returns
+            the last response. Stops at the first failed chunk
+
+            Parameters:
+                - chunks - the chunks of items
+                - request - function(index, chunk, previous response)
+                  sending the request
+        """
+        result = None
+        for index, chunk in enumerate(chunks):
+            try:
+                result = request(index, chunk, result)
+            except _chunk_errors as e:
+                if len(chunks) == 1:
+                    raise
+                unsent = [item for later in chunks[index + 1:] for item in later]
+                raise SpotifyChunkError(result, [(chunk, e)], unsent)
+        return result
+
     def next(self, result):
         """ returns the next result given a paged result
 
@@ -211,6 +669,101 @@ class Spotify(object):
         else:
             return None
 
+    def iter_pages(self, result, prefetch=True, concurrency=1):
+        """ Generates the paging object of result and those of the pages
+            following it. Only a few pages are held at a time, so long
+            playlists don't fill the memory
+
+                for page in sp.iter_pages(sp.user_playlist_tracks(user, id)):
+                    ...
+
+            Parameters:
+                - result - a previously returned paged result
+                - prefetch - fetch the next page in the background while
+                  the current one is being processed
+                - concurrency - number of pages fetched at the same time.
+                  Only for results paged by offset, results paged by
+                  cursor are fetched one page after the other
+        """
+        page = _paging_object(result)
+        if not page:
+            return
+
+        urls = self._page_urls(page) if concurrency > 1 else None
+        if urls is None and not prefetch:
+            while page:
+                yield page
+                page = self._get_page(page['next']) if page.get('next') else None
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(max(1, concurrency))
+        pending = collections.deque()
+        try:
+            if urls is not None:
+                for url in itertools.islice(urls, concurrency):
+                    pending.append(executor.submit(self._get_page, url))
+                yield page
+                while pending:
+                    page = pending.popleft().result()
+                    url = next(urls, None)
+                    if url is not None:
+                        pending.append(executor.submit(self._get_page, url))
+                    yield page
+            else:
+                while page:
+                    if page.get('next'):
+                        pending.append(executor.submit(self._get_page, page['next']))
+                    yield page
+                    page = pending.popleft().result() if pending else None
+        finally:
+            # The caller may stop early
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_items(self, result, prefetch=True, concurrency=1):
+        """ Generates the items of result and of the pages following it,
+            see iter_pages
+
+                for item in sp.iter_items(sp.current_user_saved_tracks()):
+                    print(item['track']['name'])
+
+            Parameters:
+                - result - a previously returned paged result
+                - prefetch - fetch the next page in the background
+                - concurrency - number of pages fetched at the same time
+        """
+        for page in self.iter_pages(result, prefetch, concurrency):
+            for item in page['items']:
+                yield item
+
+    def _get_page(self, url):
+        return _paging_object(self._get(url))
+
+    def _page_urls(self, page):
+        """ Returns a generator of the URLs of the pages following page,
+            or None if the result isn't paged by offset
+        """
+        next_url = page.get('next')
+        total = page.get('total')
+        limit = page.get('limit')
+        offset = page.get('offset')
+        if not next_url or 'cursors' in page or total is None or not limit or offset is None:
+            return None
+
+        parts = urllibparse.urlsplit(next_url)
+        query = urllibparse.parse_qsl(parts.query, keep_blank_values=True)
+        if 'offset' not in dict(query):
+            return None
+
+        def urls():
+            for page_offset in range(offset + limit, total, limit):
+                page_query = [(key, str(page_offset) if key == 'offset' else value)
+                              for key, value in query]
+                yield urllibparse.urlunsplit(
+                    parts._replace(query=urllibparse.urlencode(page_query)))
+        return urls()
+
     def _warn_old(self, msg):
         print('warning:' + msg, file=sys.stderr)
 
@@ -231,12 +784,14 @@ class Spotify(object):
         """ returns a list of tracks given a list of track IDs, URIs, or URLs
 
             Parameters:
-                - tracks - a list of spotify URIs, URLs or IDs
+                - tracks - a list of spotify URIs, URLs or IDs. More than
+                  tracks_limit are fetched in several requests
                 - market - an ISO 3166-1 alpha-2 country code.
         """
 
         tlist = [self._get_id('track', t) for t in tracks]
-        return self._get('tracks/?ids=' + ','.join(tlist), market = market)
+        return self._bulk_get('tracks', _chunks(tlist, self.tracks_limit),
+            lambda chunk: self._get('tracks/?ids=' + ','.join(chunk), market = market))
 
     def artist(self, artist_id):
         """ returns a single artist given the artist's ID, URI or URL
@@ -252,11 +807,13 @@ class Spotify(object):
         """ returns a list of artists given the artist IDs, URIs, or URLs
 
             Parameters:
-                - artists - a list of  artist IDs, URIs or URLs
+                - artists - a list of  artist IDs, URIs or URLs. More than
+                  artists_limit are fetched in several requests
         """
 
         tlist = [self._get_id('artist', a) for a in artists]
-        return self._get('artists/?ids=' + ','.join(tlist))
+        return self._bulk_get('artists', _chunks(tlist, self.artists_limit),
+            lambda chunk: self._get('artists/?ids=' + ','.join(chunk)))
 
     def artist_albums(self, artist_id, album_type=None, country=None, limit=20,
                       offset=0):
@@ -324,11 +881,13 @@ class Spotify(object):
         """ returns a list of albums given the album IDs, URIs, or URLs
 
             Parameters:
-                - albums - a list of  album IDs, URIs or URLs
+                - albums - a list of  album IDs, URIs or URLs. More than
+                  albums_limit are fetched in several requests
         """
 
         tlist = [self._get_id('album', a) for a in albums]
-        return self._get('albums/?ids=' + ','.join(tlist))
+        return self._bulk_get('albums', _chunks(tlist, self.albums_limit),
+            lambda chunk: self._get('albums/?ids=' + ','.join(chunk)))
 
     def search(self, q, limit=10, offset=0, type='track', market=None):
         """ searches for an item
@@ -456,13 +1015,21 @@ class Spotify(object):
             Parameters:
                 - user - the id of the user
                 - playlist_id - the id of the playlist
-                - tracks - a list of track URIs, URLs or IDs
+                - tracks - a list of track URIs, URLs or IDs. More than
+                  playlist_tracks_limit are added in several requests
                 - position - the position to add the tracks
         """
         plid = self._get_id('playlist', playlist_id)
         ftracks = [self._get_uri('track', tid) for tid in tracks]
-        return self._post("users/%s/playlists/%s/tracks" % (user, plid),
-                          payload=ftracks, position=position)
+        limit = self.playlist_tracks_limit
+
+        def add(index, chunk, previous):
+            chunk_position = position
+            if position is not None:
+                chunk_position = position + index * limit
+            return self._post("users/%s/playlists/%s/tracks" % (user, plid),
+                              payload=chunk, position=chunk_position)
+        return self._bulk_change(_chunks(ftracks, limit), add)
 
     def user_playlist_replace_tracks(self, user, playlist_id, tracks):
         """ Replace all tracks in a playlist
@@ -470,13 +1037,21 @@ class Spotify(object):
             Parameters:
                 - user - the id of the user
                 - playlist_id - the id of the playlist
-                - tracks - the list of track ids to add to the playlist
+                - tracks - the list of track ids to add to the playlist.
+                  More than playlist_tracks_limit are added in several
+                  requests
         """
         plid = self._get_id('playlist', playlist_id)
         ftracks = [self._get_uri('track', tid) for tid in tracks]
-        payload = {"uris": ftracks}
-        return self._put("users/%s/playlists/%s/tracks" % (user, plid),
-                         payload=payload)
+
+        def replace(index, chunk, previous):
+            # The first chunk replaces the tracks, the others are appended
+            if index == 0:
+                return self._put("users/%s/playlists/%s/tracks" % (user, plid),
+                                 payload={"uris": chunk})
+            return self._post("users/%s/playlists/%s/tracks" % (user, plid),
+                              payload=chunk)
+        return self._bulk_change(_chunks(ftracks, self.playlist_tracks_limit), replace)
 
     def user_playlist_reorder_tracks(
             self, user, playlist_id, range_start, insert_before,
@@ -507,18 +1082,23 @@ class Spotify(object):
             Parameters:
                 - user - the id of the user
                 - playlist_id - the id of the playlist
-                - tracks - the list of track ids to add to the playlist
+                - tracks - the list of track ids to add to the playlist.
+                  More than playlist_tracks_limit are removed in several
+                  requests
                 - snapshot_id - optional id of the playlist snapshot
 
         """
 
         plid = self._get_id('playlist', playlist_id)
         ftracks = [self._get_uri('track', tid) for tid in tracks]
-        payload = {"tracks": [{"uri": track} for track in ftracks]}
-        if snapshot_id:
-            payload["snapshot_id"] = snapshot_id
-        return self._delete("users/%s/playlists/%s/tracks" % (user, plid),
-                            payload=payload)
+
+        def remove(index, chunk, previous):
+            payload = {"tracks": [{"uri": track} for track in chunk]}
+            if snapshot_id:
+                payload["snapshot_id"] = _snapshot_id(previous, snapshot_id)
+            return self._delete("users/%s/playlists/%s/tracks" % (user, plid),
+                                payload=payload)
+        return self._bulk_change(_chunks(ftracks, self.playlist_tracks_limit), remove)
 
     def user_playlist_remove_specific_occurrences_of_tracks(
             self, user, playlist_id, tracks, snapshot_id=None):
@@ -530,6 +1110,8 @@ class Spotify(object):
                 - tracks - an array of objects containing Spotify URIs of the tracks to remove with their current positions in the playlist.  For example:
                     [  { "uri":"4iV5W9uYEdYUVa79Axb7Rh", "positions":[2] },
                        { "uri":"1301WleyT98MSxVHPZCA6M", "positions":[7] } ]
+                  More than playlist_tracks_limit are removed in several
+                  requests
                 - snapshot_id - optional id of the playlist snapshot
         """
 
@@ -540,11 +1122,22 @@ class Spotify(object):
                 "uri": self._get_uri("track", tr["uri"]),
                 "positions": tr["positions"],
             })
-        payload = {"tracks": ftracks}
-        if snapshot_id:
-            payload["snapshot_id"] = snapshot_id
-        return self._delete("users/%s/playlists/%s/tracks" % (user, plid),
-                            payload=payload)
+
+        if len(ftracks) > self.playlist_tracks_limit:
+            # Removing tracks shifts the ones behind them, so the chunks are
+            # removed from the end of the playlist to its beginning
+            ftracks = sorted(
+                ({"uri": track["uri"], "positions": [position]}
+                 for track in ftracks for position in track["positions"]),
+                key=lambda track: track["positions"][0], reverse=True)
+
+        def remove(index, chunk, previous):
+            payload = {"tracks": chunk}
+            if snapshot_id:
+                payload["snapshot_id"] = _snapshot_id(previous, snapshot_id)
+            return self._delete("users/%s/playlists/%s/tracks" % (user, plid),
+                                payload=payload)
+        return self._bulk_change(_chunks(ftracks, self.playlist_tracks_limit), remove)
 
     def user_playlist_follow_playlist(self, playlist_owner_id, playlist_id):
         """
@@ -681,13 +1274,20 @@ class Spotify(object):
         return self._get('me/top/tracks', time_range=time_range, limit=limit,
                          offset=offset)
 
-    def current_user_recently_played(self, limit=50):
+    def current_user_recently_played(self, limit=50, after=None, before=None):
         ''' Get the current user's recently played tracks
 
             Parameters:
                 - limit - the number of entities to return
-        '''        
-        return self._get('me/player/recently-played', limit=limit)
+                - after - unix timestamp in milliseconds. Returns all items
+                          after (but not including) this cursor position.
+                          Cannot be used if before is specified.
+                - before - unix timestamp in milliseconds. Returns all items
+                           before (but not including) this cursor position.
+                           Cannot be used if after is specified.
+        '''
+        return self._get('me/player/recently-played', limit=limit,
+                         after=after, before=before)
 
     def current_user_saved_albums_add(self, albums=[]):
         """ Add one or more albums to the current user's
@@ -854,14 +1454,17 @@ class Spotify(object):
     def audio_features(self, tracks=[]):
         """ Get audio features for one or multiple tracks based upon their Spotify IDs
             Parameters:
-                - tracks - a list of track URIs, URLs or IDs, maximum: 50 ids
+                - tracks - a list of track URIs, URLs or IDs. More than
+                  audio_features_limit are fetched in several requests
         """
         if isinstance(tracks, str):
             trackid = self._get_id('track', tracks)
             results = self._get('audio-features/?ids=' + trackid)
         else:
             tlist = [self._get_id('track', t) for t in tracks]
-            results = self._get('audio-features/?ids=' + ','.join(tlist))
+            results = self._bulk_get(
+                'audio_features', _chunks(tlist, self.audio_features_limit),
+                lambda chunk: self._get('audio-features/?ids=' + ','.join(chunk)))
         # the response has changed, look for the new style first, and if
         # its not there, fallback on the old style
         if 'audio_features' in results:
@@ -993,7 +1596,7 @@ class Spotify(object):
         if state not in ['track', 'context', 'off']:
             self._warn('invalid state')
             return
-        self._put(self._append_device_id("me/player/repeat?state=%s" % state, device_id))
+        return self._put(self._append_device_id("me/player/repeat?state=%s" % state, device_id))
 
     def volume(self, volume_percent, device_id = None):
         ''' Set playback volume.
@@ -1008,7 +1611,7 @@ class Spotify(object):
         if volume_percent < 0 or volume_percent > 100:
             self._warn('volume must be between 0 and 100, inclusive')
             return
-        self._put(self._append_device_id("me/player/volume?volume_percent=%s" % volume_percent, device_id))
+        return self._put(self._append_device_id("me/player/volume?volume_percent=%s" % volume_percent, device_id))
 
     def shuffle(self, state, device_id = None):
         ''' Toggle playback shuffling.
@@ -1021,7 +1624,7 @@ class Spotify(object):
             self._warn('state must be a boolean')
             return
         state = str(state).lower()
-        self._put(self._append_device_id("me/player/shuffle?state=%s" % state, device_id))
+        return self._put(self._append_device_id("me/player/shuffle?state=%s" % state, device_id))
 
     def _append_device_id(self, path, device_id):
         ''' Append device ID to API path.
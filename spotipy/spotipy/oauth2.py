@@ -1,11 +1,21 @@
 
 from __future__ import print_function
 import base64
+import contextlib
 import requests
 import os
 import json
+import sqlite3
+import tempfile
 import time
 import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows. The file store works without locking there
+    fcntl = None
 
 # Workaround to support both python 2 & 3
 import six
@@ -21,19 +31,195 @@ def _make_authorization_headers(client_id, client_secret):
     return {'Authorization': 'Basic %s' % auth_header.decode('ascii')}
 
 
-def is_token_expired(token_info):
+def _build_session(requests_session):
+    """ The session to send the token requests with. Same as the
+        requests_session argument of the Spotify client
+    """
+    if isinstance(requests_session, requests.Session):
+        return requests_session
+    if requests_session:
+        return requests.Session()
+    # Use the Requests API module as a "session".
+    from requests import api
+    return api
+
+
+def is_token_expired(token_info, margin=60):
     now = int(time.time())
-    return token_info['expires_at'] - now < 60
+    return token_info['expires_at'] - now < margin
+
+
+class TokenStore(object):
+    """
+        Where SpotifyOAuth keeps the token between runs. Several processes
+        (or several SpotifyOAuth objects) using the same store share one
+        token: while one of them refreshes it, the others wait (lock) and
+        then use the refreshed token instead of refreshing it again.
+    """
+
+    def load(self):
+        """ Returns the stored token info or None
+        """
+        raise NotImplementedError()
+
+    def save(self, token_info):
+        """ Stores the token info
+
+            Parameters:
+                - token_info - the token info
+        """
+        raise NotImplementedError()
+
+    def lock(self):
+        """ Returns a context manager which keeps others from refreshing
+            the token at the same time
+        """
+        return _no_lock()
+
+
+@contextlib.contextmanager
+def _no_lock():
+    yield
+
+
+class MemoryTokenStore(TokenStore):
+    """
+        Keeps the token in memory, shared by the SpotifyOAuth objects of one
+        process. It's lost when the process ends.
+    """
+
+    def __init__(self, token_info=None):
+        self._lock = threading.RLock()
+        self._token_info = token_info
+
+    def load(self):
+        with self._lock:
+            return dict(self._token_info) if self._token_info else None
+
+    def save(self, token_info):
+        with self._lock:
+            self._token_info = dict(token_info)
+
+    def lock(self):
+        return self._lock
+
+
+class FileTokenStore(TokenStore):
+    """
+        Keeps the token in a JSON file (the cache_path of SpotifyOAuth). The
+        file is replaced atomically, so it's never read half written, and
+        refreshes are serialized with a lock file (not on Windows).
+    """
+
+    def __init__(self, path):
+        """
+            Parameters:
+                - path - the token file
+        """
+        self.path = path
+
+    def load(self):
+        try:
+            f = open(self.path)
+            token_info_string = f.read()
+            f.close()
+        except IOError:
+            return None
+        return json.loads(token_info_string)
+
+    def save(self, token_info):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(token_info))
+            os.replace(temp_name, self.path)
+        except Exception:
+            os.unlink(temp_name)
+            raise
+
+    @contextlib.contextmanager
+    def lock(self):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+        Keeps the tokens in a SQLite database, one per key (e.g. the
+        username), so several accounts can share one database.
+    """
+
+    def __init__(self, path, key='default', timeout=60):
+        """
+            Parameters:
+                - path - the database. Will be created if it doesn't exist
+                - key - the key of the token
+                - timeout - seconds to wait for another process refreshing
+                  the token
+        """
+        self.path = path
+        self.key = key
+        self._lock = threading.RLock()
+        # Transactions are started explicitly (see lock)
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS tokens ('
+                             'key TEXT PRIMARY KEY, '
+                             'token_info TEXT NOT NULL)')
+
+    def load(self):
+        with self._lock:
+            row = self._db.execute('SELECT token_info FROM tokens WHERE key = ?',
+                                   (self.key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, token_info):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?)',
+                             (self.key, json.dumps(token_info)))
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._lock:
+            # Other processes can still read, but not start refreshing
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 
 class SpotifyClientCredentials(object):
     OAUTH_TOKEN_URL = 'https://accounts.spotify.com/api/token'
 
-    def __init__(self, client_id=None, client_secret=None, proxies=None):
+    def __init__(self, client_id=None, client_secret=None, proxies=None,
+            requests_session=True, requests_timeout=None):
         """
         You can either provid a client_id and client_secret to the
         constructor or set SPOTIPY_CLIENT_ID and SPOTIPY_CLIENT_SECRET
         environment variables
+
+        requests_session is a Requests session object (e.g. the one of the
+        Spotify client, see client.pooled_session) or a truthy value to
+        create one. requests_timeout is the number of seconds to wait for
+        the token endpoint
         """
         if not client_id:
             client_id = os.getenv('SPOTIPY_CLIENT_ID')
@@ -51,6 +237,8 @@ class SpotifyClientCredentials(object):
         self.client_secret = client_secret
         self.token_info = None
         self.proxies = proxies
+        self._session = _build_session(requests_session)
+        self.requests_timeout = requests_timeout
 
     def get_access_token(self):
         """
@@ -71,8 +259,9 @@ class SpotifyClientCredentials(object):
 
         headers = _make_authorization_headers(self.client_id, self.client_secret)
 
-        response = requests.post(self.OAUTH_TOKEN_URL, data=payload,
-            headers=headers, verify=True, proxies=self.proxies)
+        response = self._session.post(self.OAUTH_TOKEN_URL, data=payload,
+            headers=headers, verify=True, proxies=self.proxies,
+            timeout=self.requests_timeout)
         if response.status_code != 200:
             raise SpotifyOauthError(response.reason)
         token_info = response.json()
@@ -99,7 +288,8 @@ class SpotifyOAuth(object):
     OAUTH_TOKEN_URL = 'https://accounts.spotify.com/api/token'
 
     def __init__(self, client_id, client_secret, redirect_uri,
-            state=None, scope=None, cache_path=None, proxies=None):
+            state=None, scope=None, cache_path=None, proxies=None,
+            token_store=None, requests_session=True, requests_timeout=None):
         '''
             Creates a SpotifyOAuth object
 
@@ -110,6 +300,13 @@ class SpotifyOAuth(object):
                  - state - security state
                  - scope - the desired scope of the request
                  - cache_path - path to location to save tokens
+                 - token_store - where to save tokens (a TokenStore),
+                   instead of the file at cache_path
+                 - requests_session - a Requests session object (e.g. the
+                   one of the Spotify client, see client.pooled_session)
+                   or a truthy value to create one
+                 - requests_timeout - seconds to wait for the token
+                   endpoint
         '''
 
         self.client_id = client_id
@@ -117,48 +314,181 @@ class SpotifyOAuth(object):
         self.redirect_uri = redirect_uri
         self.state=state
         self.cache_path = cache_path
+        if token_store is None and cache_path:
+            token_store = FileTokenStore(cache_path)
+        self.token_store = token_store
         self.scope=self._normalize_scope(scope)
         self.proxies = proxies
+        self._session = _build_session(requests_session)
+        self.requests_timeout = requests_timeout
+
+        # The token is kept in memory once it has been read from (or written
+        # to) the token store, so the store is only touched on startup and
+        # when the token expires
+        self.token_info = None
+        self.token_cache_hits = 0
+        self.token_cache_misses = 0
+
+        # Only one refresh at a time, other threads wait for its result
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
+        self.token_refreshes = 0
+        self.token_refresh_failures = 0
+        self.token_refresh_time = 0.0
 
     def get_cached_token(self):
         ''' Gets a cached auth token
         '''
-        token_info = None
-        if self.cache_path:
-            try:
-                f = open(self.cache_path)
-                token_info_string = f.read()
-                f.close()
-                token_info = json.loads(token_info_string)
+        token_info = self.token_info
+        if token_info and not self.is_token_expired(token_info):
+            self.token_cache_hits += 1
+            return token_info
 
-                # if scopes don't match, then bail
-                if 'scope' not in token_info or not self._is_scope_subset(self.scope, token_info['scope']):
-                    return None
+        with self._refresh_lock:
+            # Another thread may have refreshed the token while this one
+            # was waiting for the lock
+            token_info = self.token_info
+            if token_info and not self.is_token_expired(token_info):
+                self.token_cache_hits += 1
+                return token_info
+            self.token_cache_misses += 1
+            token_info = self._renew_token(token_info)
+            self.token_info = token_info
+            return token_info
 
-                if self.is_token_expired(token_info):
-                    token_info = self.refresh_access_token(token_info['refresh_token'])
+    def _renew_token(self, token_info, margin=60):
+        ''' Returns a token valid for at least margin seconds: the stored
+            one, if somebody else has renewed it already, or a refreshed
+            one. Caller holds the refresh lock
 
-            except IOError:
-                pass
+            Parameters:
+                - token_info - the current (in-memory) token or None
+                - margin - seconds the token has to be valid
+        '''
+        with self._store_lock():
+            stored_token_info = self._load_stored_token()
+            if stored_token_info:
+                token_info = stored_token_info
+            if not token_info:
+                return None
+
+            if not self.is_token_expired(token_info, margin):
+                if token_info is stored_token_info:
+                    self.token_info = token_info
+                return token_info
+            return self.refresh_access_token(token_info['refresh_token'])
+
+    def _store_lock(self):
+        if self.token_store:
+            return self.token_store.lock()
+        return _no_lock()
+
+    def _load_stored_token(self):
+        if not self.token_store:
+            return None
+        try:
+            token_info = self.token_store.load()
+        except ValueError:
+            self._warn("couldn't read token cache")
+            return None
+
+        # if scopes don't match, then bail
+        if not token_info or 'scope' not in token_info or \
+                not self._is_scope_subset(self.scope, token_info['scope']):
+            return None
         return token_info
 
+    def token_cache_stats(self):
+        ''' Returns the hit/miss counters of the in-memory token cache
+        '''
+        return {'hits': self.token_cache_hits,
+                'misses': self.token_cache_misses}
+
+    def token_refresh_stats(self):
+        ''' Returns the number of token refreshes, how many of them failed
+            and their average duration in seconds
+        '''
+        return {'refreshes': self.token_refreshes,
+                'failures': self.token_refresh_failures,
+                'average_latency': self.token_refresh_time / max(1, self.token_refreshes)}
+
+    def start_refresher(self, margin=120, retry_interval=30):
+        ''' Starts a background thread which refreshes the token before it
+            expires, so requests don't have to wait for the refresh
+
+            Parameters:
+                - margin - seconds before expires_at the token is refreshed.
+                  Should be more than the 60 seconds after which
+                  get_cached_token considers it expired
+                - retry_interval - seconds to wait after a failed refresh
+        '''
+        if self._refresher is not None:
+            return
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, args=(margin, retry_interval),
+            name='token-refresher')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stop_refresher(self):
+        ''' Stops the background refresh thread
+        '''
+        if self._refresher is None:
+            return
+        self._refresher_stop.set()
+        self._refresher.join()
+        self._refresher = None
+
+    def _refresh_loop(self, margin, retry_interval):
+        wait = 0
+        while not self._refresher_stop.wait(wait):
+            wait = retry_interval
+            try:
+                if not self.refresh_if_expiring(margin):
+                    continue
+            except Exception as e:
+                # Network errors, but also a locked token store: the thread
+                # has to keep running
+                self._warn("couldn't refresh token: %s" % e)
+                continue
+            token_info = self.token_info
+            if token_info:
+                wait = max(token_info['expires_at'] - margin - time.time(), 1)
+
+    def refresh_if_expiring(self, margin=120):
+        ''' Refreshes the token if it expires within the next margin
+            seconds. Returns False if there's no valid token afterwards
+
+            Parameters:
+                - margin - seconds before expires_at the token is refreshed
+        '''
+        with self._refresh_lock:
+            token_info = self.token_info
+            if not token_info:
+                return False
+            if not self.is_token_expired(token_info, margin):
+                return True
+            # A failed refresh keeps the old token, it may still be valid
+            # for a while
+            return self._renew_token(token_info, margin) is not None
+
     def _save_token_info(self, token_info):
-        if self.cache_path:
+        self.token_info = token_info
+        if self.token_store:
             try:
-                f = open(self.cache_path, 'w')
-                f.write(json.dumps(token_info))
-                f.close()
-            except IOError:
-                self._warn("couldn't write token cache to " + self.cache_path)
-                pass
+                self.token_store.save(token_info)
+            except (IOError, OSError, sqlite3.Error):
+                self._warn("couldn't write token cache")
 
     def _is_scope_subset(self, needle_scope, haystack_scope):
         needle_scope = set(needle_scope.split()) if needle_scope else set()
         haystack_scope = set(haystack_scope.split()) if haystack_scope else set()
         return needle_scope <= haystack_scope
 
-    def is_token_expired(self, token_info):
-        return is_token_expired(token_info)
+    def is_token_expired(self, token_info, margin=60):
+        return is_token_expired(token_info, margin)
 
     def get_authorize_url(self, state=None, show_dialog=False):
         """ Gets the URL to use to authorize this app
@@ -212,8 +542,9 @@ class SpotifyOAuth(object):
 
             headers = self._make_authorization_headers()
 
-            response = requests.post(self.OAUTH_TOKEN_URL, data=payload,
-                headers=headers, verify=True, proxies=self.proxies)
+            response = self._session.post(self.OAUTH_TOKEN_URL, data=payload,
+                headers=headers, verify=True, proxies=self.proxies,
+                timeout=self.requests_timeout)
             if response.status_code != 200:
                 raise SpotifyOauthError(response.reason)
             token_info = response.json()
@@ -241,12 +572,23 @@ class SpotifyOAuth(object):
 
         headers = self._make_authorization_headers()
 
-        response = requests.post(self.OAUTH_TOKEN_URL, data=payload,
-            headers=headers, proxies=self.proxies)
+        start = time.monotonic()
+        try:
+            response = self._session.post(self.OAUTH_TOKEN_URL, data=payload,
+                headers=headers, proxies=self.proxies,
+                timeout=self.requests_timeout)
+        except requests.exceptions.RequestException:
+            self.token_refresh_failures += 1
+            raise
+        finally:
+            self.token_refreshes += 1
+            self.token_refresh_time += time.monotonic() - start
+
         if response.status_code != 200:
             if False:  # debugging code
                 print('headers', headers)
                 print('request', response.url)
+            self.token_refresh_failures += 1
             self._warn("couldn't refresh token: code:%d reason:%s" \
                 % (response.status_code, response.reason))
             return None
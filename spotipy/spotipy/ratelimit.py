@@ -0,0 +1,116 @@
+# coding: utf-8
+
+""" Rate limit handling shared by all Spotify objects of a process
+"""
+
+import random
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+        Keeps track of Spotify's rate limit. When Spotify answers with a
+        429 (Too Many Requests), every caller waits until the time given in
+        the Retry-After header has passed - not only the one who got the
+        429. Callers may give a deadline; if waiting would exceed it, they
+        fail at once instead of blocking.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0):
+        """
+            Parameters:
+                - base_delay - the first backoff delay in seconds
+                - max_delay - the maximum backoff delay in seconds
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+        self.throttled = 0
+        self.backoffs = 0
+        self.deadline_exceeded = 0
+        self.sleep_time = 0.0
+
+    def blocked_for(self):
+        """ Returns the number of seconds requests have to wait
+        """
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    def throttle(self, retry_after):
+        """ Blocks all requests for the given number of seconds
+
+            Parameters:
+                - retry_after - seconds (usually from the Retry-After header)
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      time.monotonic() + retry_after)
+            self.throttled += 1
+
+    def backoff(self, attempt):
+        """ Returns the (jittered, exponential) delay for the given attempt
+
+            Parameters:
+                - attempt - the number of the failed attempt (1 = first)
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def wait(self, deadline=None):
+        """ Waits until requests are allowed again. Returns False (without
+            waiting) if that would take longer than the deadline
+
+            Parameters:
+                - deadline - time.monotonic() value or None (no deadline)
+        """
+        return self.sleep(self.blocked_for(), deadline, retry=False)
+
+    def sleep(self, seconds, deadline=None, retry=True):
+        """ Sleeps for the given number of seconds. Returns False (without
+            sleeping) if the deadline would be exceeded
+
+            Parameters:
+                - seconds - the number of seconds to sleep
+                - deadline - time.monotonic() value or None (no deadline)
+                - retry - count the sleep as a backoff after an error
+        """
+        if not self.reserve(seconds, deadline, retry):
+            return False
+        if seconds > 0:
+            time.sleep(seconds)
+        return True
+
+    def reserve(self, seconds, deadline=None, retry=True):
+        """ Like sleep, but doesn't sleep - for callers which have to sleep
+            on their own (asyncio)
+
+            Parameters:
+                - seconds - the number of seconds the caller will sleep
+                - deadline - time.monotonic() value or None (no deadline)
+                - retry - count the sleep as a backoff after an error
+        """
+        if seconds <= 0:
+            return True
+
+        if deadline is not None and time.monotonic() + seconds > deadline:
+            with self._lock:
+                self.deadline_exceeded += 1
+            return False
+
+        with self._lock:
+            self.sleep_time += seconds
+            if retry:
+                self.backoffs += 1
+        return True
+
+    def stats(self):
+        """ Returns the counters
+        """
+        with self._lock:
+            return {'throttled': self.throttled,
+                    'backoffs': self.backoffs,
+                    'deadline_exceeded': self.deadline_exceeded,
+                    'sleep_time': self.sleep_time}
@@ -7,7 +7,8 @@ from . import oauth2
 import spotipy
 
 def prompt_for_user_token(username, scope=None, client_id = None,
-        client_secret = None, redirect_uri = None, cache_path = None):
+        client_secret = None, redirect_uri = None, cache_path = None,
+        token_store = None, requests_session = True, requests_timeout = None):
     ''' prompts the user to login if necessary and returns
         the user token suitable for use with the spotipy.Spotify 
         constructor
@@ -20,6 +21,10 @@ def prompt_for_user_token(username, scope=None, client_id = None,
          - client_secret - the client secret of your app
          - redirect_uri - the redirect URI of your app
          - cache_path - path to location to save tokens
+         - token_store - where to save tokens (an oauth2.TokenStore),
+           instead of cache_path
+         - requests_session - the Requests session for the token requests
+         - requests_timeout - seconds to wait for the token endpoint
 
     '''
 
@@ -48,7 +53,8 @@ def prompt_for_user_token(username, scope=None, client_id = None,
 
     cache_path = cache_path or ".cache-" + username
     sp_oauth = oauth2.SpotifyOAuth(client_id, client_secret, redirect_uri, 
-        scope=scope, cache_path=cache_path)
+        scope=scope, cache_path=cache_path, token_store=token_store,
+        requests_session=requests_session, requests_timeout=requests_timeout)
 
     # try to get a valid token for this user, from the cache,
     # if not in the cache, the create a new (this will send
@@ -94,7 +100,8 @@ def prompt_for_user_token(username, scope=None, client_id = None,
 
 
 def prompt_for_oauth_object(username, scope=None, client_id = None,
-        client_secret = None, redirect_uri = None):
+        client_secret = None, redirect_uri = None, token_store = None,
+        requests_session = True, requests_timeout = None):
     ''' prompts the user to login if necessary and returns
         the oauth object suitable for use with the spotipy.Spotify
         constructor
@@ -104,6 +111,10 @@ def prompt_for_oauth_object(username, scope=None, client_id = None,
          - client_id - the client id of your app
          - client_secret - the client secret of your app
          - redirect_uri - the redirect URI of your app
+         - token_store - where to save tokens (an oauth2.TokenStore).
+           Default: the file .cache-<username>
+         - requests_session - the Requests session for the token requests
+         - requests_timeout - seconds to wait for the token endpoint
     '''
 
     if not client_id:
@@ -128,7 +139,8 @@ def prompt_for_oauth_object(username, scope=None, client_id = None,
         raise spotipy.SpotifyException(550, -1, 'no credentials set')
 
     sp_oauth = oauth2.SpotifyOAuth(client_id, client_secret, redirect_uri,
-        scope=scope, cache_path=".cache-" + username )
+        scope=scope, cache_path=".cache-" + username, token_store=token_store,
+        requests_session=requests_session, requests_timeout=requests_timeout)
 
     # try to get a valid token for this user, from the cache,
     # if not in the cache, the create a new (this will send
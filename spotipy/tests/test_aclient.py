@@ -0,0 +1,285 @@
+from spotipy import aclient
+from spotipy.aclient import AsyncSpotify
+from spotipy.cache import MemoryCache
+from spotipy.client import SpotifyChunkError, SpotifyException
+import asyncio
+import json
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer
+
+from requests.structures import CaseInsensitiveDict
+
+
+class FakeServer(object):
+    """ Replaces AsyncSpotify._request
+    """
+
+    def __init__(self, responses, delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+
+    async def __call__(self, method, url, headers, params, data):
+        self.requests.append((method, url, headers, params, data))
+        await asyncio.sleep(self.delay)
+        status, body, headers = self.responses.pop(0)
+        text = json.dumps(body) if body is not None else ''
+        return status, CaseInsensitiveDict(headers or {}), text
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers with the request it got
+    """
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path,
+                           'authorization': self.headers.get('Authorization')})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _spotify(responses, delay=0, **kwargs):
+    spotify = AsyncSpotify(auth='TOKEN', **kwargs)
+    spotify._request = FakeServer(responses, delay)
+    return spotify
+
+
+def _run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class AsyncSpotifyTest(unittest.TestCase):
+
+    def test_get(self):
+        spotify = _spotify([(200, {'name': 'track'}, None)])
+
+        self.assertEqual(_run(spotify.track('spotify:track:1')), {'name': 'track'})
+
+        method, url, headers, params, data = spotify._request.requests[0]
+        self.assertEqual(method, 'GET')
+        self.assertEqual(url, 'https://api.spotify.com/v1/tracks/1')
+        self.assertEqual(headers['Authorization'], 'Bearer TOKEN')
+
+    def test_params(self):
+        spotify = _spotify([(200, {'items': []}, None)])
+
+        _run(spotify.current_user_recently_played(limit=10))
+
+        params = spotify._request.requests[0][3]
+        self.assertEqual(params, {'limit': '10'})
+
+    def test_error(self):
+        spotify = _spotify([(404, {'error': {'message': 'not found'}}, None)])
+
+        with self.assertRaises(SpotifyException) as context:
+            _run(spotify.track('spotify:track:1'))
+        self.assertEqual(context.exception.http_status, 404)
+        self.assertIn('not found', context.exception.msg)
+
+    def test_retry_server_error(self):
+        spotify = _spotify([(502, None, None), (200, {'name': 'track'}, None)])
+        spotify.rate_limiter.base_delay = 0.01
+
+        self.assertEqual(_run(spotify.track('spotify:track:1')), {'name': 'track'})
+        self.assertEqual(len(spotify._request.requests), 2)
+
+    def test_concurrent_gets_coalesced(self):
+        spotify = _spotify([(200, {'name': 'track'}, None)], delay=0.05,
+                           coalesce_requests=True)
+
+        async def gather():
+            return await asyncio.gather(*[spotify.track('spotify:track:1')
+                                          for i in range(5)])
+
+        results = _run(gather())
+
+        self.assertEqual(len(spotify._request.requests), 1)
+        self.assertEqual(results, [{'name': 'track'}] * 5)
+        self.assertEqual(spotify.coalesce_stats(), {'executed': 1, 'shared': 4})
+
+    def test_coalesced_get_cancelled(self):
+        spotify = _spotify([(200, {'name': 'track'}, None)], delay=0.05,
+                           coalesce_requests=True)
+
+        async def gather():
+            first = asyncio.ensure_future(spotify.track('spotify:track:1'))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(spotify.track('spotify:track:1'))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second, first.cancelled()
+
+        # Cancelling the first caller doesn't cancel the shared request
+        self.assertEqual(_run(gather()), ({'name': 'track'}, True))
+        self.assertEqual(len(spotify._request.requests), 1)
+        self.assertEqual(spotify.coalesce_stats(), {'executed': 1, 'shared': 1})
+
+    def test_coalesce_ttl_purged(self):
+        responses = [(200, {'name': str(i)}, None) for i in range(10)]
+        spotify = _spotify(responses, coalesce_requests=True, coalesce_ttl=0.05)
+
+        async def fetch():
+            for i in range(5):
+                await spotify.track('spotify:track:%d' % i)
+            await asyncio.sleep(0.1)
+            for i in range(5, 10):
+                await spotify.track('spotify:track:%d' % i)
+
+        _run(fetch())
+
+        # The expired results aren't kept
+        self.assertEqual(len(spotify._single_flight._calls), 5)
+
+    def test_concurrent_different_gets(self):
+        responses = [(200, {'name': str(i)}, None) for i in range(3)]
+        spotify = _spotify(responses, delay=0.05)
+
+        async def gather():
+            return await asyncio.gather(*[spotify.track('spotify:track:%d' % i)
+                                          for i in range(3)])
+
+        _run(gather())
+        self.assertEqual(len(spotify._request.requests), 3)
+
+    def test_revalidate(self):
+        spotify = _spotify([(200, {'name': 'track'}, {'ETag': '"v1"'}),
+                            (304, None, None)], response_cache=MemoryCache())
+
+        _run(spotify.track('spotify:track:1'))
+        self.assertEqual(_run(spotify.track('spotify:track:1')), {'name': 'track'})
+
+        self.assertEqual(spotify._request.requests[1][2]['If-None-Match'], '"v1"')
+        self.assertEqual(spotify.cache_stats()['revalidations'], 1)
+
+    def test_early_return(self):
+        spotify = _spotify([])
+
+        self.assertIsNone(_run(spotify.volume(200)))
+        self.assertIsNone(_run(spotify.next({'next': None})))
+
+    def test_start_playback(self):
+        spotify = _spotify([(204, None, None)])
+        spotify._warn = lambda msg: None
+
+        self.assertIsNone(_run(spotify.start_playback(uris='spotify:track:1')))
+        self.assertIsNone(_run(spotify.start_playback(uris=['spotify:track:1'])))
+
+        method, url, headers, params, data = spotify._request.requests[0]
+        self.assertEqual((method, url), ('PUT', 'https://api.spotify.com/v1/me/player/play'))
+        self.assertEqual(json.loads(data), {'uris': ['spotify:track:1']})
+
+    def test_seek_track(self):
+        spotify = _spotify([(204, None, None)])
+        spotify._warn = lambda msg: None
+
+        self.assertIsNone(_run(spotify.seek_track('x')))
+        self.assertIsNone(_run(spotify.seek_track(1000)))
+
+        method, url = spotify._request.requests[0][:2]
+        self.assertEqual((method, url), ('PUT', 'https://api.spotify.com/v1/me/player/seek?position_ms=1000'))
+
+    def test_audio_features(self):
+        spotify = _spotify([(200, {'audio_features': [{'id': '1'}]}, None)])
+
+        self.assertEqual(_run(spotify.audio_features(['spotify:track:1'])), [{'id': '1'}])
+
+    def test_iter_items(self):
+        def page(offset, total=250, limit=100):
+            next_url = None
+            if offset + limit < total:
+                next_url = 'https://api.spotify.com/v1/me/tracks?offset=%d&limit=%d' % (
+                    offset + limit, limit)
+            return {'items': list(range(offset, min(offset + limit, total))),
+                    'offset': offset, 'limit': limit, 'total': total,
+                    'next': next_url}
+
+        async def items(spotify, concurrency):
+            return [item async for item in spotify.iter_items(
+                page(0), concurrency=concurrency)]
+
+        for concurrency in (1, 2):
+            spotify = _spotify([(200, page(100), None), (200, page(200), None)])
+            self.assertEqual(_run(items(spotify, concurrency)), list(range(250)))
+            urls = [request[1] for request in spotify._request.requests]
+            self.assertEqual(len(urls), 2)
+
+
+    def test_chunked_tracks(self):
+        ids = ['%022d' % i for i in range(60)]
+        spotify = _spotify([
+            (200, {'tracks': [{'id': id} for id in ids[:50]]}, None),
+            (200, {'tracks': [{'id': id} for id in ids[50:]]}, None)],
+            chunk_concurrency=2)
+
+        result = _run(spotify.tracks(ids))
+
+        self.assertEqual([track['id'] for track in result['tracks']], ids)
+        self.assertEqual(len(spotify._request.requests), 2)
+
+    def test_chunked_partial_failure(self):
+        ids = ['%022d' % i for i in range(60)]
+        spotify = _spotify([
+            (200, {'tracks': [{'id': id} for id in ids[:50]]}, None),
+            (404, {'error': {'message': 'not found'}}, None)])
+
+        with self.assertRaises(SpotifyChunkError) as context:
+            _run(spotify.tracks(ids))
+
+        self.assertEqual(context.exception.result['tracks'][50:], [None] * 10)
+        self.assertEqual(context.exception.failures[0][0], ids[50:])
+
+
+@unittest.skipIf(aclient.aiohttp is None, 'aiohttp is not installed')
+class AsyncSpotifyRequestTest(unittest.TestCase):
+    """ AsyncSpotify._request against a local server
+    """
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/v1/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_request(self):
+        spotify = AsyncSpotify(auth='TOKEN')
+
+        async def request():
+            async with spotify:
+                return await spotify._request(
+                    'GET', self.url + 'tracks/1', {'Authorization': 'Bearer TOKEN'},
+                    {'market': 'DE'}, None)
+
+        status, headers, text = _run(request())
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(text), {'path': '/v1/tracks/1?market=DE',
+                                            'authorization': 'Bearer TOKEN'})
+
+    def test_api_call(self):
+        spotify = AsyncSpotify(auth='TOKEN')
+        spotify.prefix = self.url
+
+        async def track():
+            async with spotify:
+                return await spotify.track('spotify:track:1')
+
+        self.assertEqual(_run(track()), {'path': '/v1/tracks/1',
+                                         'authorization': 'Bearer TOKEN'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+from spotipy.cache import MemoryCache, DiskCache, cache_entry
+from spotipy.client import Spotify
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from requests.structures import CaseInsensitiveDict
+
+TRACK_URL = 'https://api.spotify.com/v1/tracks/4uLU6hMCjMI75M1A2tKUQC'
+
+
+def _response(status_code, body=None, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.text = json.dumps(body) if body is not None else ''
+    response.json.return_value = body
+    response.headers = CaseInsensitiveDict(headers or {})
+    response.url = TRACK_URL
+    return response
+
+
+class CacheEntryTest(unittest.TestCase):
+
+    def test_max_age(self):
+        entry = cache_entry({}, {'Cache-Control': 'public, max-age=7200'}, now=100)
+        self.assertEqual(entry['expires'], 7300)
+        self.assertIsNone(entry['etag'])
+
+    def test_etag_only(self):
+        entry = cache_entry({}, {'ETag': '"abc"', 'Cache-Control': 'max-age=0'}, now=100)
+        self.assertEqual(entry['expires'], 100)
+        self.assertEqual(entry['etag'], '"abc"')
+
+    def test_not_cacheable(self):
+        self.assertIsNone(cache_entry({}, {}))
+        self.assertIsNone(cache_entry({}, {'ETag': '"abc"', 'Cache-Control': 'no-store'}))
+
+
+class MemoryCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        memory_cache = MemoryCache(maxsize=2)
+        memory_cache.set('a', 1)
+        memory_cache.set('b', 2)
+        memory_cache.get('a')
+        memory_cache.set('c', 3)
+
+        self.assertEqual(len(memory_cache), 2)
+        self.assertIsNone(memory_cache.get('b'))
+        self.assertEqual(memory_cache.get('a'), 1)
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_persistent(self):
+        entry = {'body': {'name': 'track'}, 'etag': '"abc"', 'expires': 100}
+        DiskCache(self.directory).set('key', entry)
+
+        loaded = DiskCache(self.directory).get('key')
+        self.assertEqual(loaded['body'], entry['body'])
+        self.assertEqual(loaded['etag'], entry['etag'])
+        self.assertIsNone(DiskCache(self.directory).get('other key'))
+
+
+class SpotifyCacheTest(unittest.TestCase):
+
+    def _spotify(self, responses):
+        session = mock.Mock()
+        session.request.side_effect = responses
+        spotify = Spotify(auth='TOKEN', requests_session=False,
+                          response_cache=MemoryCache())
+        spotify._session = session
+        return spotify, session
+
+    def test_fresh_hit(self):
+        spotify, session = self._spotify([
+            _response(200, {'name': 'track'}, {'Cache-Control': 'max-age=3600'})])
+
+        self.assertEqual(spotify.track(TRACK_URL), {'name': 'track'})
+        self.assertEqual(spotify.track(TRACK_URL), {'name': 'track'})
+
+        self.assertEqual(session.request.call_count, 1)
+        self.assertEqual(spotify.cache_stats(),
+                         {'hits': 1, 'misses': 1, 'revalidations': 0})
+
+    def test_hit_is_a_copy(self):
+        spotify, session = self._spotify([
+            _response(200, {'name': 'track'}, {'Cache-Control': 'max-age=3600'})])
+
+        spotify.track(TRACK_URL)['name'] = 'changed'
+        spotify.track(TRACK_URL)['name'] = 'changed again'
+
+        self.assertEqual(spotify.track(TRACK_URL), {'name': 'track'})
+
+    def test_revalidate(self):
+        spotify, session = self._spotify([
+            _response(200, {'name': 'track'}, {'ETag': '"v1"', 'Cache-Control': 'max-age=0'}),
+            _response(304, headers={'Cache-Control': 'max-age=0'})])
+
+        spotify.track(TRACK_URL)
+        self.assertEqual(spotify.track(TRACK_URL), {'name': 'track'})
+
+        headers = session.request.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(spotify.cache_stats(),
+                         {'hits': 0, 'misses': 1, 'revalidations': 1})
+
+    def test_user_endpoints_not_cached(self):
+        spotify, session = self._spotify([
+            _response(200, {'item': 1}, {'Cache-Control': 'max-age=3600'}),
+            _response(200, {'item': 2}, {'Cache-Control': 'max-age=3600'})])
+
+        spotify.current_user_playing_track()
+        self.assertEqual(spotify.current_user_playing_track(), {'item': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+from spotipy.client import Spotify, SpotifyChunkError, SpotifyException
+import threading
+import time
+import unittest
+
+
+class FakeServer(object):
+    """ Replaces Spotify._internal_call, answers the bulk endpoints
+    """
+
+    def __init__(self, fail=(), delay=0):
+        self.fail = set(fail)
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, payload, params, deadline=None):
+        with self._lock:
+            self.calls.append((method, url, payload, params))
+            index = len(self.calls) - 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+
+        if method == 'GET':
+            path, ids = url.split('/?ids=')
+            ids = ids.split(',')
+            if self.fail & set(ids):
+                raise SpotifyException(404, -1, 'not found')
+            key = path.replace('-', '_')
+            return {key: [{'id': id} for id in ids]}
+
+        if index in self.fail:
+            raise SpotifyException(502, -1, 'bad gateway')
+        return {'snapshot_id': 'snapshot%d' % index}
+
+
+def _ids(count):
+    return ['%022d' % i for i in range(count)]
+
+
+class ChunkingTest(unittest.TestCase):
+
+    def _spotify(self, server, **kwargs):
+        spotify = Spotify(auth='TOKEN', coalesce_requests=False, **kwargs)
+        spotify._internal_call = server
+        return spotify
+
+    def test_tracks_chunked(self):
+        server = FakeServer()
+        ids = _ids(120)
+
+        result = self._spotify(server).tracks(ids)
+
+        self.assertEqual([track['id'] for track in result['tracks']], ids)
+        self.assertEqual([len(call[1].split(',')) for call in server.calls],
+                         [50, 50, 20])
+
+    def test_single_request(self):
+        server = FakeServer()
+        result = self._spotify(server).artists(_ids(3))
+        self.assertEqual(len(result['artists']), 3)
+        self.assertEqual(len(server.calls), 1)
+
+    def test_limits(self):
+        server = FakeServer()
+        spotify = self._spotify(server)
+
+        self.assertEqual(len(spotify.albums(_ids(45))['albums']), 45)
+        self.assertEqual(len(server.calls), 3)
+
+        features = spotify.audio_features(_ids(150))
+        self.assertEqual([feature['id'] for feature in features], _ids(150))
+        self.assertEqual(len(server.calls), 5)
+
+    def test_parallel_chunks(self):
+        server = FakeServer(delay=0.05)
+        ids = _ids(500)
+
+        result = self._spotify(server, chunk_concurrency=4).tracks(ids)
+
+        self.assertEqual([track['id'] for track in result['tracks']], ids)
+        self.assertGreater(server.max_running, 1)
+        self.assertLessEqual(server.max_running, 4)
+
+    def test_partial_failure(self):
+        ids = _ids(120)
+        server = FakeServer(fail=[ids[60]])
+
+        with self.assertRaises(SpotifyChunkError) as context:
+            self._spotify(server, chunk_concurrency=2).tracks(ids)
+
+        error = context.exception
+        self.assertEqual(error.http_status, 404)
+        self.assertEqual(len(error.failures), 1)
+        self.assertEqual(error.failures[0][0], ids[50:100])
+        tracks = error.result['tracks']
+        self.assertEqual(len(tracks), 120)
+        self.assertEqual(tracks[:50], [{'id': id} for id in ids[:50]])
+        self.assertEqual(tracks[50:100], [None] * 50)
+        self.assertEqual(tracks[100:], [{'id': id} for id in ids[100:]])
+
+    def test_single_chunk_error_unchanged(self):
+        ids = _ids(10)
+        server = FakeServer(fail=[ids[0]])
+
+        with self.assertRaises(SpotifyException) as context:
+            self._spotify(server).tracks(ids)
+        self.assertNotIsInstance(context.exception, SpotifyChunkError)
+
+    def test_add_tracks(self):
+        server = FakeServer()
+        ids = _ids(250)
+
+        result = self._spotify(server).user_playlist_add_tracks(
+            'user', 'playlist', ids, position=5)
+
+        self.assertEqual(result, {'snapshot_id': 'snapshot2'})
+        self.assertEqual([call[3]['position'] for call in server.calls],
+                         [5, 105, 205])
+        added = [uri for call in server.calls for uri in call[2]]
+        self.assertEqual(added, ['spotify:track:' + id for id in ids])
+
+    def test_replace_tracks(self):
+        server = FakeServer()
+
+        self._spotify(server).user_playlist_replace_tracks(
+            'user', 'playlist', _ids(150))
+
+        self.assertEqual([call[0] for call in server.calls], ['PUT', 'POST'])
+        self.assertEqual(len(server.calls[0][2]['uris']), 100)
+        self.assertEqual(len(server.calls[1][2]), 50)
+
+    def test_remove_specific_occurrences(self):
+        server = FakeServer()
+        tracks = [{'uri': id, 'positions': [i]}
+                  for i, id in enumerate(_ids(150))]
+
+        self._spotify(server).user_playlist_remove_specific_occurrences_of_tracks(
+            'user', 'playlist', tracks, snapshot_id='snapshot')
+
+        first, second = [call[2] for call in server.calls]
+        # From the end of the playlist to its beginning
+        self.assertEqual(first['tracks'][0]['positions'], [149])
+        self.assertEqual(second['tracks'][-1]['positions'], [0])
+        self.assertEqual(first['snapshot_id'], 'snapshot')
+        self.assertEqual(second['snapshot_id'], 'snapshot0')
+
+    def test_change_stops_at_failure(self):
+        server = FakeServer(fail=[1])
+        ids = _ids(250)
+
+        with self.assertRaises(SpotifyChunkError) as context:
+            self._spotify(server).user_playlist_remove_all_occurrences_of_tracks(
+                'user', 'playlist', ids)
+
+        error = context.exception
+        self.assertEqual(len(server.calls), 2)
+        self.assertEqual(error.result, {'snapshot_id': 'snapshot0'})
+        self.assertEqual(error.http_status, 502)
+        self.assertEqual(error.unsent, ['spotify:track:' + id for id in ids[200:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
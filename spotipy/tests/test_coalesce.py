@@ -0,0 +1,100 @@
+from spotipy.client import Spotify, SpotifyException
+import threading
+import time
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+patch = mock.patch
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def _slow_call(self, results):
+        def internal_call(method, url, payload, params, deadline=None):
+            time.sleep(0.2)
+            results.append(url)
+            return {'url': url}
+        return internal_call
+
+    def _concurrent_gets(self, spotify, urls):
+        results = [None] * len(urls)
+
+        def get(index):
+            results[index] = spotify._get(urls[index], limit=1)
+
+        threads = [threading.Thread(target=get, args=(i,))
+                   for i in range(len(urls))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_gets_share_one_call(self):
+        calls = []
+        spotify = Spotify(auth='TOKEN', coalesce_requests=True)
+
+        with patch.object(spotify, '_internal_call', self._slow_call(calls)):
+            results = self._concurrent_gets(spotify, ['me/player'] * 5)
+
+        self.assertEqual(calls, ['me/player'])
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(spotify.coalesce_stats(), {'executed': 1, 'shared': 4})
+
+    def test_not_coalesced_by_default(self):
+        calls = []
+        spotify = Spotify(auth='TOKEN')
+
+        with patch.object(spotify, '_internal_call', self._slow_call(calls)):
+            results = self._concurrent_gets(spotify, ['me/player'] * 2)
+
+        self.assertEqual(calls, ['me/player'] * 2)
+        self.assertIsNot(results[0], results[1])
+        self.assertIsNone(spotify.coalesce_stats())
+
+    def test_different_gets_not_shared(self):
+        calls = []
+        spotify = Spotify(auth='TOKEN', coalesce_requests=True)
+
+        with patch.object(spotify, '_internal_call', self._slow_call(calls)):
+            self._concurrent_gets(spotify, ['me/player', 'me/tracks'])
+
+        self.assertEqual(sorted(calls), ['me/player', 'me/tracks'])
+
+    def test_ttl(self):
+        calls = []
+        spotify = Spotify(auth='TOKEN', coalesce_requests=True, coalesce_ttl=60)
+
+        with patch.object(spotify, '_internal_call', self._slow_call(calls)):
+            spotify._get('me/player')
+            spotify._get('me/player')
+
+        self.assertEqual(calls, ['me/player'])
+
+    def test_no_ttl(self):
+        calls = []
+        spotify = Spotify(auth='TOKEN', coalesce_requests=True)
+
+        with patch.object(spotify, '_internal_call', self._slow_call(calls)):
+            spotify._get('me/player')
+            spotify._get('me/player')
+
+        self.assertEqual(calls, ['me/player', 'me/player'])
+
+    def test_errors_not_kept(self):
+        spotify = Spotify(auth='TOKEN', coalesce_requests=True, coalesce_ttl=60)
+        error = SpotifyException(404, -1, 'not found')
+
+        with patch.object(spotify, '_internal_call', side_effect=error) as call:
+            for i in range(2):
+                self.assertRaises(SpotifyException, spotify._get, 'me/player')
+
+        self.assertEqual(call.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,14 @@
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.oauth2 import SpotifyOAuth, FileTokenStore, MemoryTokenStore, \
+    SQLiteTokenStore
 import json
+import requests
 import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 
 try:
@@ -39,13 +47,20 @@ def _make_oauth(*args, **kwargs):
 
 class OAuthCacheTest(unittest.TestCase):
 
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, ".cache-username")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
     @patch.multiple(SpotifyOAuth,
                     is_token_expired=DEFAULT, refresh_access_token=DEFAULT)
     @patch('spotipy.oauth2.open', create=True)
     def test_gets_from_cache_path(self, opener,
                                   is_token_expired, refresh_access_token):
         scope = "playlist-modify-private"
-        path = ".cache-username"
+        path = self.path
         tok = _make_fake_token(1, 1, scope)
 
         opener.return_value = _token_file(json.dumps(tok, ensure_ascii=False))
@@ -64,7 +79,7 @@ class OAuthCacheTest(unittest.TestCase):
     def test_expired_token_refreshes(self, opener,
                                      is_token_expired, refresh_access_token):
         scope = "playlist-modify-private"
-        path = ".cache-username"
+        path = self.path
         expired_tok = _make_fake_token(0, None, scope)
         fresh_tok = _make_fake_token(1, 1, scope)
 
@@ -75,7 +90,7 @@ class OAuthCacheTest(unittest.TestCase):
         spot = _make_oauth(scope, path)
         spot.get_cached_token()
 
-        is_token_expired.assert_called_with(expired_tok)
+        is_token_expired.assert_called_with(expired_tok, 60)
         refresh_access_token.assert_called_with(expired_tok['refresh_token'])
         opener.assert_any_call(path)
 
@@ -86,7 +101,7 @@ class OAuthCacheTest(unittest.TestCase):
                                       is_token_expired, refresh_access_token):
         token_scope = "playlist-modify-public"
         requested_scope = "playlist-modify-private"
-        path = ".cache-username"
+        path = self.path
         tok = _make_fake_token(1, 1, token_scope)
 
         opener.return_value = _token_file(json.dumps(tok, ensure_ascii=False))
@@ -99,20 +114,232 @@ class OAuthCacheTest(unittest.TestCase):
         self.assertIsNone(cached_tok)
         self.assertEqual(refresh_access_token.call_count, 0)
 
+    @patch.multiple(SpotifyOAuth,
+                    is_token_expired=DEFAULT, refresh_access_token=DEFAULT)
     @patch('spotipy.oauth2.open', create=True)
-    def test_saves_to_cache_path(self, opener):
+    def test_cached_token_kept_in_memory(self, opener,
+                                         is_token_expired, refresh_access_token):
         scope = "playlist-modify-private"
-        path = ".cache-username"
+        path = self.path
         tok = _make_fake_token(1, 1, scope)
 
-        fi = _fake_file()
-        opener.return_value = fi
+        opener.return_value = _token_file(json.dumps(tok, ensure_ascii=False))
+        is_token_expired.return_value = False
+
+        spot = _make_oauth(scope, path)
+        spot.get_cached_token()
+        spot.get_cached_token()
+        spot.get_access_token()
+
+        self.assertEqual(opener.call_count, 1)
+        self.assertEqual(spot.token_cache_stats(), {'hits': 2, 'misses': 1})
+        self.assertEqual(refresh_access_token.call_count, 0)
+
+    @patch.multiple(SpotifyOAuth,
+                    is_token_expired=DEFAULT, refresh_access_token=DEFAULT)
+    def test_expired_memory_token_refreshes(
+            self, is_token_expired, refresh_access_token):
+        scope = "playlist-modify-private"
+        expired_tok = _make_fake_token(0, None, scope)
+        fresh_tok = _make_fake_token(1, 1, scope)
+
+        refresh_access_token.return_value = fresh_tok
+        is_token_expired.return_value = True
+
+        spot = _make_oauth(scope, token_store=MemoryTokenStore())
+        spot.token_info = expired_tok
+        cached_tok = spot.get_cached_token()
+
+        self.assertEqual(cached_tok, fresh_tok)
+        refresh_access_token.assert_called_with(expired_tok['refresh_token'])
+
+    def test_saves_to_cache_path(self):
+        scope = "playlist-modify-private"
+        path = self.path
+        tok = _make_fake_token(1, 1, scope)
 
         spot = SpotifyOAuth("CLID", "CLISEC", "REDIR", "STATE", scope, path)
         spot._save_token_info(tok)
 
-        opener.assert_called_with(path, 'w')
-        self.assertTrue(fi.write.called)
+        with open(path) as f:
+            self.assertEqual(json.load(f), tok)
+        # Written atomically, no temporary files left
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [".cache-username"])
+
+
+class TokenStoreTest(unittest.TestCase):
+
+    scope = "playlist-modify-private"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _fresh_token(self):
+        return _make_fake_token(int(time.time()) + 3600, 3600, self.scope)
+
+    def _shares_token(self, first_store, second_store):
+        """ Two processes using the same store: the second one uses the
+            token refreshed by the first one
+        """
+        expired_tok = _make_fake_token(0, None, self.scope)
+        fresh_tok = self._fresh_token()
+        first_store.save(expired_tok)
+
+        first = _make_oauth(self.scope, token_store=first_store)
+        second = _make_oauth(self.scope, token_store=second_store)
+        second.token_info = expired_tok
+
+        def refresh(oauth, refresh_token):
+            oauth._save_token_info(fresh_tok)
+            return fresh_tok
+
+        with patch.object(SpotifyOAuth, 'refresh_access_token', autospec=True,
+                          side_effect=refresh) as refresh_access_token:
+            self.assertEqual(first.get_cached_token(), fresh_tok)
+            self.assertEqual(second.get_cached_token(), fresh_tok)
+
+        self.assertEqual(refresh_access_token.call_count, 1)
+
+    def test_memory_store(self):
+        store = MemoryTokenStore()
+        self.assertIsNone(store.load())
+        self._shares_token(store, store)
+
+    def test_file_store(self):
+        path = os.path.join(self.directory, "token")
+        self.assertIsNone(FileTokenStore(path).load())
+        self._shares_token(FileTokenStore(path), FileTokenStore(path))
+
+    def test_sqlite_store(self):
+        path = os.path.join(self.directory, "tokens.sqlite")
+        first_store = SQLiteTokenStore(path, "user")
+        second_store = SQLiteTokenStore(path, "user")
+        other_store = SQLiteTokenStore(path, "other")
+
+        self._shares_token(first_store, second_store)
+        self.assertIsNone(other_store.load())
+
+        for store in (first_store, second_store, other_store):
+            store.close()
+
+    def test_badly_scoped_stored_token_ignored(self):
+        store = MemoryTokenStore(_make_fake_token(
+            int(time.time()) + 3600, 3600, "user-read-private"))
+        spot = _make_oauth(self.scope, token_store=store)
+        self.assertIsNone(spot.get_cached_token())
+
+
+class OAuthRefreshTest(unittest.TestCase):
+
+    def _fresh_token(self, expires_in=3600):
+        return _make_fake_token(int(time.time()) + expires_in, expires_in,
+                                "playlist-modify-private")
+
+    def test_concurrent_refreshes_once(self):
+        spot = _make_oauth("playlist-modify-private")
+        spot.token_info = _make_fake_token(0, None, "playlist-modify-private")
+        fresh_tok = self._fresh_token()
+
+        def slow_refresh(refresh_token):
+            time.sleep(0.1)
+            return fresh_tok
+
+        with patch.object(SpotifyOAuth, 'refresh_access_token',
+                          side_effect=slow_refresh) as refresh_access_token:
+            results = []
+            threads = [threading.Thread(
+                target=lambda: results.append(spot.get_cached_token()))
+                for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(refresh_access_token.call_count, 1)
+        self.assertEqual(results, [fresh_tok] * 8)
+
+    @patch.object(SpotifyOAuth, 'refresh_access_token')
+    def test_refresh_if_expiring(self, refresh_access_token):
+        spot = _make_oauth("playlist-modify-private")
+        spot.token_info = self._fresh_token(3600)
+        self.assertTrue(spot.refresh_if_expiring(120))
+        self.assertEqual(refresh_access_token.call_count, 0)
+
+        spot.token_info = self._fresh_token(90)
+        self.assertTrue(spot.refresh_if_expiring(120))
+        refresh_access_token.assert_called_with("REFRESH")
+
+        refresh_access_token.return_value = None
+        self.assertFalse(spot.refresh_if_expiring(120))
+
+    def test_refresher_renews_before_expiry(self):
+        spot = _make_oauth("playlist-modify-private")
+        spot.token_info = self._fresh_token(90)
+        refreshed = threading.Event()
+        fresh_tok = self._fresh_token()
+
+        def refresh(refresh_token):
+            spot.token_info = fresh_tok
+            refreshed.set()
+            return fresh_tok
+
+        with patch.object(SpotifyOAuth, 'refresh_access_token',
+                          side_effect=refresh) as refresh_access_token:
+            spot.start_refresher(margin=120)
+            self.assertTrue(refreshed.wait(5))
+            spot.stop_refresher()
+
+        self.assertEqual(refresh_access_token.call_count, 1)
+        self.assertIs(spot.get_cached_token(), fresh_tok)
+
+    def test_refresher_survives_store_errors(self):
+        store = MemoryTokenStore()
+        spot = _make_oauth("playlist-modify-private", token_store=store)
+        spot.token_info = self._fresh_token(90)
+        refreshed = threading.Event()
+        fresh_tok = self._fresh_token()
+
+        def refresh(refresh_token):
+            spot.token_info = fresh_tok
+            refreshed.set()
+            return fresh_tok
+
+        # The first attempt fails, the second one refreshes the token
+        locked = mock.Mock(side_effect=[sqlite3.OperationalError("database is locked"),
+                                        store.lock()])
+        with patch.object(store, 'lock', locked), \
+                patch.object(SpotifyOAuth, '_warn') as warn, \
+                patch.object(SpotifyOAuth, 'refresh_access_token',
+                             side_effect=refresh) as refresh_access_token:
+            spot.start_refresher(margin=120, retry_interval=0.01)
+            self.assertTrue(refreshed.wait(5))
+            spot.stop_refresher()
+
+        self.assertEqual(locked.call_count, 2)
+        self.assertIn("database is locked", warn.call_args[0][0])
+        self.assertEqual(refresh_access_token.call_count, 1)
+
+    def test_refresh_stats(self):
+        session = mock.Mock(spec=requests.Session)
+        spot = _make_oauth("playlist-modify-private", requests_session=session,
+                           requests_timeout=5)
+        session.post.return_value = mock.Mock(status_code=200, json=lambda: {
+            'access_token': 'ACCESS', 'expires_in': 3600})
+        spot.refresh_access_token("REFRESH")
+
+        session.post.return_value = mock.Mock(status_code=400, reason='Bad Request')
+        with patch.object(SpotifyOAuth, '_warn'):
+            spot.refresh_access_token("REFRESH")
+
+        self.assertEqual(session.post.call_args[1]['timeout'], 5)
+        stats = spot.token_refresh_stats()
+        self.assertEqual(stats['refreshes'], 2)
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(spot.token_info['refresh_token'], "REFRESH")
 
 
 class TestSpotifyOAuth(unittest.TestCase):
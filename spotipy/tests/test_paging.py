@@ -0,0 +1,115 @@
+from spotipy.client import Spotify
+import threading
+import time
+import unittest
+
+import six.moves.urllib.parse as urllibparse
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+patch = mock.patch
+
+URL = 'https://api.spotify.com/v1/playlists/1/tracks'
+
+
+class FakePlaylist(object):
+    """ Replaces Spotify._internal_call, serves a playlist paged by offset
+        (or by cursor)
+    """
+
+    def __init__(self, total, limit, cursors=False, delay=0):
+        self.total = total
+        self.limit = limit
+        self.cursors = cursors
+        self.delay = delay
+        self.urls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def page(self, offset):
+        next_offset = offset + self.limit
+        page = {'items': list(range(offset, min(next_offset, self.total))),
+                'limit': self.limit, 'offset': offset, 'total': self.total,
+                'next': None}
+        if next_offset < self.total:
+            page['next'] = '%s?offset=%d&limit=%d&fields=items%%2Cnext' % (
+                URL, next_offset, self.limit)
+        if self.cursors:
+            page['cursors'] = {'after': str(next_offset)}
+        return page
+
+    def __call__(self, method, url, payload, params, deadline=None):
+        with self._lock:
+            self.urls.append(url)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        query = dict(urllibparse.parse_qsl(urllibparse.urlsplit(url).query))
+        # The other parameters are kept
+        assert query['fields'] == 'items,next', query
+        with self._lock:
+            self.running -= 1
+        return self.page(int(query['offset']))
+
+
+class PagingTest(unittest.TestCase):
+
+    def _spotify(self, playlist):
+        spotify = Spotify(auth='TOKEN', coalesce_requests=False)
+        spotify._internal_call = playlist
+        return spotify
+
+    def test_iter_items(self):
+        for prefetch in (True, False):
+            playlist = FakePlaylist(250, 100)
+            spotify = self._spotify(playlist)
+            items = list(spotify.iter_items(playlist.page(0), prefetch=prefetch))
+            self.assertEqual(items, list(range(250)))
+            self.assertEqual(len(playlist.urls), 2)
+
+    def test_iter_pages(self):
+        playlist = FakePlaylist(250, 100)
+        spotify = self._spotify(playlist)
+        pages = list(spotify.iter_pages(playlist.page(0)))
+        self.assertEqual([page['offset'] for page in pages], [0, 100, 200])
+
+    def test_concurrency(self):
+        playlist = FakePlaylist(1000, 50, delay=0.05)
+        spotify = self._spotify(playlist)
+        items = list(spotify.iter_items(playlist.page(0), concurrency=4))
+        self.assertEqual(items, list(range(1000)))
+        self.assertEqual(len(playlist.urls), 19)
+        self.assertGreater(playlist.max_running, 1)
+        self.assertLessEqual(playlist.max_running, 4)
+
+    def test_cursor_pages_sequential(self):
+        playlist = FakePlaylist(200, 50, cursors=True, delay=0.01)
+        spotify = self._spotify(playlist)
+        items = list(spotify.iter_items(playlist.page(0), concurrency=4))
+        self.assertEqual(items, list(range(200)))
+        self.assertEqual(playlist.max_running, 1)
+
+    def test_wrapped_result(self):
+        playlist = FakePlaylist(150, 100)
+        spotify = self._spotify(
+            lambda *args, **kwargs: {'tracks': playlist(*args, **kwargs)})
+        items = list(spotify.iter_items({'tracks': playlist.page(0)}))
+        self.assertEqual(items, list(range(150)))
+
+    def test_stops_early(self):
+        playlist = FakePlaylist(10000, 100)
+        spotify = self._spotify(playlist)
+        for page in spotify.iter_pages(playlist.page(0), concurrency=2):
+            break
+        # Only the pages fetched ahead
+        self.assertLessEqual(len(playlist.urls), 2)
+
+    def test_empty_result(self):
+        spotify = self._spotify(None)
+        self.assertEqual(list(spotify.iter_items(None)), [])
+        self.assertEqual(list(spotify.iter_items(
+            {'items': [], 'next': None, 'total': 0, 'limit': 20, 'offset': 0})), [])
@@ -0,0 +1,43 @@
+from spotipy.ratelimit import RateLimiter
+import time
+import unittest
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_backoff_grows_exponentially(self):
+        limiter = RateLimiter(base_delay=1, max_delay=8)
+
+        for attempt, delay in ((1, 1), (2, 2), (3, 4), (4, 8), (10, 8)):
+            backoff = limiter.backoff(attempt)
+            self.assertTrue(delay / 2 <= backoff <= delay)
+
+    def test_throttle_blocks(self):
+        limiter = RateLimiter()
+        limiter.throttle(30)
+
+        self.assertTrue(29 < limiter.blocked_for() <= 30)
+        self.assertEqual(limiter.stats()['throttled'], 1)
+
+    def test_deadline_fails_fast(self):
+        limiter = RateLimiter()
+        limiter.throttle(30)
+
+        start = time.monotonic()
+        self.assertFalse(limiter.wait(time.monotonic() + 1))
+        self.assertTrue(time.monotonic() - start < 1)
+        self.assertEqual(limiter.stats()['deadline_exceeded'], 1)
+
+    def test_sleep_counts(self):
+        limiter = RateLimiter()
+
+        self.assertTrue(limiter.sleep(0.01))
+        self.assertTrue(limiter.wait())
+
+        stats = limiter.stats()
+        self.assertEqual(stats['backoffs'], 1)
+        self.assertTrue(stats['sleep_time'] >= 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
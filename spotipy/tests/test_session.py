@@ -0,0 +1,111 @@
+from spotipy.client import Spotify, pooled_session
+from spotipy.oauth2 import SpotifyClientCredentials
+import json
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer, socketserver
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+patch = mock.patch
+
+
+class _KeepAliveServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.connections = 0
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers every GET with its path, keeping the connection open
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SharedSessionTest(unittest.TestCase):
+
+    def test_pooled_session_keeps_stats(self):
+        session = pooled_session()
+        spotify = Spotify(auth='TOKEN', requests_session=session)
+        self.assertEqual(spotify.connection_stats(),
+                         {'requests': 0, 'new_connections': 0,
+                          'reused_connections': 0})
+
+    def test_foreign_session_has_no_stats(self):
+        import requests
+        spotify = Spotify(auth='TOKEN', requests_session=requests.Session())
+        self.assertIsNone(spotify.connection_stats())
+
+    def test_token_request_uses_session(self):
+        session = pooled_session()
+        credentials = SpotifyClientCredentials(
+            "CLID", "CLISEC", requests_session=session, requests_timeout=3)
+
+        response = mock.Mock(status_code=200, json=lambda: {
+            'access_token': 'ACCESS', 'expires_in': 3600})
+        with patch.object(session, 'post', return_value=response) as post:
+            self.assertEqual(credentials.get_access_token(), 'ACCESS')
+
+        self.assertEqual(post.call_args[1]['timeout'], 3)
+
+
+class KeepAliveTest(unittest.TestCase):
+    """ Connection reuse against a local server
+    """
+
+    def setUp(self):
+        self.server = _KeepAliveServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def _spotify(self, **kwargs):
+        spotify = Spotify(auth='TOKEN', **kwargs)
+        # Don't send the requests to a proxy configured in the environment
+        spotify._session.trust_env = False
+        spotify.prefix = 'http://127.0.0.1:%d/v1/' % self.server.server_address[1]
+        for i in range(3):
+            self.assertEqual(spotify.track('spotify:track:%d' % i),
+                             {'path': '/v1/tracks/%d' % i})
+        return spotify
+
+    def test_keep_alive(self):
+        spotify = self._spotify()
+
+        self.assertEqual(spotify.connection_stats(),
+                         {'requests': 3, 'new_connections': 1,
+                          'reused_connections': 2})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_no_keep_alive(self):
+        spotify = self._spotify(keep_alive=False)
+
+        self.assertEqual(spotify.connection_stats(),
+                         {'requests': 3, 'new_connections': 3,
+                          'reused_connections': 0})
+        self.assertEqual(self.server.connections, 3)
@@ -0,0 +1,160 @@
+""" Write-behind saving of the bot's config"""
+
+import logging
+import threading
+import time
+
+from spottelbot import botconfig
+from spottelbot import botexceptions
+
+logger = logging.getLogger(__name__)
+
+# Errors which won't go away by trying again. The next change tries again
+_permanent_errors = (botexceptions.CorruptConfig, PermissionError, IsADirectoryError, NotADirectoryError)
+
+# Longest wait (seconds) between two attempts after failed saves. The wait doubles after every failure
+max_retry_delay = 300.0
+
+
+class AutoSaver(object):
+    """
+    Saves the config in the background. Changes are coalesced: after the first change, the saver waits for the
+    given delay before writing the config, so a burst of changes results in a single write. Commands changing the
+    config don't have to wait for the disk. A failed save is retried with an increasing delay, unless the error is
+    permanent.
+    """
+
+    def __init__(self, config: botconfig.BotConfig, delay: float):
+        """
+
+        :param config: The config to save
+        :type config: botconfig.BotConfig
+        :param delay: Seconds to wait for further changes before saving. If 0, schedule() saves immediately
+        :type delay: float
+        """
+        self._config = config
+        self._delay = delay
+        self._condition = threading.Condition()
+        self._dirty_since = None
+        self._stopped = False
+        self._thread = None
+
+        # Only one save at a time (background thread and flush())
+        self._save_lock = threading.Lock()
+
+        # Consecutive failures, a permanent error stops the retries
+        self._failures = 0
+        self._gave_up = False
+        self.saves = 0
+        self.failed_saves = 0
+        self.last_error = None
+
+    def schedule(self):
+        """
+        Marks the config as changed. It will be saved after the delay (or on flush/stop)
+        """
+        if self._delay <= 0:
+            with self._condition:
+                self._dirty_since = time.monotonic()
+                self._gave_up = False
+            try:
+                self.flush()
+            except Exception:
+                # Reported by last_error, tried again on the next change
+                logger.exception("Unable to save the config")
+            return
+
+        with self._condition:
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._gave_up = False
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self.__run, name="autosaver", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def flush(self):
+        """
+        Saves the config now if there are unsaved changes. Raises the error if the config can't be saved
+        """
+        with self._save_lock:
+            with self._condition:
+                if self._dirty_since is None:
+                    return
+                self._dirty_since = None
+
+            try:
+                self._config.save_config(None)
+            except Exception as error:
+                # Try again later (or on the next change)
+                with self._condition:
+                    if self._dirty_since is None:
+                        self._dirty_since = time.monotonic()
+                    self._failures += 1
+                    self._gave_up = isinstance(error, _permanent_errors)
+                    self.failed_saves += 1
+                    self.last_error = error
+                raise
+
+            with self._condition:
+                self._failures = 0
+                self.saves += 1
+                self.last_error = None
+
+    def stats(self) -> dict:
+        """
+
+        :return: The number of saves, failed saves, whether there are unsaved changes and the last error (if the
+        last save failed)
+        :rtype: dict
+        """
+        with self._condition:
+            return {"saves": self.saves, "failures": self.failed_saves, "pending": self._dirty_since is not None,
+                    "last_error": self.last_error}
+
+    def __retry_delay(self) -> float:
+        """
+
+        :return: Seconds to wait before saving, the delay doubles with every failure
+        :rtype: float
+        """
+        if not self._failures:
+            return self._delay
+        return max(self._delay, min(self._delay * 2 ** self._failures, max_retry_delay))
+
+    def stop(self):
+        """
+        Saves pending changes and stops the background thread. Errors are logged, the bot is shutting down anyway
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread = self._thread
+            self._thread = None
+
+        if thread:
+            thread.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Unable to save the config")
+
+    def __run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (self._dirty_since is None or self._gave_up):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+
+                due = self._dirty_since + self.__retry_delay()
+                now = time.monotonic()
+                if now < due:
+                    self._condition.wait(due - now)
+                    continue
+
+            # A failed save marks the config dirty again, so it will be retried after the (increased) delay
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Unable to save the config")
@@ -1,15 +1,137 @@
 """ Bot's config """
 
 import configparser
+import hashlib
+import io
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
 
 from spottelbot import botexceptions
 
+logger = logging.getLogger(__name__)
+
 # Both a bookmark name and a value (Currently playing)
 bookmark_current = "current"
 
 # /delete all, /clear all
 bookmark_all = "all"
 
+# Milliseconds to wait for further changes before the config is saved (0 = save at once)
+default_autosave_delay = 1000
+
+# How to receive the updates from telegram: ask for them (long polling) or let telegram send them (webhook)
+telegram_mode_polling = "polling"
+telegram_mode_webhook = "webhook"
+telegram_modes = (telegram_mode_polling, telegram_mode_webhook)
+
+# Number of threads processing the commands
+default_workers = 4
+
+# Seconds a command waits for a free slot if too many of its kind are running (see the limits section). A waiting
+# command blocks a worker, so by default it's rejected at once
+default_busy_timeout = 0.0
+
+# Where the webhook listens for telegram's updates. Usually behind a reverse proxy which handles SSL
+default_webhook_listen = "127.0.0.1"
+default_webhook_port = 8443
+
+# Seconds a fetched list of recently played tracks may be reused
+default_history_ttl = 5.0
+
+# Seconds between two polls of the recently played tracks, 0 disables the poller
+default_history_poll_interval = 0.0
+
+# Seconds a cached playlist (name) is used before it is revalidated
+default_playlist_ttl = 3600.0
+
+
+# The first line of a saved config, used to detect torn (partially written) files
+_checksum_prefix = "# checksum sha256 "
+_checksum_suffix = " (remove this line after editing the file by hand)"
+
+# The last line of a saved config. A file whose checksum doesn't match has been cut off if this line is missing,
+# otherwise it has been edited by hand
+_end_marker = "# end of config\n"
+
+# The last good copy of the config
+_backup_suffix = ".bak"
+
+
+def _add_checksum(content: str) -> str:
+    """
+
+    :param content: The config file's content
+    :type content: str
+    :return: The content, preceded by the checksum line and followed by the end marker
+    :rtype: str
+    """
+    content += _end_marker
+    return _checksum_prefix + hashlib.sha256(content.encode("utf-8")).hexdigest() + _checksum_suffix + "\n" + content
+
+
+def _verify_checksum(content: str) -> bool:
+    """
+
+    :param content: The config file's content
+    :type content: str
+    :return: False if the file has a checksum line which doesn't match, True otherwise
+    :rtype: bool
+
+    Files without a checksum line (written by hand) are considered fine
+    """
+    if not content.startswith(_checksum_prefix):
+        return True
+
+    first_line, newline, rest = content.partition("\n")
+    checksum = first_line[len(_checksum_prefix):].split(" ", 1)[0]
+    return bool(newline) and hashlib.sha256(rest.encode("utf-8")).hexdigest() == checksum
+
+
+def _read_config_file(file_name: str) -> str:
+    """
+
+    :param file_name: The file to read
+    :type file_name: str
+    :return: The content of the file, None if it doesn't exist
+    :rtype: str
+
+    Reads the file, raises a CorruptConfig exception if it has been cut off (the checksum doesn't match and the end
+    marker is missing). A file edited by hand is fine
+    """
+    try:
+        with open(file_name) as the_file:
+            content = the_file.read()
+    except FileNotFoundError:
+        return None
+
+    if not _verify_checksum(content) and not content.endswith(_end_marker):
+        raise botexceptions.CorruptConfig(str(file_name))
+    return content
+
+
+def _fsync_directory(directory: str):
+    """
+
+    :param directory: The directory to sync
+    :type directory: str
+
+    Makes sure a rename in the directory is on disk. Not possible on every platform, so errors are ignored
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 
 # Make sure that "current" is first in list. After that, the list can be sorted alphabetically
 def _bookmark_compare(key):
@@ -45,21 +167,63 @@ class BotConfig(object):
     _telegram_section = "telegram"
     _telegram_entry_token = "token"
     _telegram_entry_users = "users"
+    _telegram_entry_autosave_delay = "autosave_delay"
+    _telegram_entry_mode = "mode"
+    _telegram_entry_workers = "workers"
+    _telegram_entry_webhook_listen = "webhook_listen"
+    _telegram_entry_webhook_port = "webhook_port"
+    _telegram_entry_webhook_path = "webhook_path"
+    _telegram_entry_webhook_url = "webhook_url"
+    _telegram_entry_busy_timeout = "busy_timeout"
     _spotify_section = "spotify"
     _spotify_entry_username = "username"
     _spotify_entry_client_id = "client_id"
     _spotify_entry_client_secret = "client_secret"
     _spotify_entry_redirect_uri = "redirect_uri"
+    _spotify_entry_history_ttl = "history_ttl"
+    _spotify_entry_history_poll_interval = "history_poll_interval"
+    _spotify_entry_history_file = "history_file"
+    _spotify_entry_playlist_ttl = "playlist_ttl"
+    _spotify_entry_metadata_file = "metadata_file"
+    _spotify_entry_token_file = "token_file"
     _bookmark_section = "bookmarks"
+    _limits_section = "limits"
     _config_file = None
 
-    def __init__(self):
+    def __init__(self, fsync: bool = True):
+        """
+
+        :param fsync: Flush the saved config to disk before replacing the old one. Slower, but survives a crash
+        :type fsync: bool
+        """
         self._config = None
+        self.fsync = fsync
         self.access = set()
         self.bookmarks = {}
         self._translation_table = dict.fromkeys(map(ord, " \t"), "_")
         self._config_file_name = None
 
+        # The config may be saved in the background while commands change it
+        self._lock = threading.RLock()
+        # Only one save at a time
+        self._save_lock = threading.Lock()
+        self.autosave_delay = default_autosave_delay
+        self.telegram_mode = telegram_mode_polling
+        self.workers = default_workers
+        self.webhook_listen = default_webhook_listen
+        self.webhook_port = default_webhook_port
+        self.webhook_path = ""
+        self.webhook_url = None
+        self.busy_timeout = default_busy_timeout
+        # command -> maximum number of concurrent calls
+        self.command_limits = {}
+        self._spotify_history_ttl = default_history_ttl
+        self._spotify_history_poll_interval = default_history_poll_interval
+        self._spotify_history_file = None
+        self._spotify_playlist_ttl = default_playlist_ttl
+        self._spotify_metadata_file = None
+        self._spotify_token_file = None
+
     def load_config(self, configfile_name: str) -> str:
         """
 
@@ -71,7 +235,9 @@ class BotConfig(object):
         """
 
         try:
-            self._load_config(configfile_name)
+            with self._lock:
+                self._load_config(configfile_name)
+            self.__accept_hand_edit(self._config_file_name)
             return None
         except botexceptions.InvalidUser as invalid:
             return "Invalid User " + invalid.bad_id
@@ -89,6 +255,12 @@ class BotConfig(object):
             return "Missing spotify username"
         except configparser.MissingSectionHeaderError:
             return "No sections in configfile"
+        except botexceptions.CorruptConfig as corrupt:
+            return "Corrupt config file " + corrupt.file_name
+        except botexceptions.InvalidTelegramMode as invalid:
+            return "Invalid telegram mode " + invalid.invalid_mode
+        except ValueError as invalid:
+            return "Invalid value: " + str(invalid)
 
     def save_config(self, configfile_name: str):
         """
@@ -98,22 +270,126 @@ class BotConfig(object):
         :return:
         :rtype:
 
-        Write the config into the specified configfile
+        Write the config into the specified configfile. The config is written into a temporary file first which
+        then replaces the configfile, so a crash can't leave a partially written config. The previous config is
+        kept as the last good copy (configfile.bak)
         """
 
         the_file_name = configfile_name
         if not configfile_name:
             the_file_name = self._config_file_name
 
-        the_file = open(the_file_name, "w")
+        # The content is taken under the lock, commands don't have to wait for the disk. The save lock is taken
+        # first, so an older content can't replace a newer one
+        with self._save_lock:
+            with self._lock:
+                self._save_telegram_config()
+                self._save_spotify_config()
+                self._save_bookmarks()
+                self._save_limits()
+                content = io.StringIO()
+                self._config.write(content)
+
+            self.__write_atomic(str(the_file_name), _add_checksum(content.getvalue()))
+            with self._lock:
+                self._config_file_name = the_file_name
+
+    def __write_atomic(self, file_name: str, content: str):
+        """
+
+        :param file_name: The file to (re)place
+        :type file_name: str
+        :param content: The new content
+        :type content: str
+
+        Writes the content into a temporary file in the same directory and renames it to file_name
+        """
+        directory = os.path.dirname(os.path.abspath(file_name))
+        fd, temp_file_name = tempfile.mkstemp(prefix="." + os.path.basename(file_name) + ".", suffix=".tmp",
+                                              dir=directory)
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                temp_file.write(content)
+                temp_file.flush()
+                if self.fsync:
+                    os.fsync(temp_file.fileno())
 
-        the_file.seek(0)
-        self._save_telegram_config()
-        self._save_spotify_config()
-        self._save_bookmarks()
-        self._config.write(the_file)
-        the_file.truncate()  # The (overwritten) file might be smaller than it used to be (comments, bookmarks..)
-        the_file.seek(0)
+            if os.path.exists(file_name):
+                # Keep the permissions (the config contains the telegram token)
+                os.chmod(temp_file_name, stat.S_IMODE(os.stat(file_name).st_mode))
+                self.__backup(file_name)
+
+            os.replace(temp_file_name, file_name)
+        except BaseException:
+            if os.path.exists(temp_file_name):
+                os.unlink(temp_file_name)
+            raise
+
+        if self.fsync:
+            _fsync_directory(directory)
+
+    def __backup(self, file_name: str):
+        """
+
+        :param file_name: The config file about to be replaced
+        :type file_name: str
+
+        Keeps the current config file as the last good copy, unless it's torn itself
+        """
+        try:
+            if _read_config_file(file_name) is None:
+                return
+        except botexceptions.CorruptConfig:
+            return
+
+        backup_file_name = file_name + _backup_suffix
+        temp_backup_file_name = backup_file_name + ".tmp"
+        try:
+            os.link(file_name, temp_backup_file_name)
+        except FileExistsError:
+            os.unlink(temp_backup_file_name)
+            os.link(file_name, temp_backup_file_name)
+        except OSError:
+            # No hard links on this filesystem
+            shutil.copy2(file_name, temp_backup_file_name)
+        os.replace(temp_backup_file_name, backup_file_name)
+
+    def __accept_hand_edit(self, file_name: str):
+        """
+
+        :param file_name: The config file just loaded
+        :type file_name: str
+
+        A file edited by hand after it has been saved doesn't match its checksum anymore. It's kept as the last good
+        copy and its checksum is rewritten, so it's taken as a good copy from now on
+        """
+        with self._save_lock:
+            try:
+                content = _read_config_file(file_name)
+            except botexceptions.CorruptConfig:
+                return
+            if content is None or _verify_checksum(content):
+                return
+
+            logger.info("Config file %s has been edited by hand, updating its checksum", file_name)
+            content = content.partition("\n")[2]
+            try:
+                self.__write_atomic(str(file_name), _add_checksum(content[:-len(_end_marker)]))
+            except OSError:
+                logger.warning("Unable to update the checksum of %s", file_name, exc_info=True)
+
+    def config_relative_path(self, file_name: str) -> str:
+        """
+
+        :param file_name: A file name from the config
+        :type file_name: str
+        :return: The file name. Relative names are relative to the config file's directory
+        :rtype: str
+        """
+        file_name = os.path.expanduser(file_name)
+        if os.path.isabs(file_name) or not self._config_file_name:
+            return file_name
+        return os.path.join(os.path.dirname(os.path.abspath(self._config_file_name)), file_name)
 
     def has_access(self, telegram_id: str) -> bool:
         """
@@ -133,10 +409,11 @@ class BotConfig(object):
         Raises an IllegalUsername when the telegram_id is not numeric and doesn't start with an @
         """
         _check_telegram_id(telegram_id)
-        if self.has_access(telegram_id):
-            raise KeyError(telegram_id)
+        with self._lock:
+            if self.has_access(telegram_id):
+                raise KeyError(telegram_id)
 
-        self.access.add(telegram_id)
+            self.access.add(telegram_id)
 
     def remove_access(self, telegram_id: str):
         """
@@ -147,13 +424,15 @@ class BotConfig(object):
         """
 
         # No need to check the ID. Since add_access checks, the (illegal) ID can't be here.
-        self.access.remove(telegram_id)
+        with self._lock:
+            self.access.remove(telegram_id)
 
     def clear_access(self):
         """
         Empties the access list/dictionary. Used in (re)loading the config
         """
-        self.access = set()
+        with self._lock:
+            self.access = set()
 
     def set_bookmark(self, bookmark_name: str, track_id: str, playlist_id: str = None):
         """
@@ -175,7 +454,8 @@ class BotConfig(object):
         if sanitzed.isdigit() or sanitzed == bookmark_all:
             raise botexceptions.InvalidBookmark(sanitzed)
 
-        self.bookmarks[self._sanitize_bookmark(bookmark_name)] = (track_id, playlist_id)
+        with self._lock:
+            self.bookmarks[sanitzed] = (track_id, playlist_id)
 
     def get_bookmark(self, bookmark_name: str) -> (str, str):
         """
@@ -195,7 +475,8 @@ class BotConfig(object):
         Clears the bookmark. If the bookmark doesn't exist a KeyError will be raised
         """
 
-        del self.bookmarks[self._sanitize_bookmark(bookmark_name)]
+        with self._lock:
+            del self.bookmarks[self._sanitize_bookmark(bookmark_name)]
 
     def get_bookmarks(self) -> list:
         """
@@ -203,7 +484,8 @@ class BotConfig(object):
         :rtype list
         Returns the name of the bookmarks in a sorteds list, with "current" as the first entry
         """
-        return sorted(self.bookmarks.keys(), key=_bookmark_compare)
+        with self._lock:
+            return sorted(self.bookmarks.keys(), key=_bookmark_compare)
 
     def clear_bookmarks(self):
         """
@@ -211,7 +493,8 @@ class BotConfig(object):
         :rtype:
         Empties the bookmark list, either by command or by reloading the config
         """
-        self.bookmarks = {}
+        with self._lock:
+            self.bookmarks = {}
 
     def _sanitize_bookmark(self, bookmark_string: str) -> str:
         """
@@ -241,8 +524,19 @@ class BotConfig(object):
         if not configfile_name:
             the_config_file_name = self._config_file_name
 
+        try:
+            content = _read_config_file(the_config_file_name)
+        except botexceptions.CorruptConfig:
+            # Torn file (crash while saving?) - use the last good copy if there is one
+            backup_file_name = str(the_config_file_name) + _backup_suffix
+            content = _read_config_file(backup_file_name)
+            if content is None:
+                raise
+            logger.warning("Config file %s is corrupt, using %s", the_config_file_name, backup_file_name)
+
         self._config = configparser.ConfigParser()
-        self._config.read(the_config_file_name)
+        if content is not None:
+            self._config.read_string(content, str(the_config_file_name))
 
         try:
             self._load_telegram_config()
@@ -251,6 +545,8 @@ class BotConfig(object):
             if self._bookmark_section in self._config:
                 self._load_bookmarks()
 
+            self._load_limits()
+
         # Transform generic exceptions into more specific ones which are more easily processed, resulting in more
         # readable code
         except KeyError as key_error:
@@ -290,6 +586,20 @@ class BotConfig(object):
             except KeyError as k:
                 raise botexceptions.DuplicateUsers(stripped) from k
 
+        self.autosave_delay = self._config[self._telegram_section].getint(self._telegram_entry_autosave_delay,
+                                                                          fallback=default_autosave_delay)
+
+        telegram_section = self._config[self._telegram_section]
+        self.telegram_mode = telegram_section.get(self._telegram_entry_mode, fallback=telegram_mode_polling).strip()
+        if self.telegram_mode not in telegram_modes:
+            raise botexceptions.InvalidTelegramMode(self.telegram_mode)
+        self.workers = telegram_section.getint(self._telegram_entry_workers, fallback=default_workers)
+        self.webhook_listen = telegram_section.get(self._telegram_entry_webhook_listen, fallback=default_webhook_listen)
+        self.webhook_port = telegram_section.getint(self._telegram_entry_webhook_port, fallback=default_webhook_port)
+        self.webhook_path = telegram_section.get(self._telegram_entry_webhook_path, fallback="")
+        self.webhook_url = telegram_section.get(self._telegram_entry_webhook_url)
+        self.busy_timeout = telegram_section.getfloat(self._telegram_entry_busy_timeout, fallback=default_busy_timeout)
+
     def _save_telegram_config(self):
         """
         Saves the telegram section
@@ -301,6 +611,24 @@ class BotConfig(object):
         if self.access:
             self._config[self._telegram_section][self._telegram_entry_users] = \
                 ",".join(str(telegram_id) for telegram_id in self.access)
+        if self.autosave_delay != default_autosave_delay:
+            self._config[self._telegram_section][self._telegram_entry_autosave_delay] = str(self.autosave_delay)
+
+        telegram_section = self._config[self._telegram_section]
+        if self.telegram_mode != telegram_mode_polling:
+            telegram_section[self._telegram_entry_mode] = self.telegram_mode
+        if self.workers != default_workers:
+            telegram_section[self._telegram_entry_workers] = str(self.workers)
+        if self.webhook_listen != default_webhook_listen:
+            telegram_section[self._telegram_entry_webhook_listen] = self.webhook_listen
+        if self.webhook_port != default_webhook_port:
+            telegram_section[self._telegram_entry_webhook_port] = str(self.webhook_port)
+        if self.webhook_path:
+            telegram_section[self._telegram_entry_webhook_path] = self.webhook_path
+        if self.webhook_url:
+            telegram_section[self._telegram_entry_webhook_url] = self.webhook_url
+        if self.busy_timeout != default_busy_timeout:
+            telegram_section[self._telegram_entry_busy_timeout] = str(self.busy_timeout)
 
     def _load_spotify_config(self):
         """
@@ -314,6 +642,15 @@ class BotConfig(object):
         self._spotify_client_id = self._config[self._spotify_section].get(self._spotify_entry_client_id)
         self._spotify_client_secret = self._config[self._spotify_section].get(self._spotify_entry_client_secret)
         self._spotify_redirect_uri = self._config[self._spotify_section].get(self._spotify_entry_redirect_uri)
+        self._spotify_history_ttl = self._config[self._spotify_section].getfloat(self._spotify_entry_history_ttl,
+                                                                                 fallback=default_history_ttl)
+        self._spotify_history_poll_interval = self._config[self._spotify_section].getfloat(
+            self._spotify_entry_history_poll_interval, fallback=default_history_poll_interval)
+        self._spotify_history_file = self._config[self._spotify_section].get(self._spotify_entry_history_file)
+        self._spotify_playlist_ttl = self._config[self._spotify_section].getfloat(self._spotify_entry_playlist_ttl,
+                                                                                  fallback=default_playlist_ttl)
+        self._spotify_metadata_file = self._config[self._spotify_section].get(self._spotify_entry_metadata_file)
+        self._spotify_token_file = self._config[self._spotify_section].get(self._spotify_entry_token_file)
 
     def _save_spotify_config(self):
         """
@@ -334,6 +671,25 @@ class BotConfig(object):
         if self._spotify_redirect_uri:
             self._config[self._spotify_section][self._spotify_entry_redirect_uri] = self._spotify_redirect_uri
 
+        if self._spotify_history_ttl != default_history_ttl:
+            self._config[self._spotify_section][self._spotify_entry_history_ttl] = str(self._spotify_history_ttl)
+
+        if self._spotify_history_poll_interval != default_history_poll_interval:
+            self._config[self._spotify_section][self._spotify_entry_history_poll_interval] = \
+                str(self._spotify_history_poll_interval)
+
+        if self._spotify_history_file:
+            self._config[self._spotify_section][self._spotify_entry_history_file] = self._spotify_history_file
+
+        if self._spotify_playlist_ttl != default_playlist_ttl:
+            self._config[self._spotify_section][self._spotify_entry_playlist_ttl] = str(self._spotify_playlist_ttl)
+
+        if self._spotify_metadata_file:
+            self._config[self._spotify_section][self._spotify_entry_metadata_file] = self._spotify_metadata_file
+
+        if self._spotify_token_file:
+            self._config[self._spotify_section][self._spotify_entry_token_file] = self._spotify_token_file
+
     def _load_bookmarks(self):
         """
 
@@ -354,6 +710,36 @@ class BotConfig(object):
                 playlist_id = splitted[1].strip()
             self.set_bookmark(bookmark_name, track_id, playlist_id)
 
+    def _load_limits(self):
+        """
+
+        Loads the per command limits (optional section)
+        """
+
+        self.command_limits = {}
+        if self._limits_section not in self._config:
+            return
+
+        for command, limit in self._config[self._limits_section].items():
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("{} = {}".format(command, limit))
+            self.command_limits[command] = limit
+
+    def _save_limits(self):
+        """
+
+        Saves the per command limits
+        """
+
+        if self._config.has_section(self._limits_section):
+            self._config.remove_section(self._limits_section)
+
+        if self.command_limits:
+            self._config.add_section(self._limits_section)
+            for command, limit in self.command_limits.items():
+                self._config[self._limits_section][command] = str(limit)
+
     def _save_bookmarks(self):
         """
 
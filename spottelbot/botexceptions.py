@@ -45,6 +45,18 @@ class InvalidRange(Exception):
         self.invalid_argument = argument
 
 
+# The config file has been cut off (and there's no usable backup)
+class CorruptConfig(Exception):
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+
+
+# Telegram mode neither polling nor webhook
+class InvalidTelegramMode(Exception):
+    def __init__(self, mode=None):
+        self.invalid_mode = mode
+
+
 # Unable to connect to spotify
 class SpotifyAuth(Exception):
     pass
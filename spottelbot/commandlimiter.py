@@ -0,0 +1,131 @@
+""" Limits the number of commands running at the same time"""
+
+import collections
+import threading
+import time
+
+
+class _CommandState(object):
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit) if limit else None
+        self.calls = 0
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+
+
+class CommandLimiter(object):
+    """
+    Keeps slow commands from occupying all worker threads: a command with a limit runs at most limit times at the
+    same time. Further calls are rejected, or wait for a free slot (up to the timeout) as long as the limited commands
+    don't occupy too many workers, so fast commands always find a free worker.
+    """
+
+    def __init__(self, limits: dict, timeout: float, max_occupied: int = None):
+        """
+
+        :param limits: command -> maximum number of concurrent calls. Commands not in here aren't limited
+        :type limits: dict
+        :param timeout: Seconds a call waits for a free slot before it's rejected (0 = reject at once)
+        :type timeout: float
+        :param max_occupied: Maximum number of threads the limited commands may occupy, running or waiting. A call
+        which would exceed it is rejected at once instead of waiting (None = no maximum)
+        :type max_occupied: int
+        """
+        self._limits = limits
+        self._timeout = timeout
+        self._max_occupied = max_occupied
+        self._lock = threading.Lock()
+        self._commands = collections.OrderedDict()
+
+    def __state(self, command: str) -> _CommandState:
+        with self._lock:
+            state = self._commands.get(command)
+            if state is None:
+                state = _CommandState(self._limits.get(command))
+                self._commands[command] = state
+            return state
+
+    def acquire(self, command: str) -> bool:
+        """
+
+        :param command: The command
+        :type command: str
+        :return: True if the command may run, False if it has been rejected
+        :rtype: bool
+
+        Waits for a free slot. Has to be followed by release() if successful
+        """
+        state = self.__state(command)
+
+        if state.semaphore is None:
+            with self._lock:
+                state.calls += 1
+                state.running += 1
+            return True
+
+        # A waiting call blocks a worker thread as well
+        with self._lock:
+            acquired = state.semaphore.acquire(blocking=False)
+            may_wait = not acquired and self._timeout > 0 and (
+                    self._max_occupied is None or self.__occupied() < self._max_occupied)
+            if acquired:
+                state.calls += 1
+                state.running += 1
+                return True
+            if not may_wait:
+                state.rejected += 1
+                return False
+            state.waiting += 1
+            state.max_waiting = max(state.max_waiting, state.waiting)
+
+        start = time.monotonic()
+        acquired = state.semaphore.acquire(timeout=self._timeout)
+
+        with self._lock:
+            state.waiting -= 1
+            state.wait_time += time.monotonic() - start
+            if acquired:
+                state.calls += 1
+                state.running += 1
+            else:
+                state.rejected += 1
+        return acquired
+
+    def __occupied(self) -> int:
+        """
+
+        :return: Number of limited calls running or waiting. Caller holds the lock
+        :rtype: int
+        """
+        return sum(state.running + state.waiting for state in self._commands.values() if state.semaphore is not None)
+
+    def release(self, command: str):
+        """
+
+        :param command: The command
+        :type command: str
+
+        The command has finished
+        """
+        state = self.__state(command)
+        with self._lock:
+            state.running -= 1
+        if state.semaphore is not None:
+            state.semaphore.release()
+
+    def stats(self) -> dict:
+        """
+
+        :return: command -> dict of limit, calls, running, waiting, max_waiting, rejected and the average wait time
+        :rtype: dict
+        """
+        with self._lock:
+            return {command: {"limit": state.limit, "calls": state.calls, "running": state.running,
+                              "waiting": state.waiting, "max_waiting": state.max_waiting,
+                              "rejected": state.rejected,
+                              "average_wait": state.wait_time / max(1, state.calls + state.rejected)}
+                    for command, state in self._commands.items()}
@@ -0,0 +1,160 @@
+""" Local, persistent store of the recently played tracks"""
+
+import datetime
+import json
+import sqlite3
+import threading
+
+import dateutil.parser
+
+
+# Only the fields needed to format a track are stored
+_track_fields = ("name", "uri")
+_track_named_fields = ("album",)
+_track_named_lists = ("artists",)
+
+
+def parse_played_at(played_at_object: str) -> datetime.datetime:
+    """
+
+    :param played_at_object: The content of 'played_at' ("2018-07-06T12:34:56.789Z")
+    :type played_at_object: str
+    :return: The (timezone aware) datetime
+    :rtype: datetime.datetime
+
+    Spotify always uses the same ISO-8601 format (UTC, optional fraction of seconds), which can be parsed much faster
+    than by dateutil's generic parser. Anything else is handed over to dateutil.
+    """
+    try:
+        if (len(played_at_object) >= 20 and played_at_object[-1] == "Z" and played_at_object[4] == "-" and
+                played_at_object[7] == "-" and played_at_object[10] == "T" and played_at_object[13] == ":" and
+                played_at_object[16] == ":"):
+            microsecond = 0
+            if len(played_at_object) > 20:
+                fraction = played_at_object[20:-1]
+                if played_at_object[19] != "." or not fraction.isdigit():
+                    raise ValueError(played_at_object)
+                microsecond = int(fraction[:6].ljust(6, "0"))
+            elif played_at_object[19] != "Z":
+                raise ValueError(played_at_object)
+
+            return datetime.datetime(int(played_at_object[0:4]), int(played_at_object[5:7]),
+                                     int(played_at_object[8:10]), int(played_at_object[11:13]),
+                                     int(played_at_object[14:16]), int(played_at_object[17:19]), microsecond,
+                                     tzinfo=datetime.timezone.utc)
+    except ValueError:
+        pass
+
+    return dateutil.parser.parse(played_at_object)
+
+
+def _played_at_ms(played_at: str) -> int:
+    """
+
+    :param played_at: The content of 'played_at' ("2018-07-06T...")
+    :type played_at: str
+    :return: milliseconds since the epoch
+    :rtype: int
+    """
+    return int(parse_played_at(played_at).timestamp() * 1000)
+
+
+def _slim_track(track_object: dict) -> dict:
+    """
+
+    :param track_object: spotify's track object
+    :type track_object: dict
+    :return: The track object, reduced to the fields the bot uses
+    :rtype: dict
+    """
+    slim = {field: track_object.get(field) for field in _track_fields}
+    for field in _track_named_fields:
+        slim[field] = {"name": track_object[field]["name"]}
+    for field in _track_named_lists:
+        slim[field] = [{"name": item["name"]} for item in track_object[field]]
+    return slim
+
+
+def _slim_context(context_object: dict) -> dict:
+    """
+
+    :param context_object: spotify's context object (may be None)
+    :type context_object: dict
+    :return: The context object, reduced to type and URI
+    :rtype: dict
+    """
+    if not context_object:
+        return None
+    return {"type": context_object.get("type"), "uri": context_object.get("uri")}
+
+
+class HistoryStore(object):
+    """
+    An append only store of play history objects, indexed by the time the track was played. Spotify only keeps the
+    last 50 tracks, the store keeps everything it has ever seen.
+    """
+
+    def __init__(self, file_name: str):
+        """
+
+        :param file_name: The sqlite database. Will be created if it doesn't exist
+        :type file_name: str
+        """
+        # The store is used by the telegram worker threads and the poller, access is serialized by the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(file_name), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS plays ("
+                             "played_at INTEGER PRIMARY KEY, "
+                             "played_at_string TEXT NOT NULL, "
+                             "track TEXT NOT NULL, "
+                             "context TEXT)")
+
+    def add(self, play_history_objects: list):
+        """
+
+        :param play_history_objects: list of PHOs as returned by spotify
+        :type play_history_objects: list
+
+        Adds the play history objects. Already stored ones (same played_at) are ignored
+        """
+        rows = []
+        for play_history_object in play_history_objects:
+            played_at = play_history_object["played_at"]
+            rows.append((_played_at_ms(played_at), played_at,
+                         json.dumps(_slim_track(play_history_object["track"])),
+                         json.dumps(_slim_context(play_history_object.get("context")))))
+
+        if not rows:
+            return
+
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO plays VALUES (?, ?, ?, ?)", rows)
+
+    def get(self, lower: int, upper: int) -> list:
+        """
+
+        :param lower: the lower index (0 = most recently played)
+        :type lower: int
+        :param upper: the upper index, >= lower
+        :type upper: int
+        :return: list of PHOs
+        :rtype: list
+
+        Returns the play history objects defined by lower and upper index, most recently played first
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT played_at_string, track, context FROM plays "
+                                    "ORDER BY played_at DESC LIMIT ? OFFSET ?",
+                                    (upper - lower + 1, lower)).fetchall()
+
+        return [{"played_at": played_at, "track": json.loads(track), "context": json.loads(context)}
+                for played_at, track, context in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM plays").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
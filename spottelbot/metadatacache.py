@@ -0,0 +1,333 @@
+""" Cache of spotify's metadata (tracks, playlists..)"""
+
+import collections
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _size(value) -> int:
+    """
+
+    :param value: a cached value (JSON serializable)
+    :return: The (approximate) number of bytes the value takes
+    :rtype: int
+    """
+    return len(json.dumps(value))
+
+
+class MetadataStore(object):
+    """
+    Persistent backing store of the metadata cache (sqlite), so the cache survives restarts. Entries are read on
+    demand, writes are done in the background (batched) so callers don't wait for the disk.
+    """
+
+    def __init__(self, file_name: str, maxsize: int):
+        """
+
+        :param file_name: The sqlite database. Will be created if it doesn't exist
+        :type file_name: str
+        :param maxsize: Maximum number of entries. Older ones are removed when the store is opened
+        :type maxsize: int
+        """
+        # Reads happen in the callers' threads, writes in the writer thread
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(file_name), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                             "key TEXT PRIMARY KEY, "
+                             "value TEXT NOT NULL, "
+                             "expires REAL, "
+                             "stored REAL NOT NULL)")
+            self._db.execute("DELETE FROM metadata WHERE key NOT IN "
+                             "(SELECT key FROM metadata ORDER BY stored DESC LIMIT ?)", (maxsize,))
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self.__write_loop, name="metadatastore", daemon=True)
+        self._writer.start()
+
+    def get(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :return: (value, expires) or None if the key isn't stored
+        :rtype: tuple
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            row = self._db.execute("SELECT value, expires FROM metadata WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value, expires: float):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :param value: The value (JSON serializable)
+        :param expires: time.time() the value expires, None = never
+        :type expires: float
+
+        Stores the entry (in the background)
+        """
+        self._queue.put((key, json.dumps(value), expires))
+
+    def delete(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+
+        Deletes the entry (in the background)
+        """
+        self._queue.put((key, None, None))
+
+    def flush(self):
+        """
+        Waits until everything has been written
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the pending entries and closes the database. Can be called more than once
+        """
+        if self._closed:
+            return
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._db.close()
+
+    def __write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Everything that has piled up is written in one transaction
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.__write(batch)
+            except Exception:
+                logger.exception("Unable to write the metadata cache")
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+
+    def __write(self, batch: list):
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            with self._db:
+                for key, value, expires in batch:
+                    if value is None:
+                        self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                    else:
+                        self._db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                                         (key, value, expires, now))
+
+
+class MetadataCache(object):
+    """
+    A LRU cache with a time to live per entry, bounded by the number of entries and (optionally) the total size of
+    the values. Expired entries are not thrown away at once: they can be revalidated (see get_stale and touch), which
+    is cheaper than fetching them again.
+    """
+
+    def __init__(self, maxsize: int, max_bytes: int = None, ttl: float = None, store: MetadataStore = None):
+        """
+
+        :param maxsize: Maximum number of entries
+        :type maxsize: int
+        :param max_bytes: Maximum total size of the values (approximately, None = unlimited)
+        :type max_bytes: int
+        :param ttl: Default number of seconds an entry is valid (None = forever)
+        :type ttl: float
+        :param store: Optional persistent store. Entries not in memory are looked up there, changes are written to it
+        :type store: MetadataStore
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+
+        self._lock = threading.Lock()
+        # key -> (value, expires, size)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :return: The value or None if it isn't cached or has expired
+        """
+        self.__load(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires, size = entry
+            if expires is not None and expires <= time.time():
+                self.expirations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :return: The value, even if it has expired, or None
+
+        Returns the value for revalidation
+        """
+        self.__load(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def set(self, key: str, value, ttl: float = -1):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :param value: The value (JSON serializable)
+        :param ttl: seconds the value is valid. Default: the cache's ttl, None = forever
+        :type ttl: float
+        """
+        if ttl == -1:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        size = _size(value)
+
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry:
+                self._bytes -= old_entry[2]
+            self._entries[key] = (value, expires, size)
+            self._bytes += size
+            self.__evict()
+
+        if self.store:
+            self.store.put(key, value, expires)
+
+    def touch(self, key: str, ttl: float = -1):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        :param ttl: seconds the value is valid from now on. Default: the cache's ttl, None = forever
+        :type ttl: float
+
+        Marks an (expired) entry as valid again, after it has been revalidated
+        """
+        if ttl == -1:
+            ttl = self.ttl
+
+        expires = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return
+            value = entry[0]
+            self._entries[key] = (value, expires, entry[2])
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+
+        if self.store:
+            self.store.put(key, value, expires)
+
+    def invalidate(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._bytes -= entry[2]
+
+        if self.store:
+            self.store.delete(key)
+
+    def stats(self) -> dict:
+        """
+
+        :return: The counters, the number of entries and their size
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "expirations": self.expirations,
+                    "revalidations": self.revalidations, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+    def __load(self, key: str):
+        """
+
+        :param key: The key (spotify URI)
+        :type key: str
+
+        Loads the entry from the store, if it isn't in memory
+        """
+        if not self.store:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+
+        stored = self.store.get(key)
+        if stored is None:
+            return
+
+        value, expires = stored
+        size = _size(value)
+        with self._lock:
+            # Might have been set in the meantime
+            if key not in self._entries:
+                self._entries[key] = (value, expires, size)
+                self._bytes += size
+                self.__evict()
+
+    def __evict(self):
+        # Caller holds the lock. Plain LRU: expired entries stay until evicted, they may still be revalidated
+        while self._entries and (len(self._entries) > self.maxsize or
+                                 (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key, (value, expires, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
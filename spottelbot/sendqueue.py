@@ -0,0 +1,282 @@
+""" Outbound message queue, honoring telegram's flood limits"""
+
+import collections
+import logging
+import threading
+import time
+
+import telegram
+import telegram.error
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one message per second per chat (short bursts are ok)
+global_rate = 30.0
+global_burst = 30
+chat_rate = 1.0
+chat_burst = 3
+
+# Number of retries if a message couldn't be sent because of network problems
+max_retries = 3
+
+
+class TokenBucket(object):
+    """
+    Allows rate events per second on average, up to burst events at once
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+
+        :param rate: events per second
+        :type rate: float
+        :param burst: maximum number of events at once
+        :type burst: int
+        """
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    def __refill(self, now: float):
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def delay(self, now: float) -> float:
+        """
+
+        :param now: time.monotonic()
+        :type now: float
+        :return: Seconds until the next event is allowed (0 = now)
+        :rtype: float
+        """
+        self.__refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self, now: float):
+        """
+
+        :param now: time.monotonic()
+        :type now: float
+
+        Uses up a token
+        """
+        self.__refill(now)
+        self._tokens -= 1
+
+    def full(self, now: float) -> bool:
+        """
+
+        :param now: time.monotonic()
+        :type now: float
+        :return: True if the bucket has been refilled completely (and can be forgotten)
+        :rtype: bool
+        """
+        self.__refill(now)
+        return self._tokens >= self._burst
+
+
+class SendQueue(object):
+    """
+    Sends the messages in the background, so commands don't have to wait for telegram. Messages are sent in order per
+    chat and as fast as telegram's limits allow (token buckets per chat and overall). Adjacent messages to the same
+    chat are merged if they fit into one. If telegram asks to slow down (RetryAfter), sending pauses as long as told.
+
+    Has the same send_message() as telegram.Bot, so it can be used instead of it.
+    """
+
+    def __init__(self, bot: telegram.Bot, max_length: int):
+        """
+
+        :param bot: The bot sending the messages
+        :type bot: telegram.Bot
+        :param max_length: Maximum length of a message (for merging)
+        :type max_length: int
+        """
+        self._bot = bot
+        self._max_length = max_length
+        self._condition = threading.Condition()
+        # chat_id -> deque of (text, kwargs, retries)
+        self._chats = collections.OrderedDict()
+        self._chat_buckets = {}
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._blocked_until = 0.0
+        self._sending = False
+        self._stopped = False
+
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.timed_out = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self.__run, name="sendqueue", daemon=True)
+        self._thread.start()
+
+    def send_message(self, chat_id, text: str, **kwargs):
+        """
+
+        :param chat_id: The chat to send the message to
+        :param text: The message
+        :type text: str
+        :param kwargs: args to pass to bot.send_message()
+
+        Queues the message and returns at once
+        """
+        with self._condition:
+            self._chats.setdefault(chat_id, collections.deque()).append((text, kwargs, 0))
+            self._condition.notify()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+
+        :param timeout: Maximum number of seconds to wait (None = no limit)
+        :type timeout: float
+        :return: True if all messages have been sent
+        :rtype: bool
+
+        Waits until the queue is empty
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._chats and not self._sending, timeout)
+
+    def stop(self, timeout: float = 10):
+        """
+
+        :param timeout: Maximum number of seconds to wait for the pending messages
+        :type timeout: float
+
+        Sends the pending messages and stops
+        """
+        self.flush(timeout)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        """
+
+        :return: The number of messages sent, merged, retried, timed out, failed and still queued
+        :rtype: dict
+        """
+        with self._condition:
+            return {"sent": self.sent, "merged": self.merged, "retried": self.retried, "timed_out": self.timed_out,
+                    "failed": self.failed, "queued": sum(len(messages) for messages in self._chats.values())}
+
+    def __next_message(self):
+        """
+
+        :return: (chat_id, text, kwargs, retries) or None if the queue has been stopped
+
+        Waits until a message may be sent. Caller holds the condition
+        """
+        while True:
+            if self._stopped:
+                return None
+
+            now = time.monotonic()
+            delay = None
+            if self._chats:
+                delay = max(self._blocked_until - now, self._global_bucket.delay(now))
+                if delay <= 0:
+                    # The chats are in round robin order, the first one which may send gets its turn
+                    for chat_id in self._chats:
+                        chat_delay = self.__chat_bucket(chat_id).delay(now)
+                        if chat_delay <= 0:
+                            return self.__take_message(chat_id, now)
+                        delay = chat_delay if delay <= 0 else min(delay, chat_delay)
+
+            self._condition.wait(delay)
+
+    def __chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(chat_rate, chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def __take_message(self, chat_id, now: float):
+        """
+
+        Takes the chat's next message, merged with the following ones if possible. Caller holds the condition
+        """
+        messages = self._chats[chat_id]
+        text, kwargs, retries = messages.popleft()
+
+        while messages:
+            next_text, next_kwargs, next_retries = messages[0]
+            separator = "" if text.endswith("\n") else "\n"
+            if next_kwargs != kwargs or len(text) + len(separator) + len(next_text) >= self._max_length:
+                break
+            messages.popleft()
+            text += separator + next_text
+            self.merged += 1
+
+        if messages:
+            self._chats.move_to_end(chat_id)
+        else:
+            del self._chats[chat_id]
+
+        self.__chat_bucket(chat_id).take(now)
+        self._global_bucket.take(now)
+
+        # Buckets of idle chats aren't needed anymore
+        for idle_chat_id in [idle_chat_id for idle_chat_id, bucket in self._chat_buckets.items()
+                             if idle_chat_id not in self._chats and bucket.full(now)]:
+            del self._chat_buckets[idle_chat_id]
+
+        self._sending = True
+        return chat_id, text, kwargs, retries
+
+    def __requeue(self, chat_id, text: str, kwargs: dict, retries: int):
+        # Caller holds the condition. The message goes first, the order within the chat must not change
+        self._chats.setdefault(chat_id, collections.deque()).appendleft((text, kwargs, retries))
+        self.retried += 1
+
+    def __run(self):
+        while True:
+            with self._condition:
+                message = self.__next_message()
+                if message is None:
+                    return
+            chat_id, text, kwargs, retries = message
+
+            try:
+                self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                with self._condition:
+                    self.sent += 1
+            except telegram.error.RetryAfter as retry_after:
+                logger.warning("Flood limit reached, waiting %s seconds", retry_after.retry_after)
+                with self._condition:
+                    self._blocked_until = time.monotonic() + retry_after.retry_after
+                    self.__requeue(chat_id, text, kwargs, retries)
+            except telegram.error.BadRequest:
+                # Also a NetworkError, but retrying won't help
+                logger.exception("Unable to send message to %s", chat_id)
+                with self._condition:
+                    self.failed += 1
+            except telegram.error.TimedOut:
+                # Also a NetworkError, but the message may have been delivered. Better lost than sent twice
+                logger.warning("Sending a message to %s timed out, not sent again", chat_id)
+                with self._condition:
+                    self.timed_out += 1
+            except telegram.error.NetworkError:
+                with self._condition:
+                    if retries < max_retries:
+                        # The network is the same for all chats
+                        self._blocked_until = time.monotonic() + 2 ** retries
+                        self.__requeue(chat_id, text, kwargs, retries + 1)
+                    else:
+                        logger.exception("Unable to send message to %s", chat_id)
+                        self.failed += 1
+            except Exception:
+                logger.exception("Unable to send message to %s", chat_id)
+                with self._condition:
+                    self.failed += 1
+            finally:
+                with self._condition:
+                    self._sending = False
+                    self._condition.notify_all()
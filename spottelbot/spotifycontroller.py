@@ -1,15 +1,23 @@
 """ The spotify related functions and constants"""
 
+import atexit
+import collections
+import concurrent.futures
 import datetime
-import functools
+import logging
+import threading
+import time
 
-import dateutil.parser
 import dateutil.tz
 
+import spotipy.spotipy.cache as spotipy_cache
 import spotipy.spotipy.client as cl
+import spotipy.spotipy.oauth2 as oauth2
 import spotipy.spotipy.util as util
 from spottelbot import botconfig
 from spottelbot import botexceptions
+from spottelbot import historystore
+from spottelbot import metadatacache
 
 # Theoretically it's possible to have mor than 50 last items by using the "next" feature. But since 50 entries
 # makes quite a list (especially when using the mobile telegram client), this limit shouldn't bother anyone - it's
@@ -17,6 +25,36 @@ from spottelbot import botexceptions
 
 last_limit = 50
 
+# Number of requests sent at the same time when resolving more tracks than spotify accepts in a single request
+chunk_concurrency = 4
+
+# Number of tracks and playlists to keep (and their maximum total size in bytes). A track never changes and is kept
+# until it's evicted, a playlist is revalidated after the playlist_ttl (see botconfig)
+metadata_cache_size = 5000
+metadata_cache_bytes = 4 * 1024 * 1024
+
+# Maximum number of playlists looked up at the same time (e.g. the contexts of /last)
+playlist_workers = 8
+
+logger = logging.getLogger(__name__)
+
+# Seconds a request may spend waiting for spotify's rate limit (or retrying) before giving up. Better to tell the
+# user to try again than to block a worker thread for minutes
+retry_deadline = 20
+
+# Seconds to wait for a response of spotify (API and token requests), so a hanging connection can't block a worker
+requests_timeout = 10
+
+# Seconds before it expires the access token is renewed in the background (the client considers it expired 60 seconds
+# before)
+token_refresh_margin = 300
+
+# Token files with this suffix are databases holding the tokens of several users
+token_database_suffix = ".sqlite"
+
+# Number of spotify responses (catalog objects like playlists) to keep. Stale ones are revalidated using their ETag
+response_cache_size = 500
+
 scope = 'user-read-recently-played user-read-currently-playing playlist-read-private'
 
 # Some constants
@@ -32,6 +70,13 @@ track_str = "track"
 type_str = "type"
 uri_str = "uri"
 played_at_str = "played_at"
+tracks_str = "tracks"
+cursors_str = "cursors"
+after_str = "after"
+snapshot_id_str = "snapshot_id"
+
+# Fields of a playlist to fetch
+playlist_fields = name_str + "," + snapshot_id_str
 
 
 class SpotifyController(object):
@@ -40,12 +85,47 @@ class SpotifyController(object):
         self._config = config
         self._oath = None
         self._client = None
+        self._metadata_cache = metadatacache.MetadataCache(metadata_cache_size, metadata_cache_bytes)
+        self._play_history = None
+        self._play_history_time = 0.0
+        self._play_history_lock = threading.Lock()
+        # Only one thread fetches the snapshot, the others wait for it (without blocking the poller)
+        self._play_history_fetch_lock = threading.Lock()
+
+        # Filled by the (optional) poller, most recently played track first
+        self._play_history_buffer = collections.deque(maxlen=last_limit)
+        self._play_history_cursor = None
+        self._play_history_polled = False
+        self._poller = None
+        self._poller_stop = threading.Event()
+
+        # Optional local store of everything that has been played, reaching back further than last_limit
+        self._history_store = None
+
+        # Threads are only started when needed
+        self._playlist_executor = concurrent.futures.ThreadPoolExecutor(max_workers=playlist_workers,
+                                                                        thread_name_prefix="playlist")
+
+    @staticmethod
+    def __context_playlist(context_object: dict) -> str:
+        """
 
-    def __format_context_object(self, context_object: dict):
+        :param context_object: The context object (may be None)
+        :type context_object: dict
+        :return: The URI of the playlist or None if the track wasn't played from a playlist
+        :rtype: str
+        """
+        if context_object and context_object[type_str] in (playlist_str, playlist_v2_str):
+            return context_object[uri_str]
+        return None
+
+    def __format_context_object(self, context_object: dict, playlist_names: dict):
         """
 
         :param context_object: The context object
         :type context_object: dict
+        :param playlist_names: The names of the playlists, by URI (see get_playlists)
+        :type playlist_names: dict
         :return: Formatted string
         :rtype: str
 
@@ -54,29 +134,34 @@ class SpotifyController(object):
         """
         formatted_context = ""
 
-        if context_object:
-            if context_object[type_str] in (playlist_str, playlist_v2_str):
-                playlist_uri = context_object[uri_str]
-                playlist_dict = self.__get_playlist(playlist_uri)
-                formatted_context = " (Playlist: {}) ".format(playlist_dict[name_str])
+        playlist_uri = self.__context_playlist(context_object)
+        if playlist_uri:
+            formatted_context = " (Playlist: {}) ".format(playlist_names[playlist_uri])
 
         return formatted_context
 
-    def _format_played_at(self, played_at_object: str) -> str:
+    def _format_played_at(self, played_at_object: str, local_tz: datetime.tzinfo = None,
+                          today: datetime.date = None) -> str:
         """
 
         :param played_at_object: The content of 'played_at'
+        :param local_tz: The local timezone. Determined if None
+        :param today: Today's date. Determined if None
         :return: Formatted string
 
-        Formats the play_at_object ("2018-07-06T..."), returns the formatted string
+        Formats the play_at_object ("2018-07-06T..."), returns the formatted string. When formatting many objects,
+        the local timezone and today's date should be determined once and passed by the caller
         """
 
-        local_tz = dateutil.tz.tzlocal()
-        date_time = dateutil.parser.parse(played_at_object).astimezone(local_tz)
+        if local_tz is None:
+            local_tz = dateutil.tz.tzlocal()
+        if today is None:
+            today = datetime.date.today()
+
+        date_time = historystore.parse_played_at(played_at_object).astimezone(local_tz)
 
         date_string = ""
 
-        today = datetime.date.today()
         date_played_at = date_time.date()
 
         delta = today - date_played_at
@@ -123,9 +208,8 @@ class SpotifyController(object):
         return formatted_track
 
     # Since a playlist (at least the name) usually doesn't change that often and this method is being called
-    # by the bookmark functions (usually more than once), it can be cached so we don't get any spotify rate limit.
-    # The drawback: If the user changes the playlist's name, the old name would be displayed. So it's a trade off
-    @functools.lru_cache(maxsize=last_limit)
+    # by the bookmark functions (usually more than once), it is cached so we don't get any spotify rate limit.
+    # After the playlist_ttl, the playlist's snapshot ID tells whether the cached name is still valid
     def __get_playlist(self, uri: str):
         """
 
@@ -136,7 +220,23 @@ class SpotifyController(object):
 
         Gets the playlist details (formatting it)
         """
-        playlist_object = self._client.user_playlist(self._config._spotify_username, uri, fields=name_str)
+        playlist_object = self._metadata_cache.get(uri)
+        if playlist_object is not None:
+            return playlist_object
+
+        username = self._config._spotify_username
+        ttl = self._config._spotify_playlist_ttl
+
+        stale_object = self._metadata_cache.get_stale(uri)
+        if stale_object and stale_object.get(snapshot_id_str):
+            snapshot_object = self._client.user_playlist(username, uri, fields=snapshot_id_str)
+            if snapshot_object and snapshot_object.get(snapshot_id_str) == stale_object[snapshot_id_str]:
+                self._metadata_cache.touch(uri, ttl)
+                return stale_object
+
+        playlist_object = self._client.user_playlist(username, uri, fields=playlist_fields)
+        if playlist_object:
+            self._metadata_cache.set(uri, playlist_object, ttl)
         return playlist_object
 
     def get_playlist(self, uri: str) -> str:
@@ -159,8 +259,25 @@ class SpotifyController(object):
 
         return playlist_name
 
-    # A track name shouldn't change at all - so it's safe to use a cache therefore reducing the requests to spotify
-    @functools.lru_cache(maxsize=last_limit)
+    def get_playlists(self, uris) -> dict:
+        """
+
+        :param uris: The URIs of the playlists (duplicates are allowed)
+        :type uris: iterable
+        :return: The names of the playlists, by URI
+        :rtype: dict
+
+        Like get_playlist, but looks up several playlists in parallel, so the time needed is that of the slowest
+        lookup instead of the sum of all
+        """
+        unique_uris = list(collections.OrderedDict.fromkeys(uris))
+
+        if len(unique_uris) <= 1:
+            return {uri: self.get_playlist(uri) for uri in unique_uris}
+
+        names = self._playlist_executor.map(self.get_playlist, unique_uris)
+        return dict(zip(unique_uris, names))
+
     def get_track(self, uri: str) -> str:
         """
 
@@ -171,13 +288,53 @@ class SpotifyController(object):
 
         Returns the track in humand readable form
         """
-        formatted_track = "<unknown>"
-        track_object = self._client.track(uri)
+        return self.get_tracks((uri,))[uri]
+
+    # A track name shouldn't change at all - so it's safe to use a cache therefore reducing the requests to spotify
+    def get_tracks(self, uris) -> dict:
+        """
 
-        if track_object:
-            formatted_track = self.__format_track_object(track_object)
+        :param uris: The spotify URIs of the tracks
+        :type uris: iterable
+        :return: dictionary uri -> formatted string
+        :rtype: dict
 
-        return formatted_track
+        Returns the tracks in human readable form. Tracks not already cached are fetched using as few requests as
+        possible (the client splits them into chunks spotify accepts)
+        """
+        formatted_tracks = {}
+        missing = []
+
+        for uri in uris:
+            if uri in formatted_tracks or uri in missing:
+                continue
+            formatted_track = self._metadata_cache.get(uri)
+            if formatted_track is None:
+                missing.append(uri)
+            else:
+                formatted_tracks[uri] = formatted_track
+
+        if missing:
+            try:
+                tracks_object = self._client.tracks(missing)
+            except cl.SpotifyChunkError as chunk_error:
+                # Show what could be fetched, the other tracks are unknown (and not cached)
+                logger.warning("Unable to fetch some of the tracks: %s", chunk_error)
+                tracks_object = chunk_error.result
+            track_objects = tracks_object[tracks_str] if tracks_object else []
+
+            for uri, track_object in zip(missing, track_objects):
+                formatted_track = "<unknown>"
+                if track_object:
+                    formatted_track = self.__format_track_object(track_object)
+                    self._metadata_cache.set(uri, formatted_track, ttl=None)
+                formatted_tracks[uri] = formatted_track
+
+        # Spotify returned fewer objects than requested
+        for uri in missing:
+            formatted_tracks.setdefault(uri, "<unknown>")
+
+        return formatted_tracks
 
     def connect(self):
         """
@@ -187,13 +344,146 @@ class SpotifyController(object):
         """
 
         config = self._config
+        # The token requests use the client's connections, too
+        session = cl.pooled_session()
         self._oath = util.prompt_for_oauth_object(config._spotify_username, scope, config._spotify_client_id,
-                                                  config._spotify_client_secret, config._spotify_redirect_uri)
+                                                  config._spotify_client_secret, config._spotify_redirect_uri,
+                                                  token_store=self.__token_store(), requests_session=session,
+                                                  requests_timeout=requests_timeout)
 
         if not self._oath:
             raise botexceptions.SpotifyAuth
 
-        self._client = cl.Spotify(client_credentials_manager=self._oath)
+        # Renew the token in the background, before the commands would have to
+        self._oath.start_refresher(token_refresh_margin)
+
+        # The results are only read, so concurrent commands may share them
+        self._client = cl.Spotify(client_credentials_manager=self._oath, requests_session=session,
+                                  requests_timeout=requests_timeout, retry_deadline=retry_deadline,
+                                  coalesce_requests=True,
+                                  response_cache=spotipy_cache.MemoryCache(response_cache_size),
+                                  chunk_concurrency=chunk_concurrency)
+        # Possibly another user's history
+        self.invalidate_play_history()
+
+        if config._spotify_history_file:
+            self._history_store = historystore.HistoryStore(
+                config.config_relative_path(config._spotify_history_file))
+
+        if config._spotify_metadata_file:
+            store = metadatacache.MetadataStore(config.config_relative_path(config._spotify_metadata_file),
+                                                metadata_cache_size)
+            self._metadata_cache = metadatacache.MetadataCache(metadata_cache_size, metadata_cache_bytes,
+                                                               store=store)
+            atexit.register(store.close)
+
+        if config._spotify_history_poll_interval > 0:
+            self.start_play_history_poller(config._spotify_history_poll_interval)
+
+    def __token_store(self):
+        """
+
+        :return: The configured token store, None = the default (.cache-username)
+        :rtype: oauth2.TokenStore
+        """
+        config = self._config
+        if not config._spotify_token_file:
+            return None
+
+        token_file = str(config.config_relative_path(config._spotify_token_file))
+        if token_file.endswith(token_database_suffix):
+            return oauth2.SQLiteTokenStore(token_file, config._spotify_username)
+        return oauth2.FileTokenStore(token_file)
+
+    def close(self):
+        """
+        Stops the background work (poller, token refresher), writes the metadata cache and closes the history store
+        """
+        self.stop_play_history_poller()
+        if self._oath:
+            self._oath.stop_refresher()
+        if self._history_store is not None:
+            self._history_store.close()
+            self._history_store = None
+        if self._metadata_cache.store:
+            self._metadata_cache.store.close()
+
+    def token_refresh_stats(self) -> dict:
+        """
+
+        :return: Number of token refreshes, failures and their average duration (empty if not connected)
+        :rtype: dict
+        """
+        return self._oath.token_refresh_stats() if self._oath else {}
+
+    def start_play_history_poller(self, interval: float):
+        """
+
+        :param interval: Seconds between two polls
+        :type interval: float
+
+        Starts a background thread fetching the recently played tracks every interval seconds. Only the tracks
+        played since the last poll are requested, /last and /mark are then served from the local buffer
+        """
+        if self._poller:
+            return
+
+        self._poller_stop.clear()
+        self._poller = threading.Thread(target=self.__poll_loop, args=(interval,), name="play history poller",
+                                        daemon=True)
+        self._poller.start()
+
+    def stop_play_history_poller(self):
+        """
+        Stops the background poller (if running). The local buffer won't be used anymore
+        """
+        if not self._poller:
+            return
+
+        self._poller_stop.set()
+        self._poller.join()
+        self._poller = None
+        with self._play_history_lock:
+            self._play_history_polled = False
+        # The snapshot was taken before the poller started
+        self.invalidate_play_history()
+
+    def __poll_loop(self, interval: float):
+        """
+
+        :param interval: Seconds between two polls
+        :type interval: float
+
+        The poller's main loop. Errors are logged, the next poll will try again
+        """
+        while True:
+            try:
+                self._poll_play_history()
+            except Exception:
+                logger.exception("Unable to poll the recently played tracks")
+            if self._poller_stop.wait(interval):
+                break
+
+    def _poll_play_history(self):
+        """
+        Fetches the tracks played since the last poll (the first poll fetches last_limit tracks) and adds them
+        to the local buffer
+        """
+        recently_played = self._client.current_user_recently_played(last_limit, after=self._play_history_cursor)
+        if not recently_played:
+            return
+
+        items = recently_played[items_str]
+        cursors = recently_played.get(cursors_str)
+
+        with self._play_history_lock:
+            if self._history_store is not None:
+                self._history_store.add(items)
+            # Items are sorted most recently played first
+            self._play_history_buffer.extendleft(reversed(items))
+            if cursors and cursors.get(after_str):
+                self._play_history_cursor = cursors[after_str]
+            self._play_history_polled = True
 
     def get_current(self, formatted=True):
         """
@@ -218,7 +508,9 @@ class SpotifyController(object):
                 if formatted:
                     formatted_output = self.__format_track_object(the_item)
                     if the_context:
-                        formatted_output += self.__format_context_object(the_context)
+                        playlist_uri = self.__context_playlist(the_context)
+                        playlist_names = self.get_playlists([playlist_uri] if playlist_uri else [])
+                        formatted_output += self.__format_context_object(the_context, playlist_names)
                     ret_object = formatted_output
                 else:
                     context_id = None
@@ -230,26 +522,88 @@ class SpotifyController(object):
 
         return ret_object
 
+    def invalidate_play_history(self):
+        """
+        Discards the snapshot of recently played tracks, the next access will fetch it again
+        """
+        with self._play_history_lock:
+            self._play_history = None
+
+    def __get_play_history(self) -> list:
+        """
+
+        :return: list of PHOs (up to last_limit)
+        :rtype: list
+
+        Returns the recently played tracks. The list is fetched at once (last_limit entries) and reused for the
+        configured time to live, so consecutive commands (/last, /mark 5) share one request. If the poller is
+        running, the local buffer is used instead
+        """
+        with self._play_history_fetch_lock:
+            with self._play_history_lock:
+                if self._play_history_polled:
+                    return list(self._play_history_buffer)
+                if self.__play_history_fresh():
+                    return self._play_history
+
+            # Fetched without holding the lock, the poller and the history store stay usable meanwhile
+            recently_played = self._client.current_user_recently_played(last_limit)
+            play_history = recently_played[items_str] if recently_played else []
+
+            with self._play_history_lock:
+                self._play_history = play_history
+                self._play_history_time = time.monotonic()
+                if self._history_store is not None:
+                    self._history_store.add(play_history)
+            return play_history
+
+    def __play_history_fresh(self) -> bool:
+        """
+
+        :return: True if the snapshot can be used (must be called with the lock held)
+        :rtype: bool
+        """
+        return self._play_history is not None and \
+            time.monotonic() - self._play_history_time < self._config._spotify_history_ttl
+
+    def max_last_index(self) -> int:
+        """
+
+        :return: The highest index usable for /last and /mark
+        :rtype: int
+
+        Without a local history store, this is last_limit. With a store, everything stored can be reached
+        """
+        if self._history_store is not None:
+            return max(last_limit, len(self._history_store))
+        return last_limit
+
     def __get_last_play_history_objects(self, lower: int, upper: int):
         """
 
-        :param lower: the lower index (range 0..last_limit-1
+        :param lower: the lower index (range 0..max_last_index()-1
         :type lower: int
-        :param upper: the upper index (range 0..last-limit-1), >=lower
+        :param upper: the upper index (range 0..max_last_index()-1), >=lower
         :type upper: int
         :return: list of PHOs
         :rtype: list
 
-        Returns the list of tracks defined by lower and upper index
+        Returns the list of tracks defined by lower and upper index. Ranges reaching past spotify's list are read
+        from the local history store
         """
-        return self._client.current_user_recently_played(upper + 1)[items_str][lower:upper + 1]
+        play_history = self.__get_play_history()
+        if upper < len(play_history) or self._history_store is None:
+            return play_history[lower:upper + 1]
+
+        # The store has just been updated by __get_play_history(), so it's as recent as spotify's list
+        return self._history_store.get(lower, upper)
 
     def get_last_tracks(self, lower: int, upper: int):
         """
 
-        :param lower: The lower index (range 1..last_limit)
+        :param lower: The lower index (range 1..max_last_index())
         :type lower:  int
-        :param upper: the upper index (range 1..last_limit), >= upper
+        :param upper: the upper index (range 1..max_last_index()), >= upper
         :type upper: int
         :return: A list of formatted strings
         :rtype: list
@@ -260,27 +614,34 @@ class SpotifyController(object):
         formatted_tracks_list = []
         pho_list = self.__get_last_play_history_objects(lower - 1, upper - 1)
 
+        local_tz = dateutil.tz.tzlocal()
+        today = datetime.date.today()
+
+        # Look up all playlists first (in parallel) instead of one after another while formatting
+        playlist_names = self.get_playlists(
+            uri for uri in (self.__context_playlist(pho[context_str]) for pho in pho_list) if uri)
+
         for play_history_object in pho_list:
-            played_at_string = self._format_played_at(play_history_object[played_at_str])
+            played_at_string = self._format_played_at(play_history_object[played_at_str], local_tz, today)
             formatted_tracks_list.append(
                 self.__format_track_object(play_history_object[track_str]) + self.__format_context_object(
-                    play_history_object[context_str]) + " - " + played_at_string)
+                    play_history_object[context_str], playlist_names) + " - " + played_at_string)
 
         return formatted_tracks_list
 
     def get_last_index(self, index: int):
         """
 
-        :param index: Recently played titles's index (< last_limit)
+        :param index: Recently played titles's index (<= max_last_index())
         :type index: int
         :return: track_id, playlist_id
         :rtype: tuple
 
-        return the recently played track (1 == the last played track before current, up to last_limit). Raises an
-        IndexError if index > last_limit
+        return the recently played track (1 == the last played track before current, up to max_last_index()).
+        Raises an InvalidRange if index > max_last_index()
         """
 
-        if index < 1 or index > last_limit:
+        if index < 1 or index > self.max_last_index():
             raise botexceptions.InvalidRange(index)
 
         play_history = self.__get_last_play_history_objects(index - 1, index - 1)
@@ -292,7 +653,7 @@ class SpotifyController(object):
             item = play_history[0]
             track_id = item[track_str][uri_str]
             context = item[context_str]
-            if context[type_str] == playlist_str:
+            if context and context[type_str] == playlist_str:
                 playlist_id = context[uri_str]
 
         return track_id, playlist_id
@@ -1,4 +1,5 @@
 """ Processing/relaying telegram messages"""
+import atexit
 import collections
 import functools
 import threading
@@ -6,23 +7,29 @@ import threading
 import telegram
 import telegram.bot
 import telegram.ext
+import telegram.utils.helpers
 
+from spottelbot import autosaver
 from spottelbot import botconfig
 from spottelbot import botexceptions
+from spottelbot import commandlimiter
+from spottelbot import sendqueue
 from spottelbot import spotifycontroller
 
 max_message_length = 4096
 
 
-def __parse_last_arg(parse_string):
+def __parse_last_arg(parse_string, limit=spotifycontroller.last_limit):
     """
 
     :param parse_string: The string to parse
     :type parse_string: str
+    :param limit: The highest possible index
+    :type limit: int
     :return: A tuple containung upper and lower bound
     :rtype: tuple
 
-    Parses arguments like "1-5", "1-".
+    Parses arguments like "1-5", "1-". An open range ("1-") covers at most last_limit tracks
     """
 
     lower_bound = upper_bound = 0
@@ -42,20 +49,22 @@ def __parse_last_arg(parse_string):
     else:
         lower_bound = int(value_list[0])
 
-    # "2-"
+    # "2-": at most last_limit tracks, only explicit ranges may reach further back (local history store)
     if value_list[1] == "":
-        upper_bound = spotifycontroller.last_limit
+        upper_bound = min(limit, lower_bound + spotifycontroller.last_limit - 1)
     else:
         upper_bound = int(value_list[1])
 
     return lower_bound, upper_bound
 
 
-def last_range(arguments):
+def last_range(arguments, limit=spotifycontroller.last_limit):
     """
 
     :param arguments: List of arguments given to "/last"
     :type arguments: list
+    :param limit: The highest possible index
+    :type limit: int
     :return: uper and lower bound
     :rtype: tuple
 
@@ -74,33 +83,97 @@ def last_range(arguments):
 
         value = arguments[0]
 
-        # Case 1: /last with exactly one numeric argument (/last 5)
+        # Case 1: /last with exactly one numeric argument (/last 5). Like open ranges, shows last_limit tracks at most
         if value.isdigit():
             lower_bound = 1
             upper_bound = int(arguments[0])
+            if upper_bound <= limit:
+                upper_bound = min(upper_bound, spotifycontroller.last_limit)
         else:
             # Case 2: /last with a ranged argument (/last 1-5, /last 5-, /last -10
-            lower_bound, upper_bound = __parse_last_arg(value)
+            lower_bound, upper_bound = __parse_last_arg(value, limit)
 
     # /last with two arguments: /last 1- 5, /last 1 -5...
     elif len(arguments) == 2 or len(arguments) == 3:
         try:
             value = "".join(arguments)
-            lower_bound, upper_bound = __parse_last_arg(value)
+            lower_bound, upper_bound = __parse_last_arg(value, limit)
         except ValueError:
             raise botexceptions.InvalidRange(value)
     else:
         # Too much arguments
         raise botexceptions.InvalidRange(" ".join(arguments))
 
-    if upper_bound < 1 or upper_bound > spotifycontroller.last_limit:
+    if upper_bound < 1 or upper_bound > limit:
         raise botexceptions.InvalidRange(upper_bound)
-    if lower_bound < 1 or lower_bound > spotifycontroller.last_limit:
+    if lower_bound < 1 or lower_bound > limit:
         raise botexceptions.InvalidRange(lower_bound)
 
     return lower_bound, upper_bound
 
 
+class MessageBuffer(object):
+    """
+    Collects the lines of a reply and sends them in as few messages as possible, honoring telegram's max message
+    length. Every command gets its own buffer, so concurrent commands (telegram.ext's worker threads) can't mix up
+    their output.
+    """
+
+    def __init__(self, bot: telegram.Bot, chat_id: str, **kwargs):
+        """
+
+        :param bot: Telegram bot (or the send queue)
+        :type bot: telegram.Bot
+        :param chat_id: Chat ID to send the messages to
+        :type chat_id: str
+        :param kwargs: args to pass to bot.send_message()
+        :type kwargs:
+        """
+        self._bot = bot
+        self._chat_id = chat_id
+        self._kwargs = kwargs
+        self._lines = []
+        self._length = 0
+
+    def append(self, text: str):
+        """
+
+        :param text: The text to add (usually a line, including the newline)
+        :type text: str
+
+        Adds text to the buffer. If the buffer would exceed the maximum message length, the buffer is sent first.
+        Texts which are too long for a single message are split on line boundaries. If a single line should exceed
+        the maximum message length, an exception will be raised
+        """
+        message_length = len(text)
+
+        if message_length >= max_message_length:
+            lines = text.splitlines(keepends=True)
+            if len(lines) == 1:
+                raise botexceptions.TelegramMessageLength(message_length)
+            for line in lines:
+                self.append(line)
+            return
+
+        if self._length + message_length >= max_message_length:
+            self.__send()
+
+        self._lines.append(text)
+        self._length += message_length
+
+    def flush(self):
+        """
+        Sends what's left in the buffer
+        """
+        if self._length:
+            self.__send()
+
+    def __send(self):
+        self._bot.send_message(chat_id=self._chat_id, text="".join(self._lines), **self._kwargs)
+        self._lines = []
+        self._length = 0
+
+
 class TelegramController(object):
     # Decorators used for methods
     class Decorators(object):
@@ -118,14 +191,20 @@ class TelegramController(object):
             return wrapper
 
         # Autosave (if on, currenlty always on, setting autosave on/off needs to be written yet) method which
-        # affect the configfile (users, bookmarks)
+        # affect the configfile (users, bookmarks). The config is saved in the background (see autosaver)
         @classmethod
         def autosave(self, method):
-            def wrapper(self, *args, **kwargs):
+            def wrapper(self, bot: telegram.Bot, update: telegram.Update, args):
                 # TODO: Autosave on/off
 
-                retval = method(self, *args, **kwargs)
-                self._config.save_config(None)
+                retval = method(self, bot, update, args)
+                self._autosaver.schedule()
+
+                # The change is there, but it may be lost
+                if self._autosaver.last_error:
+                    self._send_queue.send_message(
+                        chat_id=update.message.chat_id,
+                        text="Warning: the config can't be saved ({})".format(self._autosaver.last_error))
                 return retval
 
             return wrapper
@@ -141,7 +220,11 @@ class TelegramController(object):
         self._config = config
         self._spotify_controller = spotify_controller
         self._updater = None
-        self._output_buffer = ""
+        self._send_queue = None
+        self._autosaver = autosaver.AutoSaver(config, config.autosave_delay / 1000)
+        # Waiting calls occupy workers too. At least one worker has to stay free for the other commands
+        self._command_limiter = commandlimiter.CommandLimiter(config.command_limits, config.busy_timeout,
+                                                              max(config.workers - 1, 0))
 
         # TODO: /adduser, /deluser /users
         # TODO: /autosave (on/off)
@@ -174,6 +257,10 @@ class TelegramController(object):
             (("clear", "delete"), self.__clear_handler, "Deletes bookmark(s) (or all)", (
                 "*/clear <bookmarkname>* deletes the bookmark", "*/clear a b c* deletes bookmarks a, b and c",
                 "*/clear all* clears all bookmarks")),
+            ("stats", self.__stats_handler, "Shows how busy the bot is", (
+                "Shows for every command how often it has been called, how many calls are running and waiting and "
+                "how many were rejected because the bot was too busy, how many messages were sent, how often the "
+                "config was saved and how often the spotify token was refreshed",)),
             ("reload", self.__reload_handler, "Reloads config", "Reloads the config. Not very useful (yet)", None)
         )
 
@@ -185,60 +272,79 @@ class TelegramController(object):
 
         Connect to telegram, start the loop
         """
-        self._updater = telegram.ext.Updater(self._config.telegram_token)
+        self._updater = telegram.ext.Updater(self._config.telegram_token, workers=self._config.workers)
+
+        # The handlers only queue their replies
+        self._send_queue = sendqueue.SendQueue(self._updater.bot, max_message_length)
+
+        # Don't lose unsaved changes if the process ends without /quit
+        atexit.register(self._autosaver.stop)
 
         for handler in self._handlers:
             command_s = handler[0]
-            method_handler = handler[1]
+            method_handler = self.__dispatched(self.__limited(command_s, handler[1]))
             self._updater.dispatcher.add_handler(telegram.ext.CommandHandler(command_s, method_handler, pass_args=True))
 
         # Last handler - a catch all handler for unknown commands
         self._updater.dispatcher.add_handler(
             telegram.ext.MessageHandler(telegram.ext.Filters.command, self.__unknown_handler))
-        self._updater.start_polling()
 
-    def unauthorized(self, bot: telegram.Bot, update: telegram.Update, args):
-        bot.send_message(chat_id=update.message.chat_id, text="*You are not authorized to use this function*",
-                         parse_mode=telegram.ParseMode.MARKDOWN)
+        if self._config.telegram_mode == botconfig.telegram_mode_webhook:
+            self._updater.start_webhook(listen=self._config.webhook_listen, port=self._config.webhook_port,
+                                        url_path=self._config.webhook_path)
+            if self._config.webhook_url:
+                self._updater.bot.set_webhook(url=self._config.webhook_url)
+        else:
+            # Removes the webhook, if any
+            self._updater.start_polling()
 
-    def __send_message_buffer(self, bot: telegram.Bot, chat_id: str, text: str, final=False, **kwargs):
+    def __dispatched(self, method_handler):
         """
 
-        :param bot: Telegram bot
-        :type bot: telegram.Bot
-        :param chat_id: Chat ID to send the messages to
-        :type chat_id: str
-        :param text: The text to send
-        :type text: str
-        :param final: Last part of the message, i.e. flush the buffer?
-        :type final: bool
-        :param kwargs: args to pass to bot.send_message()
-        :type kwargs:
-        :return:
-        :rtype:
+        :param method_handler: The command's handler
+        :return: The handler, run in one of the dispatcher's workers
 
-        Sends a bunch of message lines to the chat_id, honoring telegram's max message length. If a single line
-        (text) should exceed the maximum message length, an exception will be raised
+        The dispatcher calls the handlers one after the other in its own thread, so a slow command would hold up the
+        others
         """
 
-        # Not sure if there should be a seperate buffer for eatch chat_id.. i.e. is this method thread safe? Does
-        # it need to be? For now there won't be buffers per chat_id, only one single, global one.
-        message_length = len(text)
+        @functools.wraps(method_handler)
+        def dispatch(*args, **kwargs):
+            self._updater.dispatcher.run_async(method_handler, *args, **kwargs)
 
-        if message_length >= max_message_length:
-            raise botexceptions.TelegramMessageLength(message_length)
+        return dispatch
 
-        if len(self._output_buffer) + message_length >= max_message_length:
-            bot.send_message(chat_id=chat_id, text=self._output_buffer, **kwargs)
-            self._output_buffer = text
-        else:
-            self._output_buffer += text
+    def __limited(self, command_s, method_handler):
+        """
+
+        :param command_s: The command (or tuple of aliases)
+        :param method_handler: The command's handler
+        :return: The handler, limited by the command limiter
+
+        Runs the handler if there's a free slot for the command (see botconfig's limits), otherwise tells the user the
+        bot is busy
+        """
+        # Aliases share the limit. It may be configured for any of them
+        commands = (command_s,) if isinstance(command_s, str) else command_s
+        command = next((alias for alias in commands if alias in self._config.command_limits), commands[0])
+
+        @functools.wraps(method_handler)
+        def wrapper(bot: telegram.Bot, update: telegram.Update, *args, **kwargs):
+            if not self._command_limiter.acquire(command):
+                self._send_queue.send_message(chat_id=update.message.chat_id,
+                                              text="Too busy right now, please try again later")
+                return
+            try:
+                return method_handler(bot, update, *args, **kwargs)
+            finally:
+                self._command_limiter.release(command)
 
-        # There's no case final is set and there's an empty buffer: If buffer is full, buffer contains the
-        # message containing the potential overflow.
-        if final:
-            bot.send_message(chat_id=chat_id, text=self._output_buffer, **kwargs)
-            self._output_buffer = ""
+        return wrapper
+
+    def unauthorized(self, bot: telegram.Bot, update: telegram.Update, args):
+        self._send_queue.send_message(chat_id=update.message.chat_id,
+                                      text="*You are not authorized to use this function*",
+                                      parse_mode=telegram.ParseMode.MARKDOWN)
 
     # Since traversing the command tuples may be expensive, it makes sense caching the results.
     @functools.lru_cache(maxsize=20)
@@ -283,12 +389,11 @@ class TelegramController(object):
     def __clear_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
         message_list = self.delete(args)
+        message_buffer = MessageBuffer(self._send_queue, update.message.chat_id, parse_mode=telegram.ParseMode.MARKDOWN)
 
         for message in message_list:
-            self.__send_message_buffer(bot, update.message.chat_id, text=message, final=False,
-                                       parse_mode=telegram.ParseMode.MARKDOWN)
-        self.__send_message_buffer(bot, update.message.chat_id, text="", final=True,
-                                   parse_mode=telegram.ParseMode.MARKDOWN)
+            message_buffer.append(message)
+        message_buffer.flush()
 
     # /current
     def __current_handler(self, bot: telegram.Bot, update: telegram.Update, args):
@@ -296,12 +401,14 @@ class TelegramController(object):
         if not message:
             message = "Nothing playing at the moment"
 
-        bot.send_message(chat_id=update.message.chat_id, text=message)
+        self._send_queue.send_message(chat_id=update.message.chat_id, text=message)
 
     # /help, /help add, ...
     @Decorators.restricted
     def __help_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
+        message_buffer = MessageBuffer(self._send_queue, update.message.chat_id, parse_mode=telegram.ParseMode.MARKDOWN)
+
         # /help without an argument -> List all commands and the quick help
         if len(args) == 0:
             for entry in self._handlers:
@@ -313,76 +420,75 @@ class TelegramController(object):
                 else:
                     text += command_s
                 text += "*: {}\n".format(quick_help)
-                self.__send_message_buffer(bot, update.message.chat_id, text=text, final=False,
-                                           parse_mode=telegram.ParseMode.MARKDOWN)
-            self.__send_message_buffer(bot, update.message.chat_id, text="", final=True,
-                                       parse_mode=telegram.ParseMode.MARKDOWN)
+                message_buffer.append(text)
+            message_buffer.flush()
         else:
             # /help help, /help clear, /help mark clear...
             for arg in args:
                 help = self.__find_help_for_command(arg)
                 if help:
-                    self.__send_message_buffer(bot, update.message.chat_id, text="*{}*: ".format(arg), final=False,
-                                               parse_mode=telegram.ParseMode.MARKDOWN)
+                    message_buffer.append("*{}*: ".format(arg))
                     if isinstance(help, collections.Iterable) and not isinstance(help, str):
                         for help_line in help:
-                            self.__send_message_buffer(bot, update.message.chat_id, text=help_line + "\n", final=False,
-                                                       parse_mode=telegram.ParseMode.MARKDOWN)
+                            message_buffer.append(help_line + "\n")
                     else:
-                        self.__send_message_buffer(bot, update.message.chat_id, text=help + "\n", final=False,
-                                                   parse_mode=telegram.ParseMode.MARKDOWN)
+                        message_buffer.append(help + "\n")
                 else:
                     # Unknown command
-                    self.__send_message_buffer(bot, update.message.chat_id, text="*{}: Unknown command*\n".format(arg),
-                                               final=False, parse_mode=telegram.ParseMode.MARKDOWN)
+                    message_buffer.append("*{}: Unknown command*\n".format(arg))
             # Empty Buffer
-            self.__send_message_buffer(bot, update.message.chat_id, text="", final=True,
-                                       parse_mode=telegram.ParseMode.MARKDOWN)
+            message_buffer.flush()
 
     # /last
     @Decorators.restricted
     def __last_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
+        limit = self._spotify_controller.max_last_index()
+        message_buffer = MessageBuffer(self._send_queue, update.message.chat_id, parse_mode=telegram.ParseMode.MARKDOWN)
         try:
-            lower, upper = last_range(args)
+            lower, upper = last_range(args, limit)
             if lower > upper:
                 raise botexceptions.InvalidRange("{}-{}".format(lower, upper))
             output_list = self._spotify_controller.get_last_tracks(lower, upper)
 
             for i, item in enumerate(output_list, lower):
                 text = "*{}*: {}\n".format(i, item)
-                self.__send_message_buffer(bot, update.message.chat_id, text=text, final=False,
-                                           parse_mode=telegram.ParseMode.MARKDOWN)
-            self.__send_message_buffer(bot, update.message.chat_id, text="", final=True,
-                                       parse_mode=telegram.ParseMode.MARKDOWN)
+                message_buffer.append(text)
+            message_buffer.flush()
         except botexceptions.InvalidRange as range_error:
-            bot.send_message(chat_id=update.message.chat_id,
-                             text="*Invalid range {}. Must be between 1 and {}*".format(range_error.invalid_argument,
-                                                                                        spotifycontroller.last_limit),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self._send_queue.send_message(chat_id=update.message.chat_id,
+                                          text="*Invalid range {}. Must be between 1 and {}*".format(
+                                              range_error.invalid_argument, limit),
+                                          parse_mode=telegram.ParseMode.MARKDOWN)
 
     # /list, /show
     @Decorators.restricted
     def __list_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
+        message_buffer = MessageBuffer(self._send_queue, update.message.chat_id, parse_mode=telegram.ParseMode.MARKDOWN)
+
         # 1.) /list without any argument -> list all bookmarks
         if len(args) == 0:
             bookmark_list = self._config.get_bookmarks()
             if bookmark_list:
                 text = ""
+                # Resolve all tracks at once instead of one request per bookmark
+                tracks = self._spotify_controller.get_tracks(
+                    self._config.get_bookmark(bookmark)[0] for bookmark in bookmark_list)
+                playlists = self._spotify_controller.get_playlists(
+                    playlist_id for playlist_id in (self._config.get_bookmark(bookmark)[1] for bookmark in
+                                                    bookmark_list) if playlist_id)
                 for bookmark in bookmark_list:
                     track_id, playlist_id = self._config.get_bookmark(bookmark)
-                    text = "*{}*: {}".format(bookmark, self._spotify_controller.get_track(track_id))
+                    text = "*{}*: {}".format(bookmark, tracks[track_id])
                     if playlist_id:
-                        text += " (Playlist {})".format(self._spotify_controller.get_playlist(playlist_id))
+                        text += " (Playlist {})".format(playlists[playlist_id])
                     text += "\n"
-                    self.__send_message_buffer(bot, update.message.chat_id, text=text, final=False,
-                                               parse_mode=telegram.ParseMode.MARKDOWN)
-                self.__send_message_buffer(bot, update.message.chat_id, text="", final=True,
-                                           parse_mode=telegram.ParseMode.MARKDOWN)
+                    message_buffer.append(text)
+                message_buffer.flush()
             else:
-                self.__send_message_buffer(bot, update.message.chat_id, text="No bookmarks found", final=True,
-                                           parse_mode=telegram.ParseMode.MARKDOWN)
+                message_buffer.append("No bookmarks found")
+                message_buffer.flush()
 
     # /mark, /set..
     @Decorators.restricted
@@ -393,7 +499,8 @@ class TelegramController(object):
         except botexceptions.InvalidBookmark as invalid:
             message = "*Invalid bookmark(s)/argument(s): {}*".format(invalid.invalid_bookmark)
 
-        bot.send_message(chat_id=update.message.chat_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+        self._send_queue.send_message(chat_id=update.message.chat_id, text=message,
+                                      parse_mode=telegram.ParseMode.MARKDOWN)
 
     def mark(self, arguments: list) -> str:
         """
@@ -463,19 +570,60 @@ class TelegramController(object):
     # /quit, /shutdown, bye
     @Decorators.restricted
     def __quit_handler(self, bot: telegram.Bot, update: telegram.Update, args):
-        bot.send_message(chat_id=update.message.chat_id, text="Shutting down")
+        self._send_queue.send_message(chat_id=update.message.chat_id, text="Shutting down")
         threading.Thread(target=self.__quit).start()
 
     # Has to be called from another thread
     def __quit(self):
+        self._spotify_controller.close()
+        self._autosaver.stop()
         self._updater.stop()
+        self._send_queue.stop()
         self._updater.is_idle = False
 
+    # /stats
+    @Decorators.restricted
+    def __stats_handler(self, bot: telegram.Bot, update: telegram.Update, args):
+        message_buffer = MessageBuffer(self._send_queue, update.message.chat_id, parse_mode=telegram.ParseMode.MARKDOWN)
+
+        # Contains at least /stats itself
+        for command, command_stats in self._command_limiter.stats().items():
+            message_buffer.append(
+                "*/{}*: {} calls, {} running (limit {}), {} waiting (max {}), {} rejected, {:.2f}s average wait\n".format(
+                    command, command_stats["calls"], command_stats["running"], command_stats["limit"] or "-",
+                    command_stats["waiting"], command_stats["max_waiting"], command_stats["rejected"],
+                    command_stats["average_wait"]))
+
+        send_stats = self._send_queue.stats()
+        message_buffer.append("*Messages*: {} sent, {} merged, {} retried, {} timed out, {} failed, {} queued\n".format(
+            send_stats["sent"], send_stats["merged"], send_stats["retried"], send_stats["timed_out"],
+            send_stats["failed"], send_stats["queued"]))
+
+        save_stats = self._autosaver.stats()
+        save_line = "*Config*: {} saves, {} failed".format(save_stats["saves"], save_stats["failures"])
+        if save_stats["pending"]:
+            save_line += ", unsaved changes"
+        if save_stats["last_error"]:
+            save_line += ", last error: " + telegram.utils.helpers.escape_markdown(str(save_stats["last_error"]))
+        message_buffer.append(save_line + "\n")
+
+        token_stats = self._spotify_controller.token_refresh_stats()
+        if token_stats:
+            message_buffer.append("*Token*: {} refreshes, {} failed, {:.2f}s average\n".format(
+                token_stats["refreshes"], token_stats["failures"], token_stats["average_latency"]))
+        message_buffer.flush()
+
     # /reload
     @Decorators.restricted
     def __reload_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
-        output = self._config.load_config(None)
+        # Pending changes would be lost otherwise
+        try:
+            self._autosaver.flush()
+            output = self._config.load_config(None)
+        except Exception as error:
+            output = "Unable to save the config, not reloaded ({})".format(
+                telegram.utils.helpers.escape_markdown(str(error)))
 
         answer = ""
         if output:
@@ -483,18 +631,19 @@ class TelegramController(object):
         else:
             answer = "Config reloaded"
 
-        bot.send_message(chat_id=update.message.chat_id, text=answer, parse_mode=telegram.ParseMode.MARKDOWN)
+        self._send_queue.send_message(chat_id=update.message.chat_id, text=answer,
+                                      parse_mode=telegram.ParseMode.MARKDOWN)
 
     # "/whoami"
     def __whoami_handler(self, bot: telegram.Bot, update: telegram.Update, args):
 
         user: telegram.User = update.message.from_user
         message = "You are @{} ({})".format(user.username, user.id)
-        bot.send_message(chat_id=update.message.chat_id, text=message)
+        self._send_queue.send_message(chat_id=update.message.chat_id, text=message)
 
     # Handler for unknown coomands
     def __unknown_handler(self, bot: telegram.Bot, update: telegram.Update):
-        bot.send_message(chat_id=update.message.chat_id, text="I dont' understand the command")
+        self._send_queue.send_message(chat_id=update.message.chat_id, text="I dont' understand the command")
 
     def delete(self, arguments: list) -> list:
         """
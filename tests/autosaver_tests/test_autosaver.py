@@ -0,0 +1,122 @@
+""" Tests of the background saving of the config"""
+import threading
+import time
+
+from spottelbot import autosaver, botconfig
+
+
+class MockConfig(botconfig.BotConfig):
+    def __init__(self):
+        super().__init__()
+        self.saved = 0
+        self.saved_event = threading.Event()
+
+    def save_config(self, configfile_name: str):
+        self.saved += 1
+        self.saved_event.set()
+
+
+def test_coalesce():
+    config = MockConfig()
+    saver = autosaver.AutoSaver(config, 0.2)
+
+    for i in range(0, 10):
+        saver.schedule()
+    assert config.saved == 0
+
+    assert config.saved_event.wait(5)
+    time.sleep(0.3)
+    assert config.saved == 1
+    saver.stop()
+    assert config.saved == 1
+
+
+def test_flush():
+    config = MockConfig()
+    saver = autosaver.AutoSaver(config, 60)
+
+    saver.schedule()
+    saver.schedule()
+    saver.flush()
+    assert config.saved == 1
+
+    # Nothing changed since
+    saver.flush()
+    assert config.saved == 1
+    saver.stop()
+
+
+def test_stop_saves():
+    config = MockConfig()
+    saver = autosaver.AutoSaver(config, 60)
+
+    saver.schedule()
+    saver.stop()
+
+    assert config.saved == 1
+
+
+def test_no_delay():
+    config = MockConfig()
+    saver = autosaver.AutoSaver(config, 0)
+
+    saver.schedule()
+    saver.schedule()
+
+    assert config.saved == 2
+
+
+class FailingConfig(botconfig.BotConfig):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.attempts = 0
+
+    def save_config(self, configfile_name: str):
+        self.attempts += 1
+        if self.error:
+            raise self.error
+
+
+def test_permanent_error():
+    config = FailingConfig(PermissionError("read only"))
+    saver = autosaver.AutoSaver(config, 0.01)
+
+    saver.schedule()
+    time.sleep(0.3)
+
+    # Not retried until the next change
+    assert config.attempts == 1
+    assert saver.stats() == {"saves": 0, "failures": 1, "pending": True, "last_error": config.error}
+
+    config.error = None
+    saver.schedule()
+    time.sleep(0.3)
+    assert config.attempts == 2
+    assert saver.stats() == {"saves": 1, "failures": 1, "pending": False, "last_error": None}
+    saver.stop()
+
+
+def test_backoff():
+    config = FailingConfig(OSError("disk full"))
+    saver = autosaver.AutoSaver(config, 0.01)
+
+    saver.schedule()
+    time.sleep(0.5)
+
+    # 0.01, 0.02, 0.04, 0.08, 0.16, 0.32 ... instead of 50 attempts
+    assert 2 <= config.attempts <= 6
+    assert saver.stats()["pending"]
+
+    config.error = None
+    saver.stop()
+    assert saver.stats()["saves"] == 1
+
+
+def test_no_delay_error():
+    config = FailingConfig(OSError("disk full"))
+    saver = autosaver.AutoSaver(config, 0)
+
+    # Doesn't raise, the error is reported
+    saver.schedule()
+    assert saver.last_error is config.error
@@ -0,0 +1,140 @@
+""" Crash safe saving of the config"""
+import os
+import threading
+
+from spottelbot import botconfig
+
+
+class TestConfigAtomic(object):
+    @classmethod
+    def setup_class(cls):
+        cls._config_path = os.path.dirname(os.path.realpath(__file__))
+        cls._config_file_valid = os.path.join(cls._config_path, "valid.config")
+
+    def _saved_config(self, tmp_path, fsync=True):
+        config = botconfig.BotConfig(fsync=fsync)
+        config._load_config(self._config_file_valid)
+        config_file = str(tmp_path / "spottelbot.config")
+        config.save_config(config_file)
+        return config, config_file
+
+    def test_checksum(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+
+        with open(config_file) as the_file:
+            content = the_file.read()
+        assert content.startswith("# checksum")
+        assert config.load_config(config_file) is None
+        assert os.listdir(str(tmp_path)) == ["spottelbot.config"]
+
+    def test_backup(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path, fsync=False)
+        config.set_bookmark("new", "abcdef")
+        config.save_config(None)
+
+        assert sorted(os.listdir(str(tmp_path))) == ["spottelbot.config", "spottelbot.config.bak"]
+
+        reloaded = botconfig.BotConfig()
+        assert reloaded.load_config(config_file + ".bak") is None
+        assert "new" not in reloaded.get_bookmarks()
+
+    def test_torn_file(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+        config.set_bookmark("new", "abcdef")
+        config.save_config(None)
+
+        # Simulate a partially written file
+        with open(config_file) as the_file:
+            content = the_file.read()
+        with open(config_file, "w") as the_file:
+            the_file.write(content[:len(content) // 2])
+
+        reloaded = botconfig.BotConfig()
+        assert reloaded.load_config(config_file) is None
+        assert "alpha" in reloaded.get_bookmarks()
+
+    def test_torn_file_no_backup(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+
+        with open(config_file) as the_file:
+            content = the_file.read()
+        with open(config_file, "w") as the_file:
+            the_file.write(content[:-1])
+
+        assert botconfig.BotConfig().load_config(config_file) == "Corrupt config file " + config_file
+
+    def test_hand_edit_after_save(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+        config.set_bookmark("new", "abcdef")
+        config.save_config(None)
+
+        # Edited by hand, the checksum line hasn't been removed
+        with open(config_file) as the_file:
+            content = the_file.read()
+        with open(config_file, "w") as the_file:
+            the_file.write(content.replace("[bookmarks]\n", "[bookmarks]\nedited = 12345abcdef\n"))
+
+        reloaded = botconfig.BotConfig()
+        assert reloaded.load_config(config_file) is None
+        assert "edited" in reloaded.get_bookmarks()
+
+        # The edit is kept as the last good copy and the checksum is valid again
+        with open(config_file) as the_file:
+            assert botconfig._verify_checksum(the_file.read())
+        with open(config_file + ".bak") as the_file:
+            assert "edited = " in the_file.read()
+
+        reloaded.set_bookmark("other", "abcdef")
+        reloaded.save_config(None)
+        saved = botconfig.BotConfig()
+        assert saved.load_config(config_file) is None
+        assert {"edited", "other"} <= set(saved.get_bookmarks())
+
+    def test_hand_written_file(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+
+        # Edited by hand, checksum line removed
+        with open(config_file) as the_file:
+            content = the_file.read()
+        with open(config_file, "w") as the_file:
+            the_file.write(content.split("\n", 1)[1].replace("alpha", "beta"))
+
+        reloaded = botconfig.BotConfig()
+        assert reloaded.load_config(config_file) is None
+        assert "beta" in reloaded.get_bookmarks()
+        reloaded.save_config(None)
+
+    def test_permissions(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+        os.chmod(config_file, 0o640)
+        config.save_config(None)
+
+        assert os.stat(config_file).st_mode & 0o777 == 0o640
+
+    def test_save_doesnt_block(self, tmp_path):
+        config, config_file = self._saved_config(tmp_path)
+        writing = threading.Event()
+        written = threading.Event()
+        write_atomic = config._BotConfig__write_atomic
+
+        def slow_write(file_name, content):
+            writing.set()
+            written.wait(5)
+            write_atomic(file_name, content)
+
+        config._BotConfig__write_atomic = slow_write
+        saver = threading.Thread(target=config.save_config, args=(None,))
+        saver.start()
+        assert writing.wait(5)
+
+        # The config can be changed while it's written to the disk
+        changer = threading.Thread(target=config.set_bookmark, args=("new", "abcdef"))
+        changer.start()
+        changer.join(2)
+        assert not changer.is_alive()
+        written.set()
+        saver.join()
+
+        reloaded = botconfig.BotConfig()
+        assert reloaded.load_config(config_file) is None
+        assert "new" not in reloaded.get_bookmarks()
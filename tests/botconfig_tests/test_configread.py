@@ -141,3 +141,65 @@ def test_duplicate_configread():
     _config._load_config(_config_file_valid)
     _config._load_config(_config_file_valid)
     _config._load_config(_config_file_valid)
+
+
+def test_telegram_defaults():
+    _config._load_config(_config_file_valid)
+    assert _config.telegram_mode == botconfig.telegram_mode_polling
+    assert _config.workers == botconfig.default_workers
+    assert _config.webhook_url is None
+
+
+def test_telegram_webhook(tmp_path):
+    config_file = tmp_path / "webhook.config"
+    with open(_config_file_valid) as valid:
+        content = valid.read()
+    config_file.write_text(content.replace("[spotify]", "mode = webhook\nworkers = 8\nwebhook_port = 8080\n"
+                                                        "webhook_path = hook\n\n[spotify]"))
+
+    config = botconfig.BotConfig()
+    config._load_config(str(config_file))
+    assert config.telegram_mode == botconfig.telegram_mode_webhook
+    assert config.workers == 8
+    assert config.webhook_port == 8080
+    assert config.webhook_path == "hook"
+
+    config.save_config(None)
+    config._load_config(str(config_file))
+    assert config.telegram_mode == botconfig.telegram_mode_webhook
+    assert config.workers == 8
+
+
+def test_telegram_invalid_mode(tmp_path):
+    config_file = tmp_path / "invalidmode.config"
+    with open(_config_file_valid) as valid:
+        content = valid.read()
+    config_file.write_text(content.replace("[spotify]", "mode = carrier pigeon\n\n[spotify]"))
+
+    with pytest.raises(botexceptions.InvalidTelegramMode):
+        botconfig.BotConfig()._load_config(str(config_file))
+
+
+def test_limits(tmp_path):
+    config_file = tmp_path / "limits.config"
+    with open(_config_file_valid) as valid:
+        content = valid.read()
+    config_file.write_text(content + "\n[limits]\nlast = 2\nlist = 3\n")
+
+    config = botconfig.BotConfig()
+    config._load_config(str(config_file))
+    assert config.command_limits == {"last": 2, "list": 3}
+
+    config.command_limits = {"last": 1}
+    config.save_config(None)
+    config._load_config(str(config_file))
+    assert config.command_limits == {"last": 1}
+
+
+def test_invalid_limits(tmp_path):
+    config_file = tmp_path / "limits.config"
+    with open(_config_file_valid) as valid:
+        content = valid.read()
+    config_file.write_text(content + "\n[limits]\nlast = 0\n")
+
+    assert botconfig.BotConfig().load_config(str(config_file)).startswith("Invalid value")
@@ -0,0 +1,82 @@
+""" Tests of the per command limits"""
+
+import threading
+import time
+
+from spottelbot import commandlimiter
+
+
+def test_unlimited():
+    limiter = commandlimiter.CommandLimiter({}, 0)
+
+    assert limiter.acquire("help")
+    assert limiter.acquire("help")
+    assert limiter.stats()["help"]["running"] == 2
+
+    limiter.release("help")
+    limiter.release("help")
+    assert limiter.stats()["help"]["running"] == 0
+    assert limiter.stats()["help"]["calls"] == 2
+
+
+def test_rejected():
+    limiter = commandlimiter.CommandLimiter({"last": 1}, 0)
+
+    assert limiter.acquire("last")
+    assert not limiter.acquire("last")
+    # Other commands aren't affected
+    assert limiter.acquire("help")
+
+    stats = limiter.stats()["last"]
+    assert stats["limit"] == 1
+    assert stats["running"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_queued():
+    limiter = commandlimiter.CommandLimiter({"last": 1}, 5)
+    acquired = []
+
+    limiter.acquire("last")
+    thread = threading.Thread(target=lambda: acquired.append(limiter.acquire("last")))
+    thread.start()
+
+    time.sleep(0.1)
+    assert limiter.stats()["last"]["waiting"] == 1
+    limiter.release("last")
+    thread.join()
+
+    stats = limiter.stats()["last"]
+    assert acquired == [True]
+    assert stats["waiting"] == 0
+    assert stats["max_waiting"] == 1
+    assert stats["average_wait"] > 0
+
+
+def test_timeout():
+    limiter = commandlimiter.CommandLimiter({"last": 1}, 0.05)
+
+    limiter.acquire("last")
+    assert not limiter.acquire("last")
+    assert limiter.stats()["last"]["rejected"] == 1
+
+
+def test_max_occupied():
+    # 3 workers: one has to stay free for the other commands
+    limiter = commandlimiter.CommandLimiter({"last": 1}, 5, max_occupied=2)
+
+    limiter.acquire("last")
+    thread = threading.Thread(target=limiter.acquire, args=("last",))
+    thread.start()
+    time.sleep(0.1)
+
+    # The running and the waiting call occupy two workers, a further one is rejected at once
+    start = time.monotonic()
+    assert not limiter.acquire("last")
+    assert time.monotonic() - start < 1
+
+    limiter.release("last")
+    thread.join()
+    stats = limiter.stats()["last"]
+    assert stats["max_waiting"] == 1
+    assert stats["rejected"] == 1
@@ -0,0 +1,71 @@
+""" Tests of the local play history store"""
+import sqlite3
+
+import pytest
+
+from spottelbot import historystore
+from tests.testdata import mock_spotify_controller, play_history_object, track_uri
+
+
+@pytest.fixture
+def store(tmp_path):
+    the_store = historystore.HistoryStore(tmp_path / "history.sqlite")
+    yield the_store
+    the_store.close()
+
+
+def test_add_get(store):
+    context = {"type": "playlist", "uri": "spotify:playlist:abcdef", "href": "https://..."}
+    store.add([play_history_object(i, context) for i in range(9, -1, -1)])
+
+    assert len(store) == 10
+    newest = store.get(0, 0)[0]
+    assert newest["track"]["uri"] == track_uri(9)
+    assert newest["context"] == {"type": "playlist", "uri": "spotify:playlist:abcdef"}
+    assert [item["track"]["name"] for item in store.get(3, 5)] == \
+           [play_history_object(i)["track"]["name"] for i in (6, 5, 4)]
+
+
+def test_add_duplicates(store):
+    store.add([play_history_object(i) for i in range(0, 5)])
+    store.add([play_history_object(i) for i in range(3, 8)])
+
+    assert len(store) == 8
+
+
+def test_persistent(tmp_path):
+    the_store = historystore.HistoryStore(tmp_path / "history.sqlite")
+    the_store.add([play_history_object(1)])
+    the_store.close()
+
+    the_store = historystore.HistoryStore(tmp_path / "history.sqlite")
+    assert len(the_store) == 1
+    the_store.close()
+
+
+def test_controller_reaches_back(store):
+    controller = mock_spotify_controller(0, played=1000)
+    controller._history_store = store
+
+    # Seed the store with older plays
+    store.add([play_history_object(i) for i in range(800, 1000)])
+    assert controller.max_last_index() == 200
+
+    track_id, playlist_id = controller.get_last_index(150)
+    assert track_id == track_uri(850)
+
+    formatted = controller.get_last_tracks(45, 60)
+    assert len(formatted) == 16
+    assert formatted[0].startswith(play_history_object(955)["track"]["name"])
+
+
+def test_controller_closes_store(tmp_path):
+    the_store = historystore.HistoryStore(tmp_path / "history.sqlite")
+    controller = mock_spotify_controller()
+    controller._history_store = the_store
+
+    controller.close()
+
+    assert controller._history_store is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(the_store)
@@ -0,0 +1,40 @@
+""" The fast path for spotify's played_at timestamps"""
+import timeit
+
+import dateutil.parser
+import pytest
+
+from spottelbot import historystore
+
+
+@pytest.mark.parametrize("played_at", (
+        "2018-07-06T12:34:56.789Z",
+        "2018-07-06T12:34:56Z",
+        "2018-12-31T23:59:59.123456789Z",
+        "2018-07-06T12:34:56.7Z",
+        # Not spotify's format - handled by dateutil
+        "2018-07-06T12:34:56+02:00",
+        "2018-07-06",
+        "2018-07-06T12:34:56.Z"
+))
+def test_parse_played_at(played_at):
+    try:
+        expected = dateutil.parser.parse(played_at)
+    except ValueError:
+        with pytest.raises(ValueError):
+            historystore.parse_played_at(played_at)
+    else:
+        parsed = historystore.parse_played_at(played_at)
+        assert expected.replace(microsecond=0) == parsed.replace(microsecond=0)
+        assert abs(expected.microsecond - parsed.microsecond) <= 1
+
+
+# Micro benchmark: The fast path should easily beat dateutil
+def test_parse_played_at_benchmark():
+    played_at = "2018-07-06T12:34:56.789Z"
+    number = 2000
+
+    fast = min(timeit.repeat(lambda: historystore.parse_played_at(played_at), number=number, repeat=3))
+    generic = min(timeit.repeat(lambda: dateutil.parser.parse(played_at), number=number, repeat=3))
+
+    assert fast < generic
@@ -0,0 +1,102 @@
+""" Tests of the metadata cache"""
+
+import time
+
+from spottelbot import metadatacache
+
+
+def test_lru():
+    cache = metadatacache.MetadataCache(2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_max_bytes():
+    cache = metadatacache.MetadataCache(100, max_bytes=25)
+    cache.set("a", "x" * 10)
+    cache.set("b", "x" * 10)
+    assert len(cache) == 2
+
+    cache.set("c", "x" * 10)
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] <= 25
+
+
+def test_ttl():
+    cache = metadatacache.MetadataCache(10, ttl=0.05)
+    cache.set("a", "1")
+    cache.set("b", "2", ttl=None)
+    assert cache.get("a") == "1"
+
+    time.sleep(0.1)
+
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == "1"
+    assert cache.get("b") == "2"
+
+    cache.touch("a")
+    assert cache.get("a") == "1"
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["revalidations"] == 1
+
+
+def test_invalidate():
+    cache = metadatacache.MetadataCache(10)
+    cache.set("a", {"name": "playlist"})
+    cache.invalidate("a")
+
+    assert cache.get_stale("a") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_store(tmp_path):
+    file_name = str(tmp_path / "metadata.sqlite")
+    store = metadatacache.MetadataStore(file_name, 10)
+    cache = metadatacache.MetadataCache(10, ttl=60, store=store)
+    cache.set("a", {"name": "playlist"})
+    cache.set("b", "track", ttl=None)
+    cache.set("c", "track")
+    cache.invalidate("c")
+    store.close()
+
+    cache = metadatacache.MetadataCache(10, ttl=60, store=metadatacache.MetadataStore(file_name, 10))
+    assert len(cache) == 0
+    assert cache.get("a") == {"name": "playlist"}
+    assert cache.get("b") == "track"
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_store_expired(tmp_path):
+    file_name = str(tmp_path / "metadata.sqlite")
+    store = metadatacache.MetadataStore(file_name, 10)
+    metadatacache.MetadataCache(10, ttl=0, store=store).set("a", "1")
+    store.close()
+
+    cache = metadatacache.MetadataCache(10, store=metadatacache.MetadataStore(file_name, 10))
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == "1"
+
+
+def test_store_maxsize(tmp_path):
+    file_name = str(tmp_path / "metadata.sqlite")
+    store = metadatacache.MetadataStore(file_name, 10)
+    cache = metadatacache.MetadataCache(10, store=store)
+    for i in range(0, 10):
+        cache.set(str(i), i)
+        store.flush()
+    store.close()
+
+    cache = metadatacache.MetadataCache(10, store=metadatacache.MetadataStore(file_name, 5))
+    assert cache.get("0") is None
+    assert cache.get("9") == 9
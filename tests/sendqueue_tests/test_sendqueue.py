@@ -0,0 +1,127 @@
+""" Tests of the outbound message queue"""
+import threading
+import time
+
+import telegram.error
+
+from spottelbot import sendqueue
+
+
+class MockBot(object):
+    def __init__(self, errors=()):
+        self.messages = []
+        self.times = []
+        self.errors = list(errors)
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.messages.append((chat_id, text))
+            self.times.append(time.monotonic())
+
+
+def test_send():
+    bot = MockBot()
+    queue = sendqueue.SendQueue(bot, 4096)
+
+    queue.send_message(chat_id=1, text="hello")
+    assert queue.flush(5)
+    queue.stop()
+
+    assert bot.messages == [(1, "hello")]
+    assert queue.stats()["sent"] == 1
+
+
+def test_merge():
+    bot = MockBot()
+    queue = sendqueue.SendQueue(bot, 4096)
+
+    # Holding the lock makes the messages pile up
+    with queue._condition:
+        for i in range(0, 5):
+            queue.send_message(chat_id=1, text="line {}\n".format(i))
+        queue.send_message(chat_id=1, text="markdown", parse_mode="Markdown")
+    assert queue.flush(5)
+    queue.stop()
+
+    assert bot.messages == [(1, "".join("line {}\n".format(i) for i in range(0, 5))), (1, "markdown")]
+    assert queue.stats()["merged"] == 4
+
+
+def test_merge_max_length():
+    bot = MockBot()
+    queue = sendqueue.SendQueue(bot, 100)
+
+    with queue._condition:
+        for i in range(0, 3):
+            queue.send_message(chat_id=1, text="x" * 40 + "\n")
+    assert queue.flush(5)
+    queue.stop()
+
+    assert [len(text) for chat_id, text in bot.messages] == [82, 41]
+
+
+def test_chat_rate(monkeypatch):
+    monkeypatch.setattr(sendqueue, "chat_rate", 20.0)
+    monkeypatch.setattr(sendqueue, "chat_burst", 1)
+    bot = MockBot()
+    queue = sendqueue.SendQueue(bot, 10)
+
+    with queue._condition:
+        for i in range(0, 5):
+            # Too long to be merged
+            queue.send_message(chat_id=1, text="message {}".format(i))
+        queue.send_message(chat_id=2, text="other chat")
+    assert queue.flush(5)
+    queue.stop()
+
+    chat_times = [t for (chat_id, text), t in zip(bot.messages, bot.times) if chat_id == 1]
+    assert [text for chat_id, text in bot.messages if chat_id == 1] == ["message {}".format(i) for i in range(0, 5)]
+    assert chat_times[-1] - chat_times[0] >= 4 / 20.0 * 0.9
+    # The other chat doesn't have to wait for chat 1
+    assert bot.messages.index((2, "other chat")) < 4
+
+
+def test_retry_after():
+    bot = MockBot([telegram.error.RetryAfter(0.2)])
+    queue = sendqueue.SendQueue(bot, 4096)
+
+    start = time.monotonic()
+    queue.send_message(chat_id=1, text="first")
+    queue.send_message(chat_id=1, text="second", parse_mode="Markdown")
+    assert queue.flush(5)
+    queue.stop()
+
+    assert bot.messages == [(1, "first"), (1, "second")]
+    assert bot.times[0] - start >= 0.2
+    assert queue.stats()["retried"] == 1
+
+
+def test_failed():
+    bot = MockBot([telegram.error.BadRequest("bad")])
+    queue = sendqueue.SendQueue(bot, 4096)
+
+    queue.send_message(chat_id=1, text="first")
+    queue.send_message(chat_id=1, text="second", parse_mode="Markdown")
+    assert queue.flush(5)
+    queue.stop()
+
+    assert bot.messages == [(1, "second")]
+    assert queue.stats()["failed"] == 1
+
+
+def test_timed_out():
+    bot = MockBot([telegram.error.TimedOut()])
+    queue = sendqueue.SendQueue(bot, 4096)
+
+    queue.send_message(chat_id=1, text="first")
+    queue.send_message(chat_id=1, text="second", parse_mode="Markdown")
+    assert queue.flush(5)
+    queue.stop()
+
+    # Not sent again, telegram may have received it
+    assert bot.messages == [(1, "second")]
+    assert queue.stats()["timed_out"] == 1
+    assert queue.stats()["retried"] == 0
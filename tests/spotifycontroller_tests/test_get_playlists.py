@@ -0,0 +1,76 @@
+""" Tests of the parallel playlist lookup"""
+
+import time
+
+from tests.testdata import mock_spotify_controller, playlist_uri, track_uri
+
+delay = 0.1
+
+
+def _controller():
+    return mock_spotify_controller(played=50, playlists=10, delay=delay)
+
+
+def test_get_playlists_parallel():
+    controller = _controller()
+    uris = [playlist_uri(i) for i in range(0, 8)]
+
+    start = time.monotonic()
+    names = controller.get_playlists(uris + uris)
+    elapsed = time.monotonic() - start
+
+    assert sorted(controller._client.requested_playlists) == uris
+    assert names == {uri: "name of " + uri for uri in uris}
+    assert elapsed < len(uris) * delay / 2
+
+
+def test_get_last_tracks_playlists():
+    controller = _controller()
+
+    formatted = controller.get_last_tracks(1, 20)
+
+    assert len(controller._client.requested_playlists) == 10
+    # Most recently played first: The fourth track is track 46
+    assert "(Playlist: name of {})".format(playlist_uri(6)) in formatted[3]
+
+
+def test_get_playlist_cached():
+    controller = _controller()
+
+    controller.get_playlist(playlist_uri(1))
+    controller.get_playlist(playlist_uri(1))
+
+    assert controller._client.requested_playlists == [playlist_uri(1)]
+
+
+def test_get_playlist_revalidated():
+    controller = _controller()
+    controller._config._spotify_playlist_ttl = 0
+
+    controller.get_playlist(playlist_uri(1))
+    controller.get_playlist(playlist_uri(1))
+    assert controller._client.playlist_fields == ["name,snapshot_id", "snapshot_id"]
+
+    controller._client.snapshot_id = "2"
+    controller.get_playlist(playlist_uri(1))
+    assert controller._client.playlist_fields == ["name,snapshot_id", "snapshot_id", "snapshot_id", "name,snapshot_id"]
+
+
+def test_get_current_playlist():
+    controller = _controller()
+    controller._client.current_context = {"type": "playlist", "uri": playlist_uri(3)}
+
+    formatted = controller.get_current()
+
+    assert "(Playlist: name of {})".format(playlist_uri(3)) in formatted
+    assert controller.get_current(formatted=False) == (track_uri(1), playlist_uri(3))
+
+
+def test_get_current_album():
+    controller = _controller()
+    controller._client.current_context = {"type": "album", "uri": "spotify:album:1"}
+
+    formatted = controller.get_current()
+
+    assert "Playlist" not in formatted
+    assert controller._client.requested_playlists == []
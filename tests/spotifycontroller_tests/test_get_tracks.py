@@ -0,0 +1,98 @@
+""" Tests of the bulk track resolution"""
+
+import spotipy.spotipy.client as cl
+from spottelbot import spotifycontroller, botconfig, metadatacache
+from tests.testdata import mock_spotify_controller, track_uri, track_object
+
+
+class MockServer(object):
+    """ Replaces the spotify client's _internal_call """
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.requested = []
+
+    def __call__(self, method, url, payload, params, deadline=None):
+        ids = url.split("?ids=")[1].split(",")
+        self.requested.append(ids)
+        if self.fail in ids:
+            raise cl.SpotifyException(404, -1, "not found")
+        return {"tracks": [track_object("spotify:track:" + track_id) for track_id in ids]}
+
+
+def _client_controller(server):
+    controller = spotifycontroller.SpotifyController(botconfig.BotConfig())
+    controller._client = cl.Spotify(auth="TOKEN", coalesce_requests=False,
+                                    chunk_concurrency=spotifycontroller.chunk_concurrency)
+    controller._client._internal_call = server
+    return controller
+
+
+def test_get_tracks_chunked():
+    server = MockServer()
+    controller = _client_controller(server)
+    uris = [track_uri(i) for i in range(0, 2 * cl.Spotify.tracks_limit + 10)]
+
+    formatted = controller.get_tracks(uris)
+
+    assert len(server.requested) == 3
+    assert max(len(chunk) for chunk in server.requested) == cl.Spotify.tracks_limit
+    assert set(formatted.keys()) == set(uris)
+    assert formatted[uris[0]].startswith(uris[0])
+
+
+def test_get_tracks_partial_failure():
+    uris = [track_uri(i) for i in range(0, 2 * cl.Spotify.tracks_limit)]
+    server = MockServer(fail=uris[0].split(":")[2])
+    controller = _client_controller(server)
+
+    formatted = controller.get_tracks(uris)
+
+    assert formatted[uris[0]] == "<unknown>"
+    assert formatted[uris[-1]].startswith(uris[-1])
+
+    # The failed tracks are fetched again
+    server.fail = None
+    server.requested = []
+    controller.get_tracks(uris)
+    assert server.requested == [[uri.split(":")[2] for uri in uris[:cl.Spotify.tracks_limit]]]
+
+
+def test_get_tracks_cached():
+    controller = mock_spotify_controller()
+    uris = [track_uri(i) for i in range(0, 10)]
+
+    controller.get_tracks(uris[:5])
+    controller.get_tracks(uris)
+
+    assert controller._client.requested_tracks == [uris[:5], uris[5:]]
+
+    controller.get_track(uris[7])
+    assert len(controller._client.requested_tracks) == 2
+
+
+def test_get_tracks_duplicates():
+    controller = mock_spotify_controller()
+
+    controller.get_tracks([track_uri(1), track_uri(1), track_uri(2)])
+
+    assert controller._client.requested_tracks == [[track_uri(1), track_uri(2)]]
+
+
+def test_get_tracks_persistent(tmp_path):
+    file_name = str(tmp_path / "metadata.sqlite")
+    uris = [track_uri(i) for i in range(0, 10)]
+
+    controller = mock_spotify_controller()
+    store = metadatacache.MetadataStore(file_name, spotifycontroller.metadata_cache_size)
+    controller._metadata_cache = metadatacache.MetadataCache(spotifycontroller.metadata_cache_size, store=store)
+    formatted = controller.get_tracks(uris)
+    controller.close()
+
+    # After a restart
+    controller = mock_spotify_controller()
+    store = metadatacache.MetadataStore(file_name, spotifycontroller.metadata_cache_size)
+    controller._metadata_cache = metadatacache.MetadataCache(spotifycontroller.metadata_cache_size, store=store)
+
+    assert controller.get_tracks(uris) == formatted
+    assert controller._client.requested_tracks == []
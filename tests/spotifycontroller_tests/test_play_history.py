@@ -0,0 +1,97 @@
+""" Tests of the recently played snapshot"""
+
+import threading
+
+from spottelbot import spotifycontroller
+from tests.testdata import mock_spotify_controller, track_uri
+
+
+def test_snapshot_shared():
+    controller = mock_spotify_controller(60, played=100)
+
+    controller.get_last_tracks(1, 5)
+    track_id, playlist_id = controller.get_last_index(7)
+    controller.get_last_index(spotifycontroller.last_limit)
+
+    assert controller._client.history_calls == 1
+    assert track_id == track_uri(93)
+    assert playlist_id is None
+
+
+def test_snapshot_invalidate():
+    controller = mock_spotify_controller(60, played=10)
+
+    controller.get_last_index(1)
+    controller.invalidate_play_history()
+    controller.get_last_index(1)
+
+    assert controller._client.history_calls == 2
+
+
+def test_fetch_outside_lock():
+    controller = mock_spotify_controller(60, played=10)
+    client = controller._client
+    fetching = threading.Event()
+    release = threading.Event()
+    recently_played = client.current_user_recently_played
+
+    def slow_recently_played(limit=50, after=None, before=None):
+        fetching.set()
+        release.wait(5)
+        return recently_played(limit, after, before)
+
+    client.current_user_recently_played = slow_recently_played
+    threads = [threading.Thread(target=controller.get_last_index, args=(1,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert fetching.wait(5)
+
+    # The lock isn't held during the request
+    assert controller._play_history_lock.acquire(timeout=1)
+    controller._play_history_lock.release()
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert client.history_calls == 1
+
+
+def test_stop_poller_invalidates():
+    controller = mock_spotify_controller(60, played=10)
+
+    controller.get_last_index(1)
+    controller.start_play_history_poller(60)
+    controller.stop_play_history_poller()
+    controller.get_last_index(1)
+
+    # Snapshot, first poll, new snapshot
+    assert controller._client.history_calls == 3
+
+
+def test_snapshot_disabled():
+    controller = mock_spotify_controller(0, played=10)
+
+    controller.get_last_index(1)
+    controller.get_last_index(1)
+
+    assert controller._client.history_calls == 2
+
+
+def test_poll_incremental():
+    controller = mock_spotify_controller(0)
+    client = controller._client
+
+    client.played = 60
+    controller._poll_play_history()
+    client.played = 63
+    controller._poll_play_history()
+    controller._poll_play_history()
+
+    assert client.cursors == [None, "59", "62"]
+
+    calls = client.history_calls
+    track_id, playlist_id = controller.get_last_index(1)
+    assert track_id == track_uri(62)
+    track_id, playlist_id = controller.get_last_index(spotifycontroller.last_limit)
+    assert track_id == track_uri(63 - spotifycontroller.last_limit)
+    assert client.history_calls == calls
@@ -0,0 +1,76 @@
+""" Tests of the command dispatching (commands run in the workers, limited per command)"""
+import threading
+import time
+
+from spottelbot import spotifycontroller
+from tests.testdata import webhook_bot
+
+delay = 1
+
+
+class SlowSpotifyController(spotifycontroller.SpotifyController):
+    def __init__(self, config):
+        super().__init__(config)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def get_last_tracks(self, lower: int, upper: int):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+        return ["track"]
+
+
+def _running_at_whoami(webhook_bot, spotify_controller):
+    running_at_whoami = []
+
+    def on_send(text):
+        if "You are" in text:
+            running_at_whoami.append(spotify_controller.running)
+
+    webhook_bot.on_send = on_send
+    return running_at_whoami
+
+
+def test_dispatch_parallel(webhook_bot):
+    webhook_bot.config.workers = 4
+    spotify_controller = SlowSpotifyController(webhook_bot.config)
+    running_at_whoami = _running_at_whoami(webhook_bot, spotify_controller)
+    webhook_bot.connect(spotify_controller)
+
+    for update_id in range(1, 4):
+        assert webhook_bot.post(update_id, "/last") == 200
+    assert webhook_bot.post(4, "/whoami") == 200
+
+    assert webhook_bot.wait_for(lambda texts: texts.count("*1*: track") == 3 and "You are" in texts)
+    # The commands run in the workers, not one after the other
+    assert spotify_controller.max_running == 3
+    # /whoami didn't have to wait for /last
+    assert running_at_whoami and running_at_whoami[0] > 0
+
+
+def test_dispatch_limited(webhook_bot):
+    webhook_bot.config.workers = 4
+    webhook_bot.config.command_limits = {"last": 2}
+    spotify_controller = SlowSpotifyController(webhook_bot.config)
+    running_at_whoami = _running_at_whoami(webhook_bot, spotify_controller)
+    webhook_bot.connect(spotify_controller)
+
+    for update_id in range(1, 5):
+        assert webhook_bot.post(update_id, "/last") == 200
+    assert webhook_bot.post(5, "/whoami") == 200
+
+    assert webhook_bot.wait_for(lambda texts: texts.count("*1*: track") == 2 and texts.count("Too busy") == 2 and
+                                "You are" in texts)
+    # Two /last at the same time, the others were rejected at once
+    assert spotify_controller.max_running == 2
+    # /whoami didn't have to wait for them
+    assert running_at_whoami and running_at_whoami[0] > 0
+
+    stats = webhook_bot.controller._command_limiter.stats()["last"]
+    assert stats["calls"] == 2
+    assert stats["rejected"] == 2
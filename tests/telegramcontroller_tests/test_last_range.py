@@ -27,3 +27,20 @@ def test_last_range(value, expected, exception_expected):
             telegramcontroller.last_range(value)
     else:
         assert expected == telegramcontroller.last_range(value)
+
+
+# /last with a local history store reaching back further than last_limit
+@pytest.mark.parametrize("value, expected, exception_expected", (
+        (["100-120"], (100, 120), False),
+        (["60-"], (60, 60 + spotifycontroller.last_limit - 1), False),
+        (["480-"], (480, 500), False),
+        (["-"], (1, spotifycontroller.last_limit), False),
+        (["100"], (1, spotifycontroller.last_limit), False),
+        (["501"], None, True)
+))
+def test_last_range_limit(value, expected, exception_expected):
+    if exception_expected:
+        with pytest.raises(botexceptions.InvalidRange):
+            telegramcontroller.last_range(value, 500)
+    else:
+        assert expected == telegramcontroller.last_range(value, 500)
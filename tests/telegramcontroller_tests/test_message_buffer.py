@@ -0,0 +1,85 @@
+""" Tests of the per command message buffer"""
+import threading
+
+import pytest
+
+from spottelbot import botexceptions, telegramcontroller
+
+
+class MockBot(object):
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+
+def test_single_message():
+    bot = MockBot()
+    message_buffer = telegramcontroller.MessageBuffer(bot, 1)
+
+    for i in range(0, 10):
+        message_buffer.append("line {}\n".format(i))
+    message_buffer.flush()
+
+    assert bot.messages == [(1, "".join("line {}\n".format(i) for i in range(0, 10)))]
+
+
+def test_split_messages():
+    bot = MockBot()
+    message_buffer = telegramcontroller.MessageBuffer(bot, 1)
+    line = "x" * 99 + "\n"
+    count = 3 * telegramcontroller.max_message_length // len(line)
+
+    for i in range(0, count):
+        message_buffer.append(line)
+    message_buffer.flush()
+
+    assert len(bot.messages) > 1
+    assert all(len(text) < telegramcontroller.max_message_length for chat_id, text in bot.messages)
+    assert "".join(text for chat_id, text in bot.messages) == line * count
+
+
+def test_split_long_text():
+    bot = MockBot()
+    message_buffer = telegramcontroller.MessageBuffer(bot, 1)
+    text = ("y" * 999 + "\n") * 10
+
+    message_buffer.append(text)
+    message_buffer.flush()
+
+    assert len(bot.messages) == 3
+    assert "".join(text for chat_id, text in bot.messages) == text
+
+
+def test_line_too_long():
+    message_buffer = telegramcontroller.MessageBuffer(MockBot(), 1)
+
+    with pytest.raises(botexceptions.TelegramMessageLength):
+        message_buffer.append("z" * telegramcontroller.max_message_length)
+
+
+def test_empty_flush():
+    bot = MockBot()
+    telegramcontroller.MessageBuffer(bot, 1).flush()
+
+    assert bot.messages == []
+
+
+def test_concurrent_buffers():
+    bot = MockBot()
+
+    def reply(chat_id):
+        message_buffer = telegramcontroller.MessageBuffer(bot, chat_id)
+        for i in range(0, 1000):
+            message_buffer.append("{}\n".format(chat_id))
+        message_buffer.flush()
+
+    threads = [threading.Thread(target=reply, args=(chat_id,)) for chat_id in range(0, 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for chat_id, text in bot.messages:
+        assert set(text.split()) == {str(chat_id)}
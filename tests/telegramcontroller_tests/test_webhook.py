@@ -0,0 +1,28 @@
+""" Tests of the webhook mode (offline: the updates are posted to the local listener)"""
+
+from tests.testdata import webhook_bot
+
+
+def test_webhook(webhook_bot):
+    webhook_bot.connect()
+
+    assert webhook_bot.post(1, "/whoami") == 200
+    assert webhook_bot.wait_for(lambda texts: texts, 5)
+    assert webhook_bot.sent == [(12354, "You are @myaccount (12354)")]
+
+
+def test_save_error(webhook_bot):
+    def save_config(configfile_name):
+        raise PermissionError("read only")
+
+    webhook_bot.config.autosave_delay = 0
+    webhook_bot.config.save_config = save_config
+    webhook_bot.connect()
+
+    # The user is told the change can't be saved
+    assert webhook_bot.post(1, "/clear all") == 200
+    assert webhook_bot.wait_for(lambda texts: "Warning: the config can't be saved (read only)" in texts)
+
+    assert webhook_bot.post(2, "/stats") == 200
+    assert webhook_bot.wait_for(lambda texts: "*Config*: 0 saves, 1 failed, unsaved changes, last error: read only"
+                                in texts)
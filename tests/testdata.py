@@ -1,8 +1,18 @@
 """Test data to share - do not repeat yourself"""
 
+import atexit
+import datetime
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
 import pytest
+import telegram.utils.request
 
-from spottelbot import telegramcontroller, botconfig
+from spottelbot import telegramcontroller, botconfig, spotifycontroller
 
 
 # Test data for access
@@ -52,3 +62,179 @@ class TestBookmarkData(object):
         for entry in cls._test_data:
             name, title_id, playlist_id = entry
             cls._test_config.set_bookmark(name, title_id, playlist_id)
+
+
+# A spotify client answering with generated tracks, playlists and play history objects
+
+# The context of play history objects can't be resolved to a playlist name without a username
+spotify_username = "user"
+
+
+def track_uri(index):
+    return "spotify:track:{:016d}".format(index)
+
+
+def playlist_uri(index):
+    return "spotify:user:{}:playlist:{:016d}".format(spotify_username, index)
+
+
+def track_object(uri):
+    return {"name": uri, "artists": [{"name": "artist"}], "album": {"name": "album"}, "uri": uri, "popularity": 42}
+
+
+def play_history_object(index, context=None):
+    # Every track was played a minute after the previous one
+    played_at = datetime.datetime(2018, 7, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=index)
+    return {"track": track_object(track_uri(index)), "context": context,
+            "played_at": played_at.strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+
+
+class MockSpotifyClient(object):
+    """ Replaces spotipy's client. Tracks 0 to played - 1 have been played, track n in playlist n % playlists """
+
+    def __init__(self, played=0, playlists=0, delay=0.0):
+        self.played = played
+        self.playlists = playlists
+        # Seconds a playlist lookup takes
+        self.delay = delay
+        self.snapshot_id = "1"
+        self.current_context = None
+
+        self.history_calls = 0
+        self.cursors = []
+        self.requested_tracks = []
+        self.requested_playlists = []
+        self.playlist_fields = []
+        self.lock = threading.Lock()
+
+    def __context(self, index):
+        if not self.playlists:
+            return None
+        return {"type": "playlist", "uri": playlist_uri(index % self.playlists)}
+
+    def current_user_recently_played(self, limit=50, after=None, before=None):
+        with self.lock:
+            self.history_calls += 1
+            self.cursors.append(after)
+        first = self.played - 1
+        last = max(-1, first - limit) if after is None else int(after)
+        items = [play_history_object(i, self.__context(i)) for i in range(first, last, -1)]
+        return {"items": items, "cursors": {"after": str(first), "before": str(last + 1)} if items else None}
+
+    def current_user_playing_track(self):
+        return {"item": track_object(track_uri(1)), "context": self.current_context}
+
+    def tracks(self, tracks):
+        with self.lock:
+            self.requested_tracks.append(list(tracks))
+        return {"tracks": [track_object(uri) for uri in tracks]}
+
+    def user_playlist(self, user, playlist_id=None, fields=None):
+        with self.lock:
+            self.requested_playlists.append(playlist_id)
+            self.playlist_fields.append(fields)
+        time.sleep(self.delay)
+        return {"name": "name of " + playlist_id, "snapshot_id": self.snapshot_id}
+
+
+def mock_spotify_controller(history_ttl=None, **kwargs):
+    """ A SpotifyController using a MockSpotifyClient (created with kwargs) """
+    config = botconfig.BotConfig()
+    config._spotify_username = spotify_username
+    if history_ttl is not None:
+        config._spotify_history_ttl = history_ttl
+    controller = spotifycontroller.SpotifyController(config)
+    controller._client = MockSpotifyClient(**kwargs)
+    return controller
+
+
+# A bot in webhook mode (offline: the updates are posted to the local listener, the requests to telegram's bot API
+# are replaced)
+
+_token = "110201543:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+
+
+def _free_port():
+    with socket.socket() as the_socket:
+        the_socket.bind(("127.0.0.1", 0))
+        return the_socket.getsockname()[1]
+
+
+def _update(update_id, text):
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                        "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+                        "chat": {"id": 12354, "type": "private"},
+                        "from": {"id": 12354, "is_bot": False, "first_name": "Test", "username": "myaccount"}}}
+
+
+class WebhookBot(object):
+    def __init__(self, monkeypatch):
+        # (chat_id, text) of the messages sent
+        self.sent = []
+        # Called with the text of every message sent
+        self.on_send = None
+        self.controller = None
+        self._condition = threading.Condition()
+
+        monkeypatch.setattr(telegram.utils.request.Request, "get", self.__request)
+        monkeypatch.setattr(telegram.utils.request.Request, "post", self.__request)
+
+        self.config = botconfig.BotConfig()
+        self.config.telegram_token = _token
+        self.config.add_access("@myaccount")
+        self.config.telegram_mode = botconfig.telegram_mode_webhook
+        self.config.webhook_port = _free_port()
+        self.config.webhook_path = "hook"
+
+    # Replaces Request.get and Request.post
+    def __request(self, url, data=None, timeout=None):
+        method = url.rsplit("/", 1)[-1]
+        if method == "getMe":
+            return {"id": 110201543, "is_bot": True, "first_name": "bot", "username": "bot"}
+        if method == "sendMessage":
+            if self.on_send:
+                self.on_send(data["text"])
+            with self._condition:
+                self.sent.append((data["chat_id"], data["text"]))
+                self._condition.notify_all()
+            return _update(100, data["text"])["message"]
+        return []
+
+    def connect(self, spotify_controller: spotifycontroller.SpotifyController = None):
+        if spotify_controller is None:
+            spotify_controller = spotifycontroller.SpotifyController(self.config)
+        self.controller = telegramcontroller.TelegramController(self.config, spotify_controller)
+        self.controller.connect()
+
+    def post(self, update_id, text):
+        url = "http://127.0.0.1:{}/hook".format(self.config.webhook_port)
+        data = json.dumps(_update(update_id, text)).encode()
+
+        # The listener is started in the background
+        for i in range(0, 50):
+            try:
+                request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+                return urllib.request.urlopen(request, timeout=5).status
+            except urllib.error.URLError:
+                time.sleep(0.1)
+        raise TimeoutError(url)
+
+    # Waits until predicate(texts of the messages sent so far) is true
+    def wait_for(self, predicate, timeout=10):
+        with self._condition:
+            return self._condition.wait_for(lambda: predicate("\n".join(text for chat_id, text in self.sent)),
+                                            timeout)
+
+    def stop(self):
+        if self.controller:
+            self.controller._updater.stop()
+            self.controller._send_queue.stop()
+            atexit.unregister(self.controller._autosaver.stop)
+
+
+@pytest.fixture
+def webhook_bot(monkeypatch):
+    bot = WebhookBot(monkeypatch)
+    yield bot
+    bot.stop()